@@ -0,0 +1,262 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from metrics import Counter, Histogram
+
+
+# Admission control for the requests that cost the most: the booking login (a database
+# lookup per guess of booking number and surname) and the forms that book, change or
+# cancel (each one waits for the SQLite write lock). Two checks, in this order:
+# - a token bucket per client and policy: `rate` requests a second on average and up to
+#   `burst` at once, past that 429 with Retry-After. The buckets are kept in a SQLite
+#   file every worker shares (ADMISSION_BACKEND="sqlite") or in the process ("memory").
+# - a concurrency limit per policy and worker: at most `concurrency` of its requests run
+#   at once, a request that would wait longer than `max_wait` seconds for one of them is
+#   turned away at once with 503 instead of queueing behind the others.
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+@dataclass(frozen=True)
+class Policy:
+    name: str
+    routes: tuple  # <-- ("METHOD", endpoint) pairs the policy applies to
+    rate: float  # <-- requests a second one client can make on average
+    burst: int  # <-- requests one client can make at once
+    concurrency: int  # <-- requests running at once in one worker, 0 for no limit
+    max_wait: float  # <-- seconds a request may wait for one of those before it is shed
+
+
+DEFAULT_POLICIES = (
+    # every lookup by number and surname, 10 a minute after the first 10
+    Policy("login", (("POST", "login_booking"), ("GET", "api.booking"), ("PATCH", "api.booking"), ("DELETE", "api.booking")),
+           rate=1 / 6, burst=10, concurrency=8, max_wait=0.25),
+    # the writes: booking a room, the customer details, a change and a cancellation
+    Policy("booking", (("POST", "room_detail"), ("POST", "details"),
+                       ("POST", "change_booking_confirmation"), ("GET", "cancel_booking"), ("POST", "api.create_booking")),
+           rate=1.0, burst=20, concurrency=2, max_wait=0.5),
+)
+
+
+def policies_from_config(config):
+    # ADMISSION_POLICIES changes the numbers of a default policy, e.g. {"login": {"rate": 0.5, "burst": 20}}
+    overrides = config.get("ADMISSION_POLICIES") or {}
+    unknown = set(overrides) - {policy.name for policy in DEFAULT_POLICIES}
+    if unknown:
+        raise ValueError(f"unknown ADMISSION_POLICIES {sorted(unknown)}, use 'login' or 'booking'")
+    return tuple(replace(policy, **overrides.get(policy.name, {})) for policy in DEFAULT_POLICIES)
+
+
+class MemoryBuckets:
+    """Token buckets in this process, dropping the least recently used ones past max_entries.
+
+    Only suitable for a single worker, every worker counts on its own. A dropped
+    bucket comes back full, like the bucket of a client that stayed away.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # <-- key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        # 0.0 when a token was taken, otherwise the seconds until there is one
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            admitted = tokens >= 1
+            if admitted:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return 0.0 if admitted else (1 - tokens) / rate
+
+
+class SQLiteBuckets:
+    """Token buckets in their own SQLite file so every worker on the host shares them.
+
+    A bucket is read, refilled and taken from by a single UPSERT, so two workers never
+    both spend the last token. Buckets idle for max_idle seconds are full again and are
+    deleted at most once every sweep_interval seconds, piggybacking on a take.
+    """
+
+    TAKE = (
+        "INSERT INTO buckets (key, tokens, updated, admitted) VALUES (:key, :burst - 1, :now, 1) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "tokens = min(:burst, tokens + max(0, :now - updated) * :rate) - (min(:burst, tokens + max(0, :now - updated) * :rate) >= 1), "
+        "updated = max(updated, :now), "
+        "admitted = min(:burst, tokens + max(0, :now - updated) * :rate) >= 1 "
+        "RETURNING admitted, tokens"
+    )  # <-- every expression of the SET sees the row as it was before the update
+
+    def __init__(self, path, max_idle=3600, sweep_interval=300):
+        self.path = path
+        self.max_idle = max_idle
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._next_sweep = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _connect(self):
+        # like the session store, the file is only opened by the first take() of each thread
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=OFF")  # <-- losing the last buckets in a power cut only gives them back full
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, "
+                "admitted INTEGER NOT NULL) WITHOUT ROWID"
+            )
+        return connection
+
+    @property
+    def connection(self):
+        # one connection per thread, sqlite3 connections are not shared between threads
+        if getattr(self._local, "pid", None) != os.getpid():  # <-- a forked worker opens its own
+            self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def take(self, key, rate, burst):
+        # 0.0 when a token was taken, otherwise the seconds until there is one
+        now = time.time()  # <-- the wall clock, the workers share it
+        with self.connection as connection:
+            admitted, tokens = connection.execute(self.TAKE, {"key": key, "rate": rate, "burst": burst, "now": now}).fetchone()
+        if now >= self._next_sweep:
+            self.sweep()
+        return 0.0 if admitted else (1 - tokens) / rate
+
+    def sweep(self):
+        self._next_sweep = time.time() + self.sweep_interval
+        with self.connection as connection:
+            return connection.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - self.max_idle,)).rowcount
+
+
+def buckets_from_config(config, max_idle=3600):
+    backend = config.get("ADMISSION_BACKEND", "sqlite")
+    if backend == "memory":
+        return MemoryBuckets(int(config.get("ADMISSION_MEMORY_MAX_ENTRIES", 100000)))
+    if backend == "sqlite":
+        return SQLiteBuckets(config.get("ADMISSION_SQLITE_PATH", "instance/admission.db"), max_idle=max_idle)
+    raise ValueError(f"unknown ADMISSION_BACKEND {backend!r}, use 'sqlite' or 'memory'")
+
+
+class ConcurrencyLimit:
+    """At most `limit` requests of one policy running at once in this worker."""
+
+    def __init__(self, limit, max_wait):
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def acquire(self):
+        # the seconds waited for a slot, None when none came free within max_wait
+        if self._slots.acquire(blocking=False):
+            return 0.0
+        started = time.perf_counter()
+        if self._slots.acquire(timeout=self.max_wait):
+            return time.perf_counter() - started
+        return None
+
+    def release(self):
+        self._slots.release()
+
+
+class AdmissionControl:
+    """Rate and concurrency limits for the routes of the policies (see DEFAULT_POLICIES).
+
+    ``admit(policy, client)`` decides, the before_request hook calls it for the routes
+    a policy covers and rejects with 429 (rate) or 503 (shed). The decisions are
+    counted in ``metrics`` (metrics.py) when it is given.
+    """
+
+    def __init__(self, metrics=None, app=None):
+        self.policies = {}
+        self.buckets = None
+        self._routes = {}  # <-- (method, endpoint) -> Policy
+        self._limits = {}  # <-- policy name -> ConcurrencyLimit
+        self.client_header = None
+        self.decisions = self.wait_seconds = None
+        if metrics is not None:
+            self.decisions = metrics.registry.add(Counter(
+                "hotel_admission_total", "Requests seen by admission control, admitted, rate_limited or shed.",
+                ("policy", "outcome")))
+            self.wait_seconds = metrics.registry.add(Histogram(
+                "hotel_admission_wait_seconds", "Time an admitted request waited for a concurrency slot.",
+                ("policy",), WAIT_BUCKETS))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["admission"] = self
+        self._routes = {}
+        self.client_header = app.config.get("ADMISSION_CLIENT_HEADER")  # <-- e.g. "X-Forwarded-For" behind a proxy
+        if not app.config.get("ADMISSION_ENABLED", True):
+            return
+        policies = policies_from_config(app.config)
+        self.policies = {policy.name: policy for policy in policies}
+        self._routes = {route: policy for policy in policies for route in policy.routes}
+        self._limits = {policy.name: ConcurrencyLimit(policy.concurrency, policy.max_wait)
+                        for policy in policies if policy.concurrency}
+        self.buckets = buckets_from_config(app.config, max_idle=max(policy.burst / policy.rate for policy in policies))
+        app.before_request(self.check_request)
+        app.teardown_request(self.release_request)
+
+    def client(self):
+        if self.client_header:
+            forwarded = request.headers.get(self.client_header, "").split(",")[0].strip()  # <-- the first address is the client's
+            if forwarded:
+                return forwarded
+        return request.remote_addr or "-"
+
+    def admit(self, policy, client):
+        """Returns ("admitted", seconds waited), ("rate_limited", retry after) or ("shed", retry after).
+
+        An admitted request holds a concurrency slot, given back with release(policy).
+        """
+        retry_after = self.buckets.take(f"{policy.name}|{client}", policy.rate, policy.burst)
+        if retry_after:
+            outcome, seconds = "rate_limited", retry_after
+        else:
+            limit = self._limits.get(policy.name)
+            waited = limit.acquire() if limit is not None else 0.0
+            if waited is None:
+                outcome, seconds = "shed", 1.0  # <-- the queue in front of it is already max_wait long
+            else:
+                outcome, seconds = "admitted", waited
+                if self.wait_seconds is not None:
+                    self.wait_seconds.observe(waited, policy.name)
+        if self.decisions is not None:
+            self.decisions.inc(policy.name, outcome)
+        return outcome, seconds
+
+    def release(self, policy):
+        limit = self._limits.get(policy.name)
+        if limit is not None:
+            limit.release()
+
+    def check_request(self):
+        policy = self._routes.get((request.method, request.endpoint))
+        if policy is None:
+            return None
+        outcome, seconds = self.admit(policy, self.client())
+        if outcome == "rate_limited":
+            raise TooManyRequests("Too many attempts, please wait a moment and try again.", retry_after=math.ceil(seconds))
+        if outcome == "shed":
+            raise ServiceUnavailable("We are very busy right now, please try again in a moment.", retry_after=math.ceil(seconds))
+        g.admission_policy = policy
+        return None
+
+    def release_request(self, exception=None):
+        policy = g.pop("admission_policy", None)
+        if policy is not None:
+            self.release(policy)
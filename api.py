@@ -0,0 +1,415 @@
+import logging
+from datetime import date
+
+from flask import Blueprint, current_app, request, url_for
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
+
+from availability import RoomUnavailable
+from bookings import delete_booking, find_booking, move_booking, queue_booking_job, run_in_transaction, valid_booking_number
+from idempotency import IdempotencyConflict, fingerprint, scoped_key
+from quotes import make_stays, price_table, quote
+from search import InvalidSearch, parse_filters, search_rooms
+from tasks import enqueue
+
+try:
+    import orjson
+except ImportError:  # <-- the standard json module is used instead, just slower
+    orjson = None
+
+
+# A JSON API under /api/v1 for partners and the mobile app. Every call carries all it
+# needs (no cookie session between steps), so a booking is one POST instead of the
+# five redirects of the HTML pages. Prices and bookings go through the same
+# room_deal_condition() and create_booking() the pages use.
+
+logger = logging.getLogger("hotel.api")
+
+API_PREFIX = "/api/v1"
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BATCH_STAYS = 1000
+DEFAULT_MEAL_DEAL = "Bed & Breakfast"
+CUSTOMER_FIELDS = ("name", "surname", "email", "address", "telephone")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """app.json backed by orjson when it is installed.
+
+    Dates come out as ISO strings either way, anything orjson cannot encode falls
+    back to the standard provider.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs.get("indent"):
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+        try:
+            body = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)  # <-- bytes, no str round trip
+        except TypeError:
+            return super().response(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.details = details
+
+
+def error_response(status, message, **details):
+    return {"error": {"status": status, "message": message, **details}}, status
+
+
+def json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError(400, "the request body must be a JSON object")
+    return body
+
+
+def parse_date(value, field):
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ApiError(400, f"{field} must be a date like 2025-06-30", field=field) from None
+
+
+def parse_int(value, field, minimum=None, maximum=None):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{field} must be a whole number", field=field) from None
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ApiError(400, f"{field} must be between {minimum} and {maximum}", field=field)
+    return number
+
+
+def parse_stay(values):
+    # check_in and check_out from a query string or a JSON object, plus the nights between them
+    if not values.get("check_in") or not values.get("check_out"):
+        raise ApiError(400, "check_in and check_out are required")
+    check_in = parse_date(values["check_in"], "check_in")
+    check_out = parse_date(values["check_out"], "check_out")
+    nights = (check_out - check_in).days
+    if nights < 1:
+        raise ApiError(400, "check_out must be after check_in", field="check_out")
+    return check_in, check_out, nights
+
+
+def page_arguments():
+    limit = parse_int(request.args.get("limit", DEFAULT_PAGE_SIZE), "limit", 1, MAX_PAGE_SIZE)
+    offset = parse_int(request.args.get("offset", 0), "offset", 0)
+    return limit, offset
+
+
+def paginate(items, limit, offset, **extra):
+    # one page of an already sorted list, next_offset is None on the last page
+    next_offset = offset + limit if offset + limit < len(items) else None
+    return {"items": items[offset:offset + limit], "total": len(items), "limit": limit, "offset": offset,
+            "next_offset": next_offset, **extra}
+
+
+def room_to_dict(room):
+    return {
+        "room": room.room_name,
+        "location": room.location,
+        "price_per_night": room.price_per_night,
+        "size": room.size,
+        "bed": room.bed,
+        "description": room.description_pitch,
+        "image": url_for("static", filename=f"img/{room.image_file_name}"),
+        "size_sqm": room.size_sqm,
+        "capacity": room.capacity,
+    }
+
+
+def customer_to_dict(customer):
+    document = {field: getattr(customer, field) for field in CUSTOMER_FIELDS}
+    document["telephone"] = str(document["telephone"])  # <-- an integer column, a string in the POST body
+    return document
+
+
+def api_client():
+    # whose Idempotency-Key it is: the partner's credentials when the request has them,
+    # otherwise the address it comes from (admission.py knows the proxy header)
+    credentials = request.headers.get("Authorization")
+    if credentials:
+        return f"credentials:{credentials}"  # <-- only ever stored hashed, see scoped_key()
+    admission = current_app.extensions.get("admission")
+    return f"address:{admission.client() if admission is not None else request.remote_addr}"
+
+
+def booking_to_dict(booking):
+    customer = booking.customer
+    return {
+        "booking_number": booking.booking_number,
+        "room": booking.room_selection,
+        "location": booking.location,
+        "check_in": booking.check_in,
+        "check_out": booking.check_out,
+        "nights": booking.nights,
+        "people": booking.people,
+        "meal_deal": booking.meal_deal,
+        "total_price": booking.total_price,
+        "customer": customer_to_dict(customer) if customer else None,
+    }
+
+
+class Api:
+    """The /api/v1 blueprint.
+
+    ``create_booking`` and ``room_deal_condition`` are the functions from app.py, so
+    the API and the HTML pages can never price or book differently. ``partitions``
+    (see partitions.py) gives the database of a location or a booking. With
+    ``idempotency_keys`` the writes accept an Idempotency-Key header. With ``archive``
+    a booking that was archived can still be looked up, but not changed.
+    """
+
+    def __init__(self, app, partitions, catalog, create_booking, room_deal_condition, idempotency_keys=None, archive=None):
+        self.partitions = partitions
+        self.archive = archive
+        self.catalog = catalog
+        self.create_booking = create_booking
+        self.room_deal_condition = room_deal_condition
+        self.idempotency_keys = idempotency_keys
+        self.blueprint = Blueprint("api", __name__, url_prefix=API_PREFIX)
+        self.blueprint.add_url_rule("/rooms", "rooms", self.rooms)
+        self.blueprint.add_url_rule("/search", "search", self.search)
+        self.blueprint.add_url_rule("/quotes", "quotes", self.quotes, methods=["POST"])
+        self.blueprint.add_url_rule("/bookings", "create_booking", self.book, methods=["POST"])
+        self.blueprint.add_url_rule("/bookings/<booking_number>", "booking", self.booking,
+                                    methods=["GET", "PATCH", "DELETE"])
+        self.blueprint.register_error_handler(ApiError, self.api_error)
+        self.blueprint.register_error_handler(HTTPException, self.http_error)
+        app.json = FastJSONProvider(app)
+        app.register_blueprint(self.blueprint)
+
+    def api_error(self, error):
+        return error_response(error.status, error.message, **error.details)
+
+    def http_error(self, error):
+        body, status = error_response(error.code, error.description)
+        return body, status, [(name, value) for name, value in error.get_headers() if name == "Retry-After"]
+
+    def idempotent(self, work, partition=None):
+        """Runs work() (which returns body, status, headers) once per Idempotency-Key header.
+
+        A retry with the same key and the same request gets the first response again,
+        the same key with a different request is refused with 409. Keys are kept per
+        client (see api_client()), two partners can use the same key, and in
+        ``partition``, the database the request writes to (the main one by default).
+        """
+        key = request.headers.get("Idempotency-Key")
+        if not key or self.idempotency_keys is None:
+            return work()
+        request_fingerprint = fingerprint(request.method, request.path, sorted(request.args.items(multi=True)),
+                                          request.get_json(silent=True))
+        try:
+            (body, status, headers), replayed = self.idempotency_keys.run(scoped_key(f"api:{api_client()}", key), request_fingerprint, work,
+                                                                          partition.Session if partition is not None else None)
+        except IdempotencyConflict as error:
+            raise ApiError(409, str(error)) from None
+        if replayed:
+            headers = dict(headers, **{"Idempotent-Replayed": "true"})
+        return body, status, headers
+
+    def meal_deal(self, snapshot, name):
+        meal_deal = snapshot.meal_deal(name or DEFAULT_MEAL_DEAL)
+        if meal_deal is None:
+            raise ApiError(400, f"unknown meal deal {name!r}", field="meal_deal")
+        return meal_deal
+
+    # catalog and search
+
+    def rooms(self):
+        snapshot = self.catalog.get()
+        location = request.args.get("location")
+        rooms = snapshot.rooms_in(location) if location else snapshot.rooms
+        limit, offset = page_arguments()
+        return paginate([room_to_dict(room) for room in rooms], limit, offset)
+
+    def search(self):
+        """Rooms with a free unit on every night of the stay, with their total price.
+
+        Takes the same filters and sort order as the search results page and is paged
+        the same way: ?after= the next_cursor of the previous page.
+        """
+        location = request.args.get("location")
+        if not location:
+            raise ApiError(400, "location is required", field="location")
+        check_in, check_out, nights = parse_stay(request.args)
+        limit = parse_int(request.args.get("limit", DEFAULT_PAGE_SIZE), "limit", 1, MAX_PAGE_SIZE)
+        snapshot = self.catalog.get()
+        meal_deal = self.meal_deal(snapshot, request.args.get("meal_deal"))
+        try:
+            filters = parse_filters(request.args)
+            page = search_rooms(self.partitions.for_location(location).session, location, check_in, check_out, filters,
+                                request.args.get("after"), limit)
+        except InvalidSearch as error:
+            raise ApiError(400, str(error)) from None
+        results = []
+        for room_name, free in page.rooms:
+            room = snapshot.room(room_name)
+            if room is None:
+                continue  # <-- added after this worker loaded the catalog
+            results.append(dict(
+                room_to_dict(room),
+                units_left=free,
+                meal_deal=meal_deal.meal_deal_name,
+                nights=nights,
+                total_price=self.room_deal_condition(room, nights, meal_deal, snapshot.deal_for_room(room_name)),
+            ))
+        return {"items": results, "limit": limit, "next_cursor": page.next_cursor, "location": location,
+                "check_in": check_in, "check_out": check_out}
+
+    def quotes(self):
+        """Prices up to MAX_BATCH_STAYS stays in one call with the batch quote engine.
+
+        Every stay is {"room", "meal_deal", "nights"} or {"room", "meal_deal",
+        "check_in", "check_out"}, the quotes come back in the same order.
+        """
+        stays = json_body().get("stays")
+        if not isinstance(stays, list) or not stays:
+            raise ApiError(400, "stays must be a non-empty list", field="stays")
+        if len(stays) > MAX_BATCH_STAYS:
+            raise ApiError(400, f"at most {MAX_BATCH_STAYS} stays per call", field="stays")
+        snapshot = self.catalog.get()
+        table = price_table(snapshot)
+        parsed = []
+        for index, stay in enumerate(stays):
+            if not isinstance(stay, dict):
+                raise ApiError(400, "every stay must be a JSON object", index=index)
+            try:
+                room_name = stay.get("room")
+                if snapshot.room(room_name) is None:
+                    raise ApiError(400, f"unknown room {room_name!r}", field="room")
+                meal_deal = self.meal_deal(snapshot, stay.get("meal_deal"))
+                if "nights" in stay:
+                    nights = parse_int(stay["nights"], "nights", 1)
+                else:
+                    nights = parse_stay(stay)[2]
+            except ApiError as error:
+                error.details["index"] = index  # <-- tells the client which stay was wrong
+                raise
+            parsed.append((room_name, meal_deal.meal_deal_name, nights))
+        prices = quote(table, make_stays(table, parsed))
+        return {"quotes": [
+            {"room": room_name, "meal_deal": meal_deal_name, "nights": nights, "total_price": price}
+            for (room_name, meal_deal_name, nights), price in zip(parsed, prices)
+        ]}
+
+    # bookings
+
+    def book(self):
+        """Books a room and stores the customer in a single transaction."""
+        body = request.get_json(silent=True)
+        location = body.get("location") if isinstance(body, dict) else None  # <-- book_once() reports a bad body
+        return self.idempotent(self.book_once, self.partitions.for_location(location))
+
+    def book_once(self):
+        body = json_body()
+        snapshot = self.catalog.get()
+        room = snapshot.room(body.get("room"), body.get("location"))
+        if room is None:
+            raise ApiError(404, "no such room at this location", field="room")
+        check_in, check_out, nights = parse_stay(body)
+        people = parse_int(body.get("people"), "people", 1)
+        meal_deal = self.meal_deal(snapshot, body.get("meal_deal"))
+        customer = body.get("customer")
+        if not isinstance(customer, dict) or not all(str(customer.get(field) or "").strip() for field in CUSTOMER_FIELDS):
+            raise ApiError(400, f"customer needs {', '.join(CUSTOMER_FIELDS)}", field="customer")
+        try:
+            booking = self.create_booking(room, meal_deal, nights, people, room.location, check_in, check_out,
+                                          snapshot.deal_for_room(room.room_name),
+                                          customer={field: str(customer[field]).strip() for field in CUSTOMER_FIELDS})
+        except RoomUnavailable as error:
+            raise ApiError(409, str(error)) from None
+        location = url_for("api.booking", booking_number=booking.booking_number)
+        return booking_to_dict(booking), 201, {"Location": location}
+
+    def booking(self, booking_number):
+        """Looks up, changes (PATCH) or cancels (DELETE) a booking.
+
+        The surname on the booking has to be given as ?surname= or in the JSON body,
+        the same check as the manage booking login.
+        """
+        if request.method == "GET":
+            return self.booking_once(booking_number)
+        partition = self.partitions.for_booking(booking_number) if valid_booking_number(booking_number) else None
+        return self.idempotent(lambda: self.booking_once(booking_number), partition)  # <-- a replayed DELETE answers like the first one
+
+    def booking_once(self, booking_number):
+        body = json_body() if request.method == "PATCH" else {}
+        surname = request.args.get("surname") or body.get("surname")
+        if not surname:
+            raise ApiError(400, "surname is required", field="surname")
+        if not valid_booking_number(booking_number):
+            raise ApiError(404, "no booking with this number and surname")  # <-- wrong check digit, no query needed
+        db_session = self.partitions.for_booking(booking_number).session
+        booking = find_booking(db_session, int(booking_number), surname)
+        if booking is None and self.archive is not None:
+            archived = self.archive.find(booking_number, surname)
+            if archived is not None and request.method != "GET":
+                raise ApiError(409, "this stay is over and can no longer be changed or cancelled")
+            if archived is not None:
+                return dict(booking_to_dict(archived), archived=True), 200, {}
+        if booking is None:
+            raise ApiError(404, "no booking with this number and surname")
+
+        if request.method == "DELETE":
+            cancelled = booking_to_dict(booking)  # <-- the customer is gone once the booking is deleted
+
+            def cancel(db_session):
+                deleted = delete_booking(db_session, booking.booking_number)
+                if deleted is not None:
+                    enqueue(db_session, "booking_cancelled", cancelled)  # <-- receipt removed and message sent after the response
+                return deleted
+
+            run_in_transaction(db_session, cancel)
+            logger.info("booking cancelled", extra={"booking_number": booking.booking_number, "source": "api"})
+            return {"cancelled": True, "booking": cancelled}, 200, {}
+
+        if request.method == "PATCH":
+            return booking_to_dict(self.change(booking, body)), 200, {}
+        return booking_to_dict(booking), 200, {}
+
+    def change(self, booking, body):
+        # fields that are left out keep their current value, the price is worked out again
+        snapshot = self.catalog.get()
+        if "check_in" in body or "check_out" in body:
+            check_in, check_out, nights = parse_stay({
+                "check_in": body.get("check_in", booking.check_in), "check_out": body.get("check_out", booking.check_out),
+            })
+        else:
+            check_in, check_out, nights = booking.check_in, booking.check_out, booking.nights
+        people = parse_int(body.get("people", booking.people), "people", 1)
+        meal_deal = self.meal_deal(snapshot, body.get("meal_deal", booking.meal_deal))
+        room = snapshot.room(booking.room_selection)
+        total_price = self.room_deal_condition(room, nights, meal_deal, snapshot.deal_for_room(room.room_name))
+        try:
+            booking = move_booking(self.partitions.for_booking(booking.booking_number).session, snapshot, booking.booking_number,
+                                   after=queue_booking_job("booking_changed"), check_in=check_in,
+                                   check_out=check_out, nights=nights, people=people,
+                                   meal_deal=meal_deal.meal_deal_name, total_price=total_price)
+        except RoomUnavailable as error:
+            raise ApiError(409, str(error)) from None
+        if booking is None:
+            raise ApiError(404, "no booking with this number and surname")  # <-- cancelled since it was looked up
+        logger.info("booking changed", extra={"booking_number": booking.booking_number, "source": "api"})
+        return booking
@@ -1,148 +1,303 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from random import randint
+from flask import Flask, Response, current_app, render_template, request, redirect, url_for, session, flash, abort
+from flask.cli import AppGroup
 from datetime import *
+from contextlib import ExitStack
+from functools import lru_cache
+from itertools import islice
+import gc
+import hmac
+import os
+import time # <-- after "from datetime import *", which has a time class of its own
+import logging
+import click
 import sqlalchemy as sa
-from sqlalchemy import ForeignKey, Integer, String, DateTime
-from sqlalchemy.orm import Mapped, mapped_column, sessionmaker, declarative_base
-
-app = Flask(__name__) # <-- to set up our flask application while refencing this file
-sqlite_file_name = "instance/Flora_Hotel.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
-db = sa.create_engine(sqlite_url) # <-- this initializes our database
-Session = sessionmaker(bind=db)
-app.secret_key = "41038"  # <-- secret key for session management
-Base = declarative_base()
-
-
-# Creating the models of our database
-# model = table
-
-class Booking(Base):
-    __tablename__ = "booking"
-
-    booking_number: Mapped[int] = mapped_column(
-        Integer,
-        primary_key=True,
-        default=lambda: randint(100000, 999999)  # setting a default value automatically
-    )
-    check_in: Mapped[date]
-    check_out: Mapped[date]
-    room_selection: Mapped[str] = mapped_column(ForeignKey("rooms.room_name"))
-    nights: Mapped[int]
-    people: Mapped[int]
-    total_price: Mapped[int]
-    location: Mapped[str]
-    meal_deal: Mapped[str]
-
-    def __repr__(self):
-        return f"<Booking(booking_number={self.booking_number}, check_in={self.check_in}, check_out={self.check_out}, room_selection={self.room_selection}, nights={self.nights}, people={self.people}, total_price={self.total_price}, location={self.location}, meal_deal={self.meal_deal})>"
-
-
-class Customer(Base):
-    __tablename__ = "customers"
-    booking_number: Mapped[int] = mapped_column(Integer, ForeignKey("booking.booking_number"), primary_key=True,
-                                                default="booking.booking_number")
-    name: Mapped[str]
-    surname: Mapped[str]
-    email: Mapped[str]
-    address: Mapped[str]
-    telephone: Mapped[int]
-
-    def __repr__(self):
-        return f"<Customer(booking_number={self.booking_number}, name={self.name}, surname={self.surname}, email={self.email}, address={self.address}, telephone={self.telephone})>"
-
-class MealDeals(Base):
-    __tablename__ = "meal_deals"
-
-    meal_deal_name: Mapped[str] = mapped_column(primary_key=True)
-    meal_deal_price: Mapped[int]
-
-    def __repr__(self):
-        return f"<MealDeals(meal_deal_name={self.meal_deal_name}, meal_deal_price={self.meal_deal_price})>"
-
-class Rooms(Base):
-    __tablename__ = "rooms"
-
-    room_name: Mapped[str] = mapped_column(primary_key=True)
-    price_per_night: Mapped[int]
-    size: Mapped[str]
-    bed: Mapped[str]
-    image_file_name: Mapped[str]
-    location: Mapped[str]
-    description_pitch: Mapped[str]
-
-    def __repr__(self):
-        return f"<Rooms(room_name={self.room_name}, price_per_night={self.price_per_night}, size={self.size}, image_path={self.image_file_name}, location={self.location}, description={self.description_pitch})>"
-
-class Deals(Base):
-    __tablename__ = "deals"
-
-    deal_name: Mapped[str] = mapped_column(primary_key=True)
-    room_location: Mapped[str]
-    room_name: Mapped[str]
-    nights: Mapped[str]
-    new_price: Mapped[int]
-    old_price: Mapped[int]
-
-    def __repr__(self):
-        return f"Deals(deal_name={self.deal_name}, room_location={self.room_location}, room_name={self.room_name}, new_price={self.new_price}, old_price={self.old_price})"
-
-#Base.metadata.drop_all(db)
-#Base.metadata.create_all(db) # <-- makes the actual tables with headers(columns) in the database
-
-# creating objects representing rows that should be already in the database
-# the program will be collecting data from them
-meal_deal_1 = MealDeals(meal_deal_name="Bed & Breakfast", meal_deal_price=5)
-meal_deal_2 = MealDeals(meal_deal_name="All Inclusive", meal_deal_price=10)
-meal_deals = [meal_deal_1, meal_deal_2]
-
-room_1 = Rooms(room_name="Standard Room", price_per_night=15, size="20-30 sqm", bed="single sized bed", image_file_name="standard hotel room.png", location="United Kingdom", description_pitch="quick refreshing stay")
-room_2 = Rooms(room_name="Premium Room", price_per_night=18, size="25-35 sqm", bed="double sized bed", image_file_name="premium room.png", location="United Kingdom", description_pitch="higher quality stay within the budget")
-room_3 = Rooms(room_name="Exclusive Room", price_per_night=25, size="30-40 sqm", bed="queen sized bed", image_file_name="exclusive hotel room.jpg", location="United Kingdom", description_pitch="exclusive above the standard experience")
-room_4 = Rooms(room_name="Deluxe Room", price_per_night=30, size="35-45 sqm", bed="king sized bed", image_file_name="deluxe room.jpg", location="United Kingdom", description_pitch="top-notch luxurious stay")
-rooms = [room_1, room_2, room_3, room_4]
-
-
-deal_1 = Deals(deal_name="Premium Bundle", room_location="London, UK", room_name="Premium Room", nights="7 nights", new_price=100, old_price=126)
-deal_2 = Deals(deal_name="Exclusive Bundle", room_location="London, UK", room_name="Exclusive Room", nights="7 nights", new_price=150, old_price=175)
-deal_3 = Deals(deal_name="Deluxe Bundle", room_location="London, UK", room_name="Deluxe Room", nights="7 nights", new_price=170, old_price=210)
-deals = [deal_1, deal_2, deal_3]
-
-
-def commit_to_database(object):
+from database import Database, default_database_url
+from models import Booking, Customer, MealDeals, Rooms, Deals, RoomNight, DailyRevenue, utc_now
+from catalog import CatalogCache, is_catalog_object
+from availability import RoomUnavailable, ensure_inventory, rebuild_occupancy, DEFAULT_ROOM_UNITS
+from bookings import book_room, move_booking, run_in_transaction, valid_booking_number, import_bookings, sync_booking_sequence
+from bookings import load_booking, find_booking, delete_booking, expire_held_bookings, queue_booking_job
+from persistence import DEFAULT_BATCH_SIZE, bulk_upsert, coerce_row, iter_records, object_to_row
+from migrations import upgrade_schema
+from query_plans import check_query_plans
+from sessions import session_interface_from_config
+from quotes import bundle_applies, cheapest_dates, check_quotes, price_table
+from search import InvalidSearch, bed_types, parse_filters, search_rooms
+from reporting import DIMENSIONS, MEASURES, iter_csv, iter_report, merge_totals, parse_group_by, rebuild_reports, report_measures, report_totals
+from partitions import PartitionRouter, MOVE_BATCH_SIZE
+from archive import Archive, ARCHIVE_BATCH_SIZE
+from assets import Assets, build_assets, DEFAULT_QUALITY, DEFAULT_WIDTHS
+from page_cache import PageCache
+from metrics import Metrics
+from admission import AdmissionControl
+from logs import configure_logging, DEFAULT_LOG_LEVEL
+from api import Api, booking_to_dict
+from idempotency import IdempotencyConflict, IdempotencyKeys, fingerprint, new_key, scoped_key, DEFAULT_TTL
+from sweeper import Sweeper
+from tasks import JobQueue, enqueue
+from notifications import notifier_from_config
+
+# The application itself is built by create_app() at the bottom of this file, so importing
+# it opens no database and reads no config. The objects below are bound to the application
+# there, and the pages and commands are collected in `views` and `cli` until then.
+logger = logging.getLogger("hotel")
+database = Database() # <-- engine with WAL and pragmas, pooled sessions, created on first use in every process
+Session = database.Session
+partitions = PartitionRouter(database) # <-- which database has a location or a booking, with DATABASE_PARTITIONS
+archive = Archive() # <-- stays that are over, moved out of the live tables by "flask archive-stays"
+catalog = CatalogCache(Session, ttl=300) # <-- rooms, meal deals and deals are kept in memory for 5 minutes
+assets = Assets() # <-- responsive_image() in the templates, built by "flask build-assets"
+page_cache = PageCache(catalog) # <-- pages that only depend on the catalog and a few session values are rendered once
+metrics = Metrics() # <-- request, SQL and template timings at /metrics
+admission = AdmissionControl(metrics) # <-- rate and concurrency limits for the login and the booking forms
+idempotency_keys = IdempotencyKeys(Session, sources=lambda: [partition.Session for partition in partitions.all()]) # <-- a booking form sent twice books once, the key is kept in the partition it books in
+jobs = JobQueue(Session, sources=lambda: [partition.Session for partition in partitions.all()]) # <-- receipts and customer messages, run by worker threads after the response
+views = [] # <-- (rule, view function, options) of every page, see route()
+cli = AppGroup("hotel") # <-- the "flask ..." commands
+DEFAULT_BOOKING_HOLD_SECONDS = 1800 # <-- how long a booking waits for the customer details
+#Base.metadata.drop_all(database.engine)
+#Base.metadata.create_all(database.engine) # <-- makes the actual tables with headers(columns) in the database
+
+def route(rule, **options):
+    # @app.route for the pages, they are added to the application by create_app()
+    def register(view):
+        views.append((rule, view, options))
+        return view
+    return register
+
+def prepare_database():
+    # "flask db-upgrade": the schema of every database, then what a new or older one is missing
+    # returns the migrations applied to each partition
+    applied = {}
+    for partition in partitions.all(): # <-- the main database first, the other partitions get a copy of its catalog
+        applied[partition.number] = upgrade_schema(partition.engine) # <-- creates missing tables and indexes on databases made by an older version
+        if partition.number:
+            partitions.copy_catalog(partition)
+        with partition.Session() as db_session:
+            ensure_inventory(db_session)
+            if db_session.query(RoomNight).first() is None:
+                rebuild_occupancy(db_session) # <-- first run on an existing database, count the nights already booked
+            if db_session.query(DailyRevenue).first() is None:
+                rebuild_reports(db_session) # <-- and add them up per night for the reports
+            db_session.commit()
+    archive.prepare()
+    catalog.invalidate()
+    return applied
+
+def default_catalog():
+    # creating objects representing rows that should be already in the database
+    # the program will be collecting data from them ("flask seed" writes them)
+    meal_deal_1 = MealDeals(meal_deal_name="Bed & Breakfast", meal_deal_price=5)
+    meal_deal_2 = MealDeals(meal_deal_name="All Inclusive", meal_deal_price=10)
+    meal_deals = [meal_deal_1, meal_deal_2]
+
+    room_1 = Rooms(room_name="Standard Room", price_per_night=15, size="20-30 sqm", bed="single sized bed", image_file_name="standard hotel room.png", location="United Kingdom", description_pitch="quick refreshing stay", size_sqm=20, capacity=1)
+    room_2 = Rooms(room_name="Premium Room", price_per_night=18, size="25-35 sqm", bed="double sized bed", image_file_name="premium room.png", location="United Kingdom", description_pitch="higher quality stay within the budget", size_sqm=25, capacity=2)
+    room_3 = Rooms(room_name="Exclusive Room", price_per_night=25, size="30-40 sqm", bed="queen sized bed", image_file_name="exclusive hotel room.jpg", location="United Kingdom", description_pitch="exclusive above the standard experience", size_sqm=30, capacity=2)
+    room_4 = Rooms(room_name="Deluxe Room", price_per_night=30, size="35-45 sqm", bed="king sized bed", image_file_name="deluxe room.jpg", location="United Kingdom", description_pitch="top-notch luxurious stay", size_sqm=35, capacity=2)
+    rooms = [room_1, room_2, room_3, room_4]
+
+    deal_1 = Deals(deal_name="Premium Bundle", room_location="London, UK", room_name="Premium Room", nights="7 nights", new_price=100, old_price=126)
+    deal_2 = Deals(deal_name="Exclusive Bundle", room_location="London, UK", room_name="Exclusive Room", nights="7 nights", new_price=150, old_price=175)
+    deal_3 = Deals(deal_name="Deluxe Bundle", room_location="London, UK", room_name="Deluxe Room", nights="7 nights", new_price=170, old_price=210)
+    deals = [deal_1, deal_2, deal_3]
+    return meal_deals, rooms, deals
+
+def commit_to_database(object, refresh=True):
     with Session() as session:
         session.add(object)
         session.commit()
-        session.refresh(object)  # <-- refresh the object to get the updated state from the database
-        print(f"Object {object} committed to the database.")
-
-"""
-for deal in meal_deals:
-    commit_to_database(deal)
-
-for room in rooms:
-    commit_to_database(room)
+        if refresh:
+            session.refresh(object)  # <-- refresh the object to get the updated state from the database
+        logger.debug("%s committed to the database", type(object).__name__)
+    if is_catalog_object(object):
+        partitions.sync_catalog()
+        catalog.invalidate() # <-- the cached catalog no longer matches the database
+
+# "flask seed" writes the rows above (or the ones in the given files) in a single transaction
+@cli.command("seed")
+@click.option("--meal-deals", "meal_deals_file", help="CSV or JSONL file with meal deals to load instead of the defaults.")
+@click.option("--rooms", "rooms_file", help="CSV or JSONL file with rooms to load instead of the defaults.")
+@click.option("--deals", "deals_file", help="CSV or JSONL file with deals to load instead of the defaults.")
+@click.option("--units", default=DEFAULT_ROOM_UNITS, show_default=True, help="Units given to rooms that have no inventory yet.")
+def seed_command(meal_deals_file, rooms_file, deals_file, units):
+    """Load the meal deals, rooms and deals catalog."""
+    meal_deals, rooms, deals = default_catalog()
+    with Session() as db_session:
+        for model, default_rows, path in ((MealDeals, meal_deals, meal_deals_file), (Rooms, rooms, rooms_file), (Deals, deals, deals_file)):
+            if path:
+                rows = (coerce_row(model, record) for record in iter_records(path))
+            else:
+                rows = (object_to_row(row) for row in default_rows)
+            count = bulk_upsert(db_session, model, rows)
+            click.echo(f"{count} {model.__tablename__} rows written")
+        ensure_inventory(db_session, units)
+        db_session.commit()
+    partitions.sync_catalog() # <-- every partition books against the same rooms
+    catalog.invalidate()
+
+@cli.command("db-upgrade")
+def db_upgrade_command():
+    """Create missing tables, apply pending schema migrations and fill in the counts they need."""
+    for number, applied in prepare_database().items():
+        prefix = f"partition {number}: " if number else ""
+        click.echo("\n".join(f"{prefix}applied: {name}" for name in applied) or f"{prefix}database is up to date")
+
+# fails (exit code 1) when one of the queries the booking pages run would read a whole table
+@cli.command("check-query-plans")
+@click.option("--live", is_flag=True, help="Ask the configured database instead of an empty copy of the schema.")
+def check_query_plans_command(live):
+    """Check that every hot query is answered from an index."""
+    offenders = check_query_plans(database.engine if live else None)
+    for name, plan in offenders.items():
+        click.echo(f"{name}: full table scan")
+        for step in plan:
+            click.echo(f"    {step}")
+    if offenders:
+        raise SystemExit(1)
+    click.echo("all hot queries use an index")
+
+# "flask import-bookings bookings.jsonl" streams historical bookings in batches
+@cli.command("import-bookings")
+@click.argument("path")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True, help="Bookings written per transaction.")
+def import_bookings_command(path, batch_size):
+    """Load bookings (and optionally their customers) from a CSV or JSONL file."""
+    count = 0
+    for partition in partitions.all(): # <-- the file is read once per partition, each one takes the bookings of its locations
+        records = (record for record in iter_records(path) if partitions.for_location(record["location"]) is partition)
+        count += import_bookings(partition.Session, records, batch_size,
+                                 on_batch=lambda imported: click.echo(f"{imported} bookings imported"))
+        with partition.Session() as db_session:
+            sync_booking_sequence(db_session)
+            db_session.commit()
+    click.echo(f"Done, {count} bookings imported")
+
+@cli.command("rebuild-reports")
+def rebuild_reports_command():
+    """Recompute the daily occupancy and revenue aggregates from the booking table."""
+    count = 0
+    since = archive.archived_through() # <-- the nights of archived stays are no longer in the booking table, they are kept
+    for partition in partitions.all():
+        with partition.Session() as db_session:
+            count += rebuild_reports(db_session, since=since)
+            db_session.commit()
+    click.echo(f"{count} daily_revenue rows written")
+
+# "flask export-report report.csv --start 2025-01-01 --end 2026-01-01 --group-by night,room_name"
+@cli.command("export-report")
+@click.argument("output", type=click.File("w"), default="-")
+@click.option("--start", required=True, type=click.DateTime(formats=["%Y-%m-%d"]), help="First night of the report.")
+@click.option("--end", required=True, type=click.DateTime(formats=["%Y-%m-%d"]), help="Night after the last one.")
+@click.option("--group-by", default="location,room_name", show_default=True, help=f"Any of {', '.join(DIMENSIONS)}.")
+@click.option("--location", help="Only this location.")
+def export_report_command(output, start, end, group_by, location):
+    """Write the occupancy and revenue report as CSV."""
+    group_by = parse_group_by(group_by)
+    rows = report_rows(catalog.get(), start.date(), end.date(), group_by, location)
+    for chunk in iter_csv(rows, [*group_by, *MEASURES]):
+        output.write(chunk)
+
+# "flask move-bookings" after a location that already has bookings was given a partition of its own
+@cli.command("move-bookings")
+@click.option("--batch-size", default=MOVE_BATCH_SIZE, show_default=True, help="Bookings moved per transaction.")
+def move_bookings_command(batch_size):
+    """Move the bookings of partitioned locations out of the main database."""
+    moved = partitions.move_bookings(batch_size, on_batch=lambda number, moved: click.echo(f"{moved} bookings moved, up to partition {number}"))
+    click.echo(f"Done, {moved} bookings moved")
+
+# "flask archive-stays" from cron, e.g. every night: each run moves whatever has become due since the last one
+@cli.command("archive-stays")
+@click.option("--days", type=int, help="Archive stays that checked out more than this many days ago (default ARCHIVE_AFTER_DAYS, 30).")
+@click.option("--batch-size", default=ARCHIVE_BATCH_SIZE, show_default=True, help="Bookings archived per transaction.")
+@click.option("--max-batches", type=int, help="Stop after this many batches per partition, the next run carries on.")
+def archive_stays_command(days, batch_size, max_batches):
+    """Move stays that are over from the live tables to the archive database."""
+    cutoff = date.today() - timedelta(days=archive.after_days if days is None else days)
+    archived = 0
+    for partition in partitions.all():
+        with partition.Session() as db_session:
+            archived += archive.archive_stays(db_session, cutoff, batch_size, max_batches,
+                                              on_batch=lambda count: click.echo(f"{archived + count} bookings archived"))
+    click.echo(f"Done, {archived} bookings that checked out before {cutoff} archived")
+
+@cli.command("sweep")
+def sweep_command():
+    """Expire held bookings and old idempotency keys once (what the background sweeper does)."""
+    for name, removed in current_app.extensions["sweeper"].run_once().items():
+        click.echo(f"{name}: {removed} removed")
+
+# "flask run-jobs" works through the job table when JOB_WORKERS=0 keeps the web workers out of it
+@cli.command("run-jobs")
+@click.option("--workers", default=2, show_default=True, help="Worker threads.")
+@click.option("--once", is_flag=True, help="Run the jobs that are due now and exit.")
+@click.option("--poll", default=1.0, show_default=True, help="Seconds between looks for jobs the servers queued.")
+def run_jobs_command(workers, once, poll):
+    """Run queued post-booking jobs (receipts, customer messages)."""
+    if once:
+        click.echo(f"{jobs.run_pending()} jobs run")
+        return
+    jobs.poll_seconds = poll # <-- every job comes from another process here, looking only reads
+    jobs.start(workers)
+    click.echo(f"{workers} job workers running, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        jobs.stop() # <-- lets the running jobs finish
+
+# "flask check-quotes" compares the batch quote engine with room_deal_condition() and the reference prices in quotes.py
+@cli.command("check-quotes")
+@click.option("--samples", default=10000, help="Random stays priced against random catalogs.")
+@click.option("--seed", default=0)
+def check_quotes_command(samples, seed):
+    """Check that batch quotes agree with the one-stay price on every case."""
+    mismatches = check_quotes(catalog.get(), room_deal_condition, samples=samples, seed=seed)
+    for room_name, meal_deal_name, nights, expected, price in mismatches[:20]:
+        click.echo(f"{room_name}, {meal_deal_name}, {nights} nights: expected {expected}, quoted {price}")
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} quotes differ from the one-stay prices")
+    click.echo("All quotes agree with room_deal_condition() and the reference prices")
+
+# "flask build-assets" makes the resized WebP/AVIF room pictures the templates link to
+@cli.command("build-assets")
+@click.option("--widths", default=",".join(map(str, DEFAULT_WIDTHS)), show_default=True, help="Comma separated widths in pixels.")
+@click.option("--quality", default=DEFAULT_QUALITY, show_default=True)
+@click.option("--all", "all_images", is_flag=True, help="Every picture in static/img, not only the rooms.")
+def build_assets_command(widths, quality, all_images):
+    """Build resized, content-hashed copies of the room pictures and their manifest."""
+    if all_images:
+        filenames = [name for name in os.listdir(IMAGE_FOLDER) if name.lower().endswith((".jpg", ".jpeg", ".png"))]
+    else:
+        filenames = [image for room in catalog.get().rooms for image in room_gallery(room.room_name, room.image_file_name)]
+    build_assets(current_app.static_folder, filenames, widths=[int(width) for width in widths.split(",")], quality=quality,
+                 on_image=lambda filename, fresh: click.echo(f"{filename}: {'up to date' if fresh else 'built'}"))
+    assets.reload()
+    click.echo(f"Done, {len(set(filenames))} pictures in static/build/manifest.json")
 
-for deal in deals:
-    commit_to_database(deal)
-"""
 # Finally, I'll begin to construct the web application
 
-@app.route("/", methods=["GET", "POST"]) # <-- default page, no request needed = path left empty + GET and POST request method used
+@route("/", methods=["GET", "POST"]) # <-- default page, no request needed = path left empty + GET and POST request method used
+@page_cache.cached()
 def homepage():
     if request.method == "POST":
-        print("POST request received")
         location = request.form["location"]
         check_in = request.form["check_in"]
         check_out = request.form["check_out"]
         people = request.form["people"]
-        print(location, check_in, check_out, people)
+        logger.debug("search submitted", extra={"location": location, "check_in": check_in, "check_out": check_out, "people": people})
         if location and check_in and check_out and people:
             # Convert check_in and check_out to datetime.date objects
-            check_in_date = datetime.strptime(check_in, "%Y-%m-%d").date()
-            check_out_date = datetime.strptime(check_out, "%Y-%m-%d").date()
+            try:
+                check_in_date = datetime.strptime(check_in, "%Y-%m-%d").date()
+                check_out_date = datetime.strptime(check_out, "%Y-%m-%d").date()
+            except ValueError:
+                flash("Please enter the dates as YYYY-MM-DD", "info")
+                return render_template("Home.html")
             nights = (check_out_date - check_in_date).days
-            print(nights)
+            if nights < 1: # <-- the same check as the API's parse_stay
+                flash("Your check-out date must be after your check-in date", "info")
+                return render_template("Home.html")
             session["nights"] = nights
             session["location"] = location
             session["check_in"] = check_in_date
@@ -153,261 +308,248 @@ def homepage():
             flash("All fields are required", "info")
             return render_template("Home.html")
     else:
-        print("GET request received")
         return render_template("Home.html")
 
-@app.route("/about", methods=["GET", "POST"])
+@route("/about", methods=["GET", "POST"])
+@page_cache.cached()
 def about():
     return render_template("About Us.html")
 
-@app.route("/search_results", methods=["GET", "POST"])
+@route("/search_results", methods=["GET", "POST"])
 def search_results():
     if "location" in session:
         location = session["location"]
-        with Session() as db_session:
-            rooms = db_session.query(Rooms).filter(Rooms.location == location).all()
-        return render_template("Search Results.html", location=location, rooms=rooms)
+        check_in = session["check_in"]
+        check_out = session["check_out"]
+        db_session = partitions.for_location(location).session # <-- the availability of a location is in its own partition
+        snapshot = catalog.get()
+        try:
+            filters = parse_filters(request.args) # <-- filters and sort order live in the query string, e.g. ?max_price=20&sort=size
+            page = search_rooms(db_session, location, check_in, check_out, filters, request.args.get("after")) # <-- one page, seeking past the last room of the previous one
+        except InvalidSearch as error:
+            flash(str(error), "info")
+            return redirect(url_for("search_results"))
+        rooms = [snapshot.room(room_name) for room_name, _ in page.rooms if snapshot.room(room_name) is not None]
+        free_units = dict(page.rooms)
+        nights = session["nights"]
+        calendar = cheapest_dates(db_session, snapshot, location, check_in, nights, DEFAULT_MEAL_DEAL) # <-- the cheapest room for the same stay on the next days
+        return render_template("Search Results.html", location=location, rooms=rooms, free_units=free_units, filters=filters,
+                               bed_types=bed_types(snapshot, location), next_cursor=page.next_cursor,
+                               calendar=calendar, nights=nights, meal_deal=DEFAULT_MEAL_DEAL)
     else:
         return redirect(url_for("homepage"))
 
 
-@app.route("/Deals")
+@route("/Deals")
+@page_cache.cached()
 def room_deals():
-    with Session() as db_session:
-        deals = db_session.query(Deals).all()
-        rooms = db_session.query(Rooms).all()
-    return render_template("Deals.html", deals=deals, rooms=rooms)
+    snapshot = catalog.get()
+    deal_images = {
+        deal.room_name: snapshot.rooms_by_name[deal.room_name].image_file_name
+        for deal in snapshot.deals
+        if deal.room_name in snapshot.rooms_by_name and snapshot.rooms_by_name[deal.room_name].image_file_name
+    } # <-- one lookup per deal instead of looping over every room in the template, a deal without a room or picture shows none
+    return render_template("Deals.html", deals=snapshot.deals, deal_images=deal_images,
+                           catalog_fingerprint=snapshot.fingerprint)
 
 
 # function that will be used to create a booking object and commit it to the database
-def create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal):
+def create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal, customer=None):
     total_price = room_deal_condition(room, nights, meal_deal, room_deal)
-    check_in_date = datetime.strptime(check_in, "%a, %d %b %Y %H:%M:%S %Z").date()
-    check_out_date= datetime.strptime(check_out, "%a, %d %b %Y %H:%M:%S %Z").date()
-    booking = Booking(
-        check_in=check_in_date,
-        check_out=check_out_date,
-        room_selection=room.room_name,
-        nights=nights,
-        people=people,
-        total_price=total_price,
-        location=location,
-        meal_deal=meal_deal.meal_deal_name
-    )
     try:
-        commit_to_database(booking)
-        print("Booking created")
-    except Exception as e:
-        print(f"Failed to create booking: {e}")
+        # one transaction: reserve the nights, take a booking number, insert the booking
+        booking = book_room(
+            partitions.for_location(location).session,
+            catalog.get(),
+            check_in=check_in,
+            check_out=check_out,
+            room_selection=room.room_name,
+            nights=nights,
+            people=people,
+            total_price=total_price,
+            location=location,
+            meal_deal=meal_deal.meal_deal_name,
+            customer=customer, # <-- the API sends the customer with the booking, the pages add it on the Details page
+            after=queue_booking_job("booking_confirmed") if customer else None # <-- the pages queue it in add_customer()
+        ) # <-- raises RoomUnavailable when the room is full
+        logger.info("booking created", extra={"booking_number": booking.booking_number, "room": room.room_name, "nights": nights})
+    except RoomUnavailable:
+        logger.info("room unavailable", extra={"room": room.room_name, "check_in": check_in, "check_out": check_out})
+        raise
+    except Exception:
+        logger.exception("failed to create booking")
         raise
     return booking
 
+def expire_holds(hold_seconds=DEFAULT_BOOKING_HOLD_SECONDS):
+    # bookings from the booking pages that never got their customer details give their room back
+    cutoff = utc_now() - timedelta(seconds=hold_seconds)
+    expired = [number for numbers in partitions.scatter(lambda db_session: expire_held_bookings(db_session, cutoff))
+               for number in numbers]
+    for booking_number in expired:
+        logger.info("booking hold expired", extra={"booking_number": booking_number})
+    return len(expired)
+
+POST_BOOKING_SUBJECTS = {
+    "booking_confirmed": "Your Flora Hotels booking is confirmed",
+    "booking_changed": "Your Flora Hotels booking has been changed",
+    "booking_cancelled": "Your Flora Hotels booking has been cancelled",
+}
+
+def receipt_path(booking_number):
+    return os.path.join(current_app.config["RECEIPT_FOLDER"], f"FH-{booking_number}.html")
+
+def write_receipt(booking, title):
+    # the booking as it was when the job was queued, rendered to instance/receipts/FH-<number>.html
+    path = receipt_path(booking["booking_number"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        file.write(render_template("Receipt.html", booking=booking, customer=booking["customer"], title=title))
+    os.replace(path + ".tmp", path)
+    return path
+
+def notify_customer(kind, booking, attachments=()):
+    if not booking["customer"]:
+        return # <-- nobody to tell
+    current_app.extensions["notifier"].send({
+        "to": booking["customer"]["email"],
+        "subject": f"{POST_BOOKING_SUBJECTS[kind]} (FH-{booking['booking_number']})",
+        "booking": booking,
+        "attachments": list(attachments),
+    })
+
+def booking_document(booking_number):
+    # the booking and its customer as booking_to_dict() gives them, None once it has been cancelled
+    with partitions.for_booking(booking_number).Session() as db_session:
+        booking = load_booking(db_session, booking_number)
+        return booking_to_dict(booking) if booking else None
+
+# the jobs queued by the booking pages: confirmed and changed get the booking number and read
+# the booking when they run, cancelled gets the whole booking because it is gone by then
+@jobs.handler("booking_confirmed")
+def booking_confirmed(payload):
+    booking = booking_document(payload["booking_number"])
+    if booking is not None:
+        notify_customer("booking_confirmed", booking, [write_receipt(booking, "Booking Successful!")])
+
+@jobs.handler("booking_changed")
+def booking_changed(payload):
+    booking = booking_document(payload["booking_number"])
+    if booking is not None:
+        notify_customer("booking_changed", booking, [write_receipt(booking, "Booking Changed")])
+
+@jobs.handler("booking_cancelled")
+def booking_cancelled(booking):
+    if os.path.exists(receipt_path(booking["booking_number"])):
+        os.remove(receipt_path(booking["booking_number"]))
+    notify_customer("booking_cancelled", booking)
+
+def add_customer(customer):
+    # the customer and the confirmation job in one transaction, the receipt and the message come after the response
+    with partitions.for_booking(customer.booking_number).Session() as db_session:
+        db_session.add(customer)
+        enqueue(db_session, "booking_confirmed", {"booking_number": customer.booking_number})
+        db_session.commit() # <-- IntegrityError when the hold expired or the details were already saved
+
+def cancel(db_session, booking_number):
+    booking = load_booking(db_session, booking_number)
+    if booking is None:
+        return None
+    document = booking_to_dict(booking) # <-- the customer is gone once the booking is deleted
+    booking = delete_booking(db_session, booking_number)
+    enqueue(db_session, "booking_cancelled", document)
+    return booking
+
+def form_idempotency_key(action, *request_values):
+    # the key from the form, scoped to this session and to what is being submitted
+    key = request.form.get("idempotency_key") or new_key() # <-- an old form without a key is never treated as a retry
+    return scoped_key(f"{action}:{getattr(session, 'sid', None)}:{fingerprint(*request_values)}", key)
+
+def room_deal_applies(room, nights, room_deal):
+    return bundle_applies(nights, room_deal) # <-- the bundle length comes from the deal's "7 nights", no deal row no bundle
+
 def room_deal_condition(room, nights, meal_deal, room_deal):
-    if nights != 7 or room.room_name == "Standard Room":
+    if not room_deal_applies(room, nights, room_deal):
         total_price = meal_deal.meal_deal_price * nights + room.price_per_night * nights
         return total_price 
     else:
         total_price = meal_deal.meal_deal_price * nights + room_deal.new_price
         return total_price
 
-@app.route("/Standard Room", methods=["GET", "POST"])
-def standard_room():
-    location = session["location"]
-    nights = session["nights"]
-    people = session["people"]
-    check_in = session["check_in"]
-    check_out = session["check_out"]    
-    with Session() as db_session:
-        room = db_session.query(Rooms).filter(Rooms.room_name == "Standard Room", Rooms.location == location).first()
-        meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first()
-        room_deal = None # <-- this is the standard meal deal
-        if request.method == "POST":
-            if "B&b" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first() # <-- this is the standard meal deal
-                print("B&b selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Standard Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people)
-            elif "all_inclusive" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "All Inclusive").first()
-                print("All Inclusive selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Standard Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people)
-            else:
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Standard Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people)
-    
-    return render_template("Standard Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people)
-        
-
-@app.route("/Premium Room", methods=["GET", "POST"])
-def premium_room():
-    location = session["location"]
-    nights = session["nights"]
-    people = session["people"]
-    with Session() as db_session:
-        room = db_session.query(Rooms).filter(Rooms.room_name == "Premium Room", Rooms.location == location).first()
-        check_in = session["check_in"]
-        check_out = session["check_out"]
-        meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first()
-        room_deal = db_session.query(Deals).filter(Deals.room_name == "Premium Room").first()
-        if request.method == "POST":
-            if "B&b" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first() # <-- this is the standard meal deal
-                print("B&b selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Premium Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-            elif "all_inclusive" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "All Inclusive").first()
-                print("All Inclusive selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Premium Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-            else:
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Premium Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people)
-    
-    return render_template("Premium Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-
-
-
-@app.route("/Exclusive Room", methods=["GET", "POST"])
-def exclusive_room():
-    location = session["location"]
-    nights = session["nights"]
-    people = session["people"]
-    check_in = session["check_in"]
-    check_out = session["check_out"]    
-    with Session() as db_session:
-        room = db_session.query(Rooms).filter(Rooms.room_name == "Exclusive Room", Rooms.location == location).first()
-        meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first()
-        room_deal = db_session.query(Deals).filter(Deals.room_name == "Exclusive Room").first()
-        if request.method == "POST":
-            if "B&b" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first() # <-- this is the standard meal deal
-                print("B&b selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Exclusive Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-            elif "all_inclusive" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "All Inclusive").first()
-                print("All Inclusive selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Exclusive Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-            else:
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Standard Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-    
-    return render_template("Exclusive Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-
-
-@app.route("/Deluxe Room", methods=["GET", "POST"])
-def deluxe_room():
+DEFAULT_MEAL_DEAL = "Bed & Breakfast"
+IDEMPOTENCY_KEY_PLACEHOLDER = "__idempotency_key__" # <-- in the cached room page, replaced by a new key for every response
+IMAGE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "img")
+
+@lru_cache(maxsize=None)
+def room_gallery(room_name, image_file_name):
+    # the room picture followed by "<Room type> Toilet.jpg" and "<Room type> Balcony.jpg" if we have them
+    room_type = room_name.split()[0]
+    gallery = [image_file_name]
+    for extra in (f"{room_type} Toilet.jpg", f"{room_type} Balcony.jpg"):
+        if os.path.exists(os.path.join(IMAGE_FOLDER, extra)):
+            gallery.append(extra)
+    return tuple(gallery)
+
+# one page for every room in the Rooms table, the meal deal comes from the "meal_deal" form field
+@route("/rooms/<room_name>", methods=["GET", "POST"])
+@page_cache.cached("location", "nights", "people", fresh={IDEMPOTENCY_KEY_PLACEHOLDER: new_key}) # <-- only GETs are cached, booking is a POST; every visit gets its own key
+def room_detail(room_name):
+    if "location" not in session:
+        return redirect(url_for("homepage"))
     location = session["location"]
     nights = session["nights"]
     people = session["people"]
     check_in = session["check_in"]
-    check_out = session["check_out"]    
-    with Session() as db_session:
-        room = db_session.query(Rooms).filter(Rooms.room_name == "Deluxe Room", Rooms.location == location).first()
-        meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first()
-        room_deal = db_session.query(Deals).filter(Deals.room_name == "Deluxe Room").first()
-        if request.method == "POST":
-            if "B&b" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "Bed & Breakfast").first() # <-- this is the standard meal deal
-                print("B&b selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Deluxe Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people)
-            elif "all_inclusive" in request.form:
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == "All Inclusive").first()
-                print("All Inclusive selected")
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Deluxe Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-            else:
-                if 'book' in request.form:
-                    print("Book button clicked")
-                    user_booking = create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal)
-                    session['booking_number'] = user_booking.booking_number
-                    print("Booking number:", user_booking.booking_number)
-                    return redirect(url_for("booking_confirmation"))
-                else:
-                    return render_template("Deluxe Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-    
-    return render_template("Deluxe Room.html", room=room, meal_deal=meal_deal, location=location, nights=nights, people=people, room_deal=room_deal)
-
-@app.route("/Booking Confirmation")
+    check_out = session["check_out"]
+    snapshot = catalog.get()
+    room = snapshot.room(room_name, location)
+    if room is None:
+        abort(404)
+    meal_deal = snapshot.meal_deal(request.values.get("meal_deal", DEFAULT_MEAL_DEAL))
+    if meal_deal is None:
+        abort(400)
+    room_deal = snapshot.deal_for_room(room.room_name)
+
+    if request.method == "POST" and "book" in request.form:
+        key = form_idempotency_key("book", room.room_name, meal_deal.meal_deal_name, location, check_in, check_out, people)
+        try:
+            result, replayed = idempotency_keys.run(key, "", lambda: {
+                "booking_number": create_booking(room, meal_deal, nights, people, location, check_in, check_out, room_deal).booking_number
+            }, partitions.for_location(location).Session) # <-- a double click or a retried POST gets the first booking back instead of a second one
+        except RoomUnavailable:
+            flash(f"Sorry, the {room.room_name} is no longer available for these dates", "info")
+            return redirect(url_for("search_results"))
+        except IdempotencyConflict:
+            flash("Your booking is still being processed, please try again in a moment", "info")
+            return redirect(url_for("room_detail", room_name=room.room_name))
+        if replayed:
+            logger.info("booking replayed", extra={"booking_number": result["booking_number"]})
+        session['booking_number'] = result["booking_number"]
+        return redirect(url_for("booking_confirmation"))
+
+    return render_template("Room.html", room=room, idempotency_key=IDEMPOTENCY_KEY_PLACEHOLDER, meal_deal=meal_deal, meal_deals=snapshot.meal_deals,
+                           room_deal=room_deal, deal_applies=room_deal_applies(room, nights, room_deal),
+                           total_price=room_deal_condition(room, nights, meal_deal, room_deal),
+                           gallery=room_gallery(room.room_name, room.image_file_name),
+                           location=location, nights=nights, people=people)
+
+# old links like "/Premium Room" keep working, 308 keeps the method and form of a POST
+@route("/<room_name>", methods=["GET", "POST"])
+def legacy_room(room_name):
+    if catalog.get().room(room_name) is None:
+        abort(404)
+    return redirect(url_for("room_detail", room_name=room_name), code=308)
+
+@route("/Booking Confirmation")
 def booking_confirmation():
     user_booking_number = session["booking_number"]
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == user_booking_number).first()
+    db_session = partitions.for_booking(user_booking_number).session
+    booking = db_session.query(Booking).filter(Booking.booking_number == user_booking_number).first()
     if booking:
         return redirect(url_for("details"))
     return render_template("Confirm Booking.html", booking=booking)
 
-@app.route("/Details", methods=["GET", "POST"])
+@route("/Details", methods=["GET", "POST"])
 def details():
     if request.method == "POST":
         full_name = request.form["name"]
@@ -416,7 +558,6 @@ def details():
         telephone = request.form["number"]
         booking_number = session["booking_number"]
         if full_name and email and address and telephone:
-            print("All fields are filled")
             customer = Customer(
                 booking_number=booking_number,
                 name=full_name.split()[0],  # Assuming the first part is the name
@@ -425,9 +566,15 @@ def details():
                 address=address,
                 telephone=telephone
             )
+            try:
+                add_customer(customer)
+            except sa.exc.IntegrityError:
+                if partitions.for_booking(booking_number).session.get(Booking, booking_number) is None:
+                    flash("Sorry, your booking was not completed in time and the room was released", "info") # <-- the sweeper expired the hold
+                    return redirect(url_for("search_results"))
+                # <-- the details were already saved by an earlier submit of this form
             session['surname'] = full_name.split()[1]
-            commit_to_database(customer)
-            print(f"{full_name} was added to the database")
+            logger.info("customer details added", extra={"booking_number": booking_number})
             return redirect(url_for("successful_booking"))
         else:
             flash("All fields are required", "info")
@@ -436,165 +583,316 @@ def details():
         return render_template("Enter Details.html")
 
 
-@app.route("/successful_booking")
+@route("/successful_booking")
 def successful_booking():
     user_booking_number = session["booking_number"]
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == user_booking_number).first()
-        customer = db_session.query(Customer).filter(Customer.booking_number == user_booking_number).first()
+    db_session = partitions.for_booking(user_booking_number).session
+    booking = load_booking(db_session, user_booking_number) # <-- booking, customer, room and meal deal in one query
+    customer = booking.customer if booking else None
     return render_template("Booking Successful.html", booking=booking, customer=customer)
 
-@app.route("/login_booking", methods=["GET", "POST"])
+@route("/login_booking", methods=["GET", "POST"])
 def login_booking():
     
     if request.method == "POST":
         user_booking_number = request.form["booking_number"]
         user_surname = request.form["surname"]
+        if not valid_booking_number(user_booking_number):
+            flash("Incorrect booking number or surname", "info") # <-- wrong check digit, no need to ask the database
+            return render_template("Manage Booking Login.html")
 
-        with Session() as db_session:
-            customer = db_session.query(Customer).filter(
-                Customer.booking_number == user_booking_number,
-                Customer.surname == user_surname
-            ).first()
+        db_session = partitions.for_booking(user_booking_number).session # <-- the number says which partition has it
+        booking = find_booking(db_session, user_booking_number, user_surname) or archive.find(user_booking_number, user_surname)
     
-            if customer:
-                booking = db_session.query(Booking).filter(Booking.booking_number == user_booking_number).first()
-                session["booking_number"] = user_booking_number
-                session["surname"] = user_surname
-                print(f"User {user_surname} logged in successfully")
-                return redirect(url_for("manage_booking"))
-            else:
-                flash("Incorrect booking number or surname", "info")
-                return render_template("Manage Booking Login.html")
+        if booking:
+            session["booking_number"] = user_booking_number
+            session["surname"] = user_surname
+            logger.info("customer logged in", extra={"booking_number": user_booking_number})
+            return redirect(url_for("manage_booking"))
+        else:
+            flash("Incorrect booking number or surname", "info")
+            return render_template("Manage Booking Login.html")
             
     else:        
         return render_template("Manage Booking Login.html")
 
-@app.route("/manage_booking", methods=["GET", "POST"])
+@route("/manage_booking", methods=["GET", "POST"])
 def manage_booking():
     booking_number = session["booking_number"]
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == booking_number).first()
-        customer = db_session.query(Customer).filter(Customer.booking_number == booking_number).first()
+    db_session = partitions.for_booking(booking_number).session
+    booking = load_booking(db_session, booking_number) # <-- booking, customer, room and meal deal in one query
+    archived = False
+    if booking is None:
+        booking = archive.find(booking_number) # <-- a stay that is over, shown read only
+        archived = booking is not None
+    customer = booking.customer if booking else None
+    if archived:
+        if request.method == "POST":
+            flash("This stay is over, it can no longer be changed or cancelled", "info")
+        return render_template("Manage Booking.html", booking=booking, customer=customer, archived=True)
     if request.method == "POST":
         if "cancel" in request.form:
-            print("User wants to cancel the booking")
             return redirect(url_for("cancel_booking_warning"))
         elif "change" in request.form:
             return redirect(url_for("change_booking"))
     else:
         return render_template("Manage Booking.html", booking=booking, customer=customer)
 
-@app.route("/cancel_booking_warning", methods=["GET", "POST"])
+@route("/cancel_booking_warning", methods=["GET", "POST"])
 def cancel_booking_warning():
     booking_number = session["booking_number"]
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == booking_number).first()
-        customer = db_session.query(Customer).filter(Customer.booking_number == booking_number).first()
+    db_session = partitions.for_booking(booking_number).session
+    booking = load_booking(db_session, booking_number) # <-- booking, customer, room and meal deal in one query
+    customer = booking.customer if booking else None
     if request.method == "POST":
         if "Yes" in request.form:
-            print("User wants to cancel the booking pt. 2")
             return redirect(url_for("cancel_booking"))
         elif  "No" in request.form:
-            print("User wants to keep the booking")
             return redirect(url_for("manage_booking"))
     else:
         return render_template("Cancel Warning.html", booking=booking, customer=customer)
 
-@app.route("/cancel_booking", methods=["GET", "POST"])
+@route("/cancel_booking", methods=["GET", "POST"])
 def cancel_booking():
     booking_number = session["booking_number"]
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == booking_number).first()
-        customer = db_session.query(Customer).filter(Customer.booking_number == booking_number).first()
-        db_session.delete(booking)
-        db_session.delete(customer)
-        db_session.commit()
-        print(f"Booking {booking_number} and customer {customer.name} were deleted from the database")
-    return render_template("Booking Cancelled.html", booking=booking, customer=customer)
+    # a single DELETE ... RETURNING, the customer is removed by the database through the cascade
+    booking = run_in_transaction(partitions.for_booking(booking_number).session, lambda db_session: cancel(db_session, booking_number))
+    logger.info("booking cancelled", extra={"booking_number": booking_number})
+    return render_template("Booking Cancelled.html", booking=booking)
 
-@app.route("/change_booking", methods=["GET", "POST"])
+@route("/change_booking", methods=["GET", "POST"])
 def change_booking():
     booking_number = session["booking_number"]
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == booking_number).first()
-        customer = db_session.query(Customer).filter(Customer.booking_number == booking_number).first()
-        if request.method == "POST":
-            if "check_in" not in request.form or "check_out"  not in request.form:
-                return "Error: Required fields are missing in the form submission", 400
+    db_session = partitions.for_booking(booking_number).session
+    booking = load_booking(db_session, booking_number) # <-- booking, customer, room and meal deal in one query
+    customer = booking.customer if booking else None
+    if request.method == "POST":
+        if "check_in" not in request.form or "check_out"  not in request.form:
+            return "Error: Required fields are missing in the form submission", 400
             
-            new_check_in = request.form["check_in"]
-            new_check_out = request.form["check_out"]
-            new_people = request.form["people"]
-            new_meal_deal = request.form["meal_deal"]
+        new_check_in = request.form["check_in"]
+        new_check_out = request.form["check_out"]
+        new_people = request.form["people"]
+        new_meal_deal = request.form["meal_deal"]
+        try:
             check_in_date = datetime.strptime(new_check_in, "%Y-%m-%d").date()
             check_out_date = datetime.strptime(new_check_out, "%Y-%m-%d").date()
-            nights = (check_out_date - check_in_date).days
-            session["new_check_in"] = check_in_date
-            session["new_check_out"] = check_out_date
-            session["new_people"] = new_people
-            session["new_nights"] = nights
-            session["new_meal_deal"] = new_meal_deal
-            return redirect(url_for("change_booking_confirmation"))
-        else:    
-            return render_template("Change Booking.html", booking=booking, customer=customer)
-
-@app.route("/change_booking_confirmation", methods=["GET", "POST"])
+        except ValueError:
+            flash("Please enter the dates as YYYY-MM-DD", "info")
+            return redirect(url_for("change_booking"))
+        nights = (check_out_date - check_in_date).days
+        if nights < 1:
+            flash("Your check-out date must be after your check-in date", "info")
+            return redirect(url_for("change_booking"))
+        session["new_check_in"] = check_in_date
+        session["new_check_out"] = check_out_date
+        session["new_people"] = new_people
+        session["new_nights"] = nights
+        session["new_meal_deal"] = new_meal_deal
+        return redirect(url_for("change_booking_confirmation"))
+    else:    
+        return render_template("Change Booking.html", booking=booking, customer=customer)
+
+@route("/change_booking_confirmation", methods=["GET", "POST"])
 def change_booking_confirmation():
-    check_in_date = session["new_check_in"] 
+    new_check_in = session["new_check_in"] # <-- date objects, the session store keeps their type
     new_check_out = session["new_check_out"] 
     new_people = session["new_people"]
     new_nights = session["new_nights"] 
     new_meal_deal = session["new_meal_deal"]
     booking_number = session["booking_number"]
-    print(check_in_date, new_check_out, new_people, new_nights, new_meal_deal)
-    new_check_in =  datetime.strptime(session["new_check_in"], "%a, %d %b %Y %H:%M:%S %Z").date()
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == booking_number).first()
-        customer = db_session.query(Customer).filter(Customer.booking_number == booking_number).first()
-        old_check_in = booking.check_in
-
-        if request.method == "POST": 
-            if "confirm" in request.form:
-                print("User confirmed the booking change.")  
-                check_in_date = new_check_in #<-- already in the correct format
-                check_out_date = datetime.strptime(new_check_out, "%a, %d %b %Y %H:%M:%S %Z").date()
-
-                # Update booking object
-                booking.check_in = check_in_date
-                booking.check_out = check_out_date
-                booking.nights = new_nights
-                booking.people = new_people
-                booking.meal_deal = new_meal_deal 
-                db_session.commit()
-                print("Booking updated in the database.")  # Debugging
-
-                
-                room = db_session.query(Rooms).filter(Rooms.room_name == booking.room_selection).first()
-                meal_deal = db_session.query(MealDeals).filter(MealDeals.meal_deal_name == new_meal_deal).first()
-                room_deal = db_session.query(Deals).filter(Deals.room_name == booking.room_selection).first()
-
-                # Update the total price based on the new values
-                booking.total_price = room_deal_condition(room, new_nights, meal_deal, room_deal)
-                db_session.commit()
-
-                print("Booking updated")
-                return redirect(url_for("change_booking_successful"))
-            elif "deny" in request.form:
-                print("User wants to keep the booking")
+    db_session = partitions.for_booking(booking_number).session
+    booking = load_booking(db_session, booking_number) # <-- booking, customer, room and meal deal in one query
+    customer = booking.customer if booking else None
+    old_check_in = booking.check_in
+
+    if request.method == "POST": 
+        if "confirm" in request.form:
+            snapshot = catalog.get()
+            room = snapshot.room(booking.room_selection)
+            meal_deal = snapshot.meal_deal(new_meal_deal)
+            if meal_deal is None: # <-- not one of our meal deals, the form was changed or the deal was removed
+                flash("Please choose one of our meal deals", "info")
+                return redirect(url_for("change_booking"))
+            room_deal = snapshot.deal_for_room(booking.room_selection)
+
+            key = form_idempotency_key("change", booking.booking_number, new_check_in, new_check_out, new_people, new_meal_deal)
+            def change():
+                # the old nights are given back and the new ones reserved in one transaction
+                moved = move_booking(
+                    db_session,
+                    snapshot,
+                    booking.booking_number,
+                    after=queue_booking_job("booking_changed"), # <-- new receipt and message, sent after the response
+                    check_in=new_check_in,
+                    check_out=new_check_out,
+                    nights=new_nights,
+                    people=new_people,
+                    meal_deal=new_meal_deal,
+                    total_price=room_deal_condition(room, new_nights, meal_deal, room_deal) # <-- total price based on the new values
+                )
+                return moved.booking_number if moved is not None else None
+
+            try:
+                changed, _ = idempotency_keys.run(key, "", change, partitions.for_booking(booking_number).Session) # <-- sent twice, the second one finds the change already made
+            except RoomUnavailable:
+                flash("Sorry, your room is not available for the new dates", "info")
                 return redirect(url_for("change_booking"))
-        else: 
-            return render_template("Change Confirm.html", booking=booking, customer=customer, old_check_in=old_check_in, new_check_in=new_check_in)
+            except IdempotencyConflict:
+                flash("Your change is still being processed, please try again in a moment", "info")
+                return redirect(url_for("change_booking"))
+            if changed is None:
+                flash("Sorry, this booking no longer exists", "info") # <-- cancelled while the change was being confirmed
+                return redirect(url_for("login_booking"))
+            logger.info("booking changed", extra={"booking_number": booking.booking_number, "check_in": new_check_in, "nights": new_nights})
+            return redirect(url_for("change_booking_successful"))
+        elif "deny" in request.form:
+            return redirect(url_for("change_booking"))
+    else: 
+        return render_template("Change Confirm.html", booking=booking, customer=customer, old_check_in=old_check_in, new_check_in=new_check_in,
+                               idempotency_key=new_key())
     
-@app.route("/change_booking_successful")
+@route("/change_booking_successful")
 def change_booking_successful():
     booking_number = session["booking_number"]
-    with Session() as db_session:
-        booking = db_session.query(Booking).filter(Booking.booking_number == booking_number).first()
-        customer = db_session.query(Customer).filter(Customer.booking_number == booking_number).first()
+    db_session = partitions.for_booking(booking_number).session
+    booking = load_booking(db_session, booking_number) # <-- booking, customer, room and meal deal in one query
+    customer = booking.customer if booking else None
     return render_template("Booking Change Successful.html", booking=booking, customer=customer)
 
+REPORT_PAGE_ROWS = 500 # <-- rows shown on the reports page, the CSV download has all of them
+
+def reports_allowed():
+    # the reports need REPORTS_TOKEN as ?token=... or "Authorization: Bearer ...", only the debug server shows them without one
+    token = current_app.config.get("REPORTS_TOKEN")
+    if not token:
+        return current_app.debug
+    given = request.args.get("token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return hmac.compare_digest(given.encode(), str(token).encode())
+
+def report_arguments():
+    if not reports_allowed():
+        abort(403)
+    first_of_month = date.today().replace(day=1)
+    try:
+        start = datetime.strptime(request.args.get("start") or first_of_month.isoformat(), "%Y-%m-%d").date()
+        end = datetime.strptime(request.args.get("end") or (first_of_month + timedelta(days=31)).replace(day=1).isoformat(), "%Y-%m-%d").date()
+        group_by = parse_group_by(",".join(request.args.getlist("group_by")))
+    except ValueError as error:
+        abort(400, str(error))
+    if end <= start:
+        abort(400, "end must be after start")
+    return start, end, group_by, request.args.get("location") or None
+
+def report_rows(snapshot, start, end, group_by, location=None):
+    # a location is reported on by its own partition, every location by all of them at once, added up
+    if location or not partitions.partitioned:
+        with partitions.for_location(location).Session() as db_session:
+            yield from iter_report(db_session, snapshot, start, end, group_by, location)
+        return
+    with ExitStack() as sessions: # <-- one open cursor per partition, read a batch at a time while the rows are merged
+        totals = [report_totals(sessions.enter_context(partition.Session()), start, end, group_by) for partition in partitions.all()]
+        yield from report_measures(merge_totals(totals, group_by), snapshot, start, end, group_by)
+
+@route("/reports")
+def reports():
+    start, end, group_by, location = report_arguments()
+    snapshot = catalog.get()
+    rows = list(islice(report_rows(snapshot, start, end, group_by, location), REPORT_PAGE_ROWS + 1))
+    totals = next(report_rows(snapshot, start, end, (), location), None) # <-- the same measures over the whole period
+    return render_template("Reports.html", rows=rows[:REPORT_PAGE_ROWS], truncated=len(rows) > REPORT_PAGE_ROWS, totals=totals,
+                           start=start, end=end, group_by=group_by, location=location, dimensions=DIMENSIONS, measures=MEASURES,
+                           locations=sorted(snapshot.rooms_by_location))
+
+@route("/reports.csv")
+def report_csv():
+    start, end, group_by, location = report_arguments()
+    snapshot = catalog.get()
+
+    def generate():
+        # report_rows() opens its own sessions, the rows are still being sent after the request's session is gone
+        yield from iter_csv(report_rows(snapshot, start, end, group_by, location), [*group_by, *MEASURES])
+
+    return Response(generate(), mimetype="text/csv",
+                    headers={"Content-Disposition": f'attachment; filename="report-{start}-{end}.csv"'})
+
+def create_app(config=None):
+    """Builds the application. ``config`` is applied last, over the defaults and the FLASK_*
+    environment variables, e.g. create_app({"DATABASE_URL": "sqlite:////srv/hotel/hotel.db"}).
+
+    With PRELOAD set the catalog and the templates are loaded before returning, see preload().
+    Nothing is written to the database, "flask db-upgrade" (prepare_database()) does that.
+    """
+    app = Flask(__name__) # <-- to set up our flask application while refencing this file
+    app.config.from_mapping(
+        DATABASE_URL=default_database_url(app.instance_path), # <-- instance/Flora_Hotel.db next to this file
+        SESSION_BACKEND="sqlite",
+        SESSION_SQLITE_PATH=os.path.join(app.instance_path, "sessions.db"),
+        ADMISSION_SQLITE_PATH=os.path.join(app.instance_path, "admission.db"),
+        RECEIPT_FOLDER=os.path.join(app.instance_path, "receipts"),
+        NOTIFICATION_FOLDER=os.path.join(app.instance_path, "outbox"), # <-- where the stand-in notifier writes messages
+        PRELOAD=False,
+    )
+    app.config.from_prefixed_env() # <-- e.g. FLASK_DATABASE_URL=postgresql+psycopg://... or FLASK_DATABASE_POOL_SIZE=10
+    app.config.from_mapping(config or {})
+    configure_logging(app.config.get("LOG_LEVEL", DEFAULT_LOG_LEVEL)) # <-- JSON lines on stderr, written by a background thread
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.secret_key = "41038"  # <-- secret key for session management
+    app.session_interface = session_interface_from_config(app.config) # <-- the cookie only holds a session id, the values stay on the server
+
+    database.init_app(app) # <-- the session of a request is closed when the request ends
+    database.on_engine(metrics.instrument_engine)
+    archive.init_app(app) # <-- ARCHIVE_DATABASE_URL, instance/Flora_Hotel_archive.db by default
+    archive.database.on_engine(metrics.instrument_engine)
+    partitions.init_app(app) # <-- DATABASE_PARTITIONS, e.g. {"1": {"url": "sqlite:////srv/hotel/uk.db", "locations": ["United Kingdom"]}}
+    assets.init_app(app)
+    page_cache.init_app(app)
+    metrics.init_app(app) # <-- METRICS_DIRECTORY adds up the numbers of every worker, gunicorn.conf.py sets it
+    metrics.allowed = reports_allowed # <-- /metrics needs the reports token too
+    admission.init_app(app) # <-- after metrics, a rejected request is still timed; ADMISSION_ENABLED=False turns it off
+    idempotency_keys.ttl = int(app.config.get("IDEMPOTENCY_TTL", DEFAULT_TTL))
+    hold_seconds = int(app.config.get("BOOKING_HOLD_SECONDS", DEFAULT_BOOKING_HOLD_SECONDS))
+    sweeper = Sweeper(app) # <-- removes expired holds and idempotency keys in the background
+    sweeper.add("held bookings", lambda: expire_holds(hold_seconds))
+    sweeper.add("idempotency keys", idempotency_keys.sweep)
+    sweeper.add("finished jobs", jobs.sweep)
+    jobs.init_app(app) # <-- JOB_WORKERS threads per process, started by its first request
+    app.extensions["notifier"] = notifier_from_config(app.config)
+
+    for rule, view, options in views:
+        app.add_url_rule(rule, view_func=view, **options)
+    for command in cli.commands.values():
+        app.cli.add_command(command)
+    # the same searches, prices and bookings as JSON under /api/v1, one request per operation
+    Api(app, partitions, catalog, create_booking, room_deal_condition, idempotency_keys, archive)
+
+    if app.config["PRELOAD"]: # <-- the database is only read here, "flask db-upgrade" prepares it before a deploy
+        preload(app)
+    return app
+
+def preload(app):
+    """Does the work every worker would otherwise repeat, once, before gunicorn forks them.
+
+    Loads the catalog, the price table and the room galleries, compiles every template,
+    closes the database connections and then freezes the garbage collector: objects
+    that exist now are never scanned again, so a collection in a worker doesn't write
+    to the pages it shares copy-on-write with the master and the other workers.
+    """
+    gc.disable() # <-- no collection while the shared objects are being made
+    with app.app_context():
+        snapshot = catalog.get()
+        price_table(snapshot)
+        for room in snapshot.rooms:
+            room_gallery(room.room_name, room.image_file_name)
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name) # <-- compiled once and kept in the environment's cache
+    database.remove_session()
+    database.dispose() # <-- every worker opens its own connections
+    archive.dispose()
+    gc.freeze()
+    gc.enable()
+    logger.info("preloaded", extra={"rooms": len(snapshot.rooms), "templates": len(app.jinja_env.cache or ())})
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True) # <-- development server, "gunicorn -c gunicorn.conf.py" runs the workers
\ No newline at end of file
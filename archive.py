@@ -0,0 +1,188 @@
+import json
+import os
+import zlib
+from datetime import date, datetime
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Mapped, declarative_base, mapped_column
+
+from database import Database
+from bookings import run_in_transaction
+from models import Booking, Customer, RoomNight, utc_now
+from persistence import object_to_row, upsert_statement
+
+
+# Stays that are over are moved out of the live booking and customers tables into an
+# archive database of their own, so the tables every search, availability check and
+# login reads only hold the bookings that can still change. An archived booking is a
+# single row: its number, location and check-out as columns, the booking with its
+# customer as zlib-compressed JSON. A booking is archived as it was deleted from the
+# live tables; archiving it again overwrites the row. The report aggregates
+# (daily_revenue) keep the archived nights.
+
+ARCHIVE_FILE_NAME = "Flora_Hotel_archive.db"
+DEFAULT_ARCHIVE_AFTER_DAYS = 30  # <-- a stay is archived a month after check-out
+ARCHIVE_BATCH_SIZE = 500  # <-- bookings per transaction, the live database's write lock is never held long
+FORMAT = 1  # <-- how data is encoded, kept on every row so older rows can still be read after a change
+
+# zlib's preset dictionary: the keys and common values every document repeats, a row of a
+# few hundred bytes compresses about twice as well with it. FORMAT 1 rows need exactly this one.
+ZDICT = (
+    b'{"booking_number":,"check_in":"20","check_out":"20","room_selection":" Room","nights":,"people":,'
+    b'"total_price":,"location":"United Kingdom","meal_deal":"Bed & Breakfast","All Inclusive",'
+    b'"created_at":"20","customer":{"name":"","surname":"","email":"@gmail.com","address":"","telephone":}}'
+)
+
+ArchiveBase = declarative_base()  # <-- only the archive database has these tables
+
+
+class ArchivedBooking(ArchiveBase):
+    __tablename__ = "archived_bookings"
+
+    booking_number: Mapped[int] = mapped_column(sa.Integer, primary_key=True, autoincrement=False)
+    location: Mapped[str]
+    check_out: Mapped[date] = mapped_column(index=True)
+    archived_at: Mapped[datetime]
+    format: Mapped[int]
+    data: Mapped[bytes]  # <-- the booking and its customer, see encode()
+
+    def __repr__(self):
+        return f"<ArchivedBooking(booking_number={self.booking_number}, location={self.location}, check_out={self.check_out})>"
+
+
+def default_archive_url(instance_path):
+    return "sqlite:///" + os.path.join(instance_path, ARCHIVE_FILE_NAME)
+
+
+def encode(booking, customer):
+    document = object_to_row(booking)
+    document["customer"] = {key: value for key, value in object_to_row(customer).items() if key != "booking_number"} if customer else None
+    compressor = zlib.compressobj(9, zdict=ZDICT)
+    return compressor.compress(json.dumps(document, separators=(",", ":"), default=str).encode()) + compressor.flush()
+
+
+def decode(row):
+    """The archived booking with the attributes of a Booking, customer included, for the templates and the API."""
+    if row.format != FORMAT:
+        raise ValueError(f"archived booking {row.booking_number} has unknown format {row.format}")
+    document = json.loads(zlib.decompressobj(zdict=ZDICT).decompress(row.data))
+    document["check_in"] = date.fromisoformat(document["check_in"])
+    document["check_out"] = date.fromisoformat(document["check_out"])
+    customer = document.pop("customer")
+    return SimpleNamespace(**document, customer=SimpleNamespace(**customer) if customer else None)
+
+
+def due_statement(cutoff, limit=ARCHIVE_BATCH_SIZE):
+    # the next bookings to archive, with their customer when they have one
+    return (
+        sa.select(Booking, Customer)
+        .outerjoin(Customer, Customer.booking_number == Booking.booking_number)
+        .where(Booking.check_out < cutoff)
+        .order_by(Booking.check_out)
+        .limit(limit)
+    )
+
+
+class Archive:
+    """The archive database and the pipeline that fills it.
+
+    ``archive_stays(db_session, cutoff)`` moves the bookings of one live database
+    (one partition) that checked out before cutoff, ``find()`` looks a booking up
+    once it is no longer in the live tables.
+    """
+
+    def __init__(self, app=None):
+        self.database = None
+        self.after_days = DEFAULT_ARCHIVE_AFTER_DAYS
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["archive"] = self
+        self.after_days = int(app.config.get("ARCHIVE_AFTER_DAYS", self.after_days))
+        if self.database is not None:
+            self.database.dispose()
+        url = app.config.get("ARCHIVE_DATABASE_URL") or default_archive_url(app.instance_path)
+        self.database = Database(dict(app.config, DATABASE_URL=url, DATABASE_PARTITIONS={}))
+
+    def prepare(self):
+        ArchiveBase.metadata.create_all(self.database.engine)  # <-- only creates what is missing
+
+    def dispose(self):
+        if self.database is not None:
+            self.database.dispose()
+
+    def find(self, booking_number, surname=None):
+        # like find_booking(): with a surname the booking only comes back when it matches
+        with self.database.Session() as db_session:
+            row = db_session.get(ArchivedBooking, int(booking_number))
+        if row is None:
+            return None
+        booking = decode(row)
+        if surname is not None and (booking.customer is None or booking.customer.surname != surname):
+            return None
+        return booking
+
+    def archived_through(self):
+        # the latest check-out in the archive, the nights from then on are only in the live tables
+        with self.database.Session() as db_session:
+            return db_session.execute(sa.select(sa.func.max(ArchivedBooking.check_out))).scalar()
+
+    def archive_stays(self, db_session, cutoff, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None, on_batch=None):
+        """Moves the bookings of db_session's database that checked out before cutoff.
+
+        Every batch is deleted from the live database in a write transaction and only
+        the bookings that delete returned are written to the archive, committed before
+        the live transaction is. A run that stops in between leaves the bookings live
+        and archived; the next run archives them again over the old rows.
+        Returns how many bookings were archived.
+        """
+        archived = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            moved = run_in_transaction(db_session, lambda db_session: self._archive_batch(db_session, cutoff, batch_size))
+            db_session.expunge_all()
+            if not moved:
+                break
+            archived += moved
+            batches += 1
+            if on_batch is not None:
+                on_batch(archived)
+        self.prune_nights(db_session, cutoff)
+        return archived
+
+    def _archive_batch(self, db_session, cutoff, batch_size):
+        # the customers are read first, the delete takes them with their booking (ON DELETE CASCADE)
+        rows = db_session.execute(due_statement(cutoff, batch_size)).all()
+        if not rows:
+            return 0
+        customers = {booking.booking_number: customer for booking, customer in rows}
+        deleted = db_session.scalars(
+            sa.delete(Booking)
+            .where(Booking.booking_number.in_(customers), Booking.check_out < cutoff)
+            .returning(Booking)
+        ).all()  # <-- the bookings as they were deleted; the nights stay counted in the reports, no release()
+        if deleted:
+            now = utc_now()
+            with self.database.Session() as archive_session:
+                statement = upsert_statement(archive_session, ArchivedBooking)
+                statement = statement.on_conflict_do_update(
+                    index_elements=[ArchivedBooking.booking_number],
+                    set_={key: statement.excluded[key] for key in ("location", "check_out", "archived_at", "format", "data")},
+                )  # <-- archived by a run that stopped before the live commit, the booking may have changed since
+                archive_session.execute(statement, [
+                    {"booking_number": booking.booking_number, "location": booking.location, "check_out": booking.check_out,
+                     "archived_at": now, "format": FORMAT, "data": encode(booking, customers[booking.booking_number])}
+                    for booking in deleted
+                ])
+                archive_session.commit()
+        return len(deleted)
+
+    def prune_nights(self, db_session, cutoff):
+        # room_nights before the first night of every live booking only ever counted archived stays
+        first_night = db_session.execute(sa.select(sa.func.min(Booking.check_in))).scalar()
+        before = min(cutoff, first_night) if first_night else cutoff
+        deleted = db_session.execute(sa.delete(RoomNight).where(RoomNight.night < before)).rowcount
+        db_session.commit()
+        return deleted
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import json
+import os
+
+from flask import request, url_for
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image, features
+except ImportError:  # <-- Pillow is only needed to build the images, not to serve them
+    Image = None
+    features = None
+
+
+# Resized WebP / AVIF copies of the room pictures. "flask build-assets" writes them to
+# static/build/img with a hash of their content in the file name, plus a manifest.json
+# that responsive_image() reads to write <picture> tags with srcset. Because a changed
+# picture gets a new file name, the built files can be cached by browsers for a year.
+
+DEFAULT_WIDTHS = (320, 640, 1024)
+DEFAULT_QUALITY = 75
+BUILD_FOLDER = "build"
+MANIFEST_NAME = "manifest.json"
+IMMUTABLE_MAX_AGE = 31536000  # <-- one year, the longest browsers honour
+
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def available_formats():
+    # the modern formats this Pillow build can write, best compression first
+    if Image is None:
+        return ()
+    return tuple(name for name in ("avif", "webp") if features.check(name))
+
+
+def encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    options = {"quality": quality}
+    if image_format == "jpeg":
+        options["optimize"] = True
+        if image.mode != "RGB":  # <-- JPEG has no transparency, flatten onto white
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+    image.save(buffer, format=image_format.upper(), **options)
+    return buffer.getvalue()
+
+
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()[:16]
+
+
+def build_image(static_folder, filename, widths=DEFAULT_WIDTHS, quality=DEFAULT_QUALITY):
+    """Writes every variant of static/img/<filename> and returns its manifest entry."""
+    source = os.path.join(static_folder, "img", filename)
+    output_folder = os.path.join(static_folder, BUILD_FOLDER, "img")
+    os.makedirs(output_folder, exist_ok=True)
+    stem = os.path.splitext(filename)[0].replace(" ", "-").lower()
+
+    with Image.open(source) as original:
+        original.load()
+    if original.mode not in ("RGB", "RGBA"):
+        original = original.convert("RGBA")
+    fallback = "jpeg"  # <-- for browsers without WebP, much smaller than PNG for photos
+    formats = available_formats() + (fallback,)
+
+    variants = {image_format: [] for image_format in formats}
+    for width in sorted({min(width, original.width) for width in widths}):  # <-- never upscale
+        height = round(original.height * width / original.width)
+        resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+        for image_format in formats:
+            data = encode(resized, image_format, quality)
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            name = f"{stem}.{width}.{digest}.{'jpg' if image_format == 'jpeg' else image_format}"
+            with open(os.path.join(output_folder, name), "wb") as file:
+                file.write(data)
+            variants[image_format].append([width, f"{BUILD_FOLDER}/img/{name}"])
+    return {
+        "source": file_hash(source),
+        "width": original.width,
+        "height": original.height,
+        "fallback": fallback,
+        "variants": variants,
+    }
+
+
+def variants_exist(static_folder, entry):
+    return all(
+        os.path.exists(os.path.join(static_folder, path))
+        for variants in entry["variants"].values()
+        for _, path in variants
+    )
+
+
+def build_assets(static_folder, filenames, widths=DEFAULT_WIDTHS, quality=DEFAULT_QUALITY, on_image=None):
+    """Builds the variants of every file in static/img that is missing or changed and saves the manifest.
+
+    Pictures whose content and settings are the same as in the existing manifest are skipped.
+    """
+    if Image is None:
+        raise RuntimeError("building images needs Pillow, install it with: pip install Pillow")
+    manifest_path = os.path.join(static_folder, BUILD_FOLDER, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    settings = {"widths": list(widths), "quality": quality, "formats": list(available_formats())}
+    if manifest.get("settings") != settings:
+        manifest = {}
+    images = manifest.get("images", {})
+
+    for filename in sorted(set(filenames)):
+        entry = images.get(filename)
+        fresh = (
+            entry is not None
+            and entry["source"] == file_hash(os.path.join(static_folder, "img", filename))
+            and variants_exist(static_folder, entry)
+        )
+        if not fresh:
+            images[filename] = build_image(static_folder, filename, widths, quality)
+        if on_image is not None:
+            on_image(filename, fresh)
+
+    manifest = {"settings": settings, "images": images}
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+class Assets:
+    """Reads the manifest once and gives templates responsive_image()."""
+
+    def __init__(self, app=None):
+        self.images = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.reload()
+        app.jinja_env.globals["responsive_image"] = self.responsive_image
+        app.after_request(self.cache_built_files)
+
+    def reload(self):
+        manifest = load_manifest(os.path.join(self.static_folder, BUILD_FOLDER, MANIFEST_NAME))
+        self.images = manifest.get("images", {})
+
+    def responsive_image(self, filename, alt="", sizes="100vw", loading="lazy", **attributes):
+        """A <picture> with an AVIF / WebP srcset and a fallback <img> for static/img/<filename>.
+
+        Falls back to a plain <img> of the original file when it hasn't been built.
+        Pass loading="eager" for a picture that is visible as soon as the page opens.
+        """
+        html_attributes = "".join(
+            f' {name.rstrip("_").replace("_", "-")}="{escape(value)}"' for name, value in attributes.items()
+        )  # <-- class_="x" for the class attribute
+        entry = self.images.get(filename)
+        if entry is None:
+            src = url_for("static", filename="img/" + filename)
+            return Markup(f'<img src="{escape(src)}" alt="{escape(alt)}"{html_attributes}>')
+
+        def srcset(variants):
+            return ", ".join(f"{escape(url_for('static', filename=path))} {width}w" for width, path in variants)
+
+        variants = entry["variants"]
+        fallback_variants = variants[entry["fallback"]]
+        sources = "".join(
+            f'<source type="{MIME_TYPES[image_format]}" srcset="{srcset(variants[image_format])}" sizes="{escape(sizes)}">'
+            for image_format in ("avif", "webp") if image_format in variants  # <-- the browser takes the first it supports
+        )
+        src = url_for("static", filename=fallback_variants[-1][1])
+        return Markup(
+            f"<picture>{sources}"
+            f'<img src="{escape(src)}" srcset="{srcset(fallback_variants)}" sizes="{escape(sizes)}"'
+            f' width="{entry["width"]}" height="{entry["height"]}" alt="{escape(alt)}" loading="{escape(loading)}"'
+            f' decoding="async"{html_attributes}></picture>'
+        )
+
+    def cache_built_files(self, response):
+        # built files never change under the same name, so browsers may keep them for a year
+        if request.endpoint == "static" and (request.view_args or {}).get("filename", "").startswith(BUILD_FOLDER + "/"):
+            if response.status_code in (200, 304):
+                response.cache_control.no_cache = None  # <-- Flask sends no-cache for static files by default
+                response.cache_control.public = True
+                response.cache_control.max_age = IMMUTABLE_MAX_AGE
+                response.cache_control.immutable = True
+        return response
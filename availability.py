@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+import sqlalchemy as sa
+
+from models import Booking, Rooms, RoomInventory, RoomNight
+from persistence import upsert_statement
+
+
+# Availability is answered from the room_nights table (how many units of a room type
+# are booked on each night) and the inventory in the catalog snapshot, so checking a
+# stay only reads one row per night instead of going through every booking.
+
+DEFAULT_ROOM_UNITS = 10
+
+
+class RoomUnavailable(Exception):
+    def __init__(self, room_name, location, check_in, check_out):
+        super().__init__(f"{room_name} in {location} is fully booked between {check_in} and {check_out}")
+        self.room_name = room_name
+        self.location = location
+        self.check_in = check_in
+        self.check_out = check_out
+
+
+def stay_nights(check_in, check_out):
+    return [check_in + timedelta(days=offset) for offset in range((check_out - check_in).days)]
+
+
+def max_booked(db_session, room_name, location, check_in, check_out):
+    booked = db_session.execute(
+        sa.select(sa.func.max(RoomNight.booked)).where(
+            RoomNight.location == location,
+            RoomNight.room_name == room_name,
+            RoomNight.night >= check_in,
+            RoomNight.night < check_out,
+        )
+    ).scalar()
+    return booked or 0
+
+
+def free_units(db_session, snapshot, room_name, location, check_in, check_out):
+    # the number of units that are free on every night of [check_in, check_out)
+    units = snapshot.units(room_name, location)
+    if units <= 0:
+        return 0
+    return max(units - max_booked(db_session, room_name, location, check_in, check_out), 0)
+
+
+def free_units_by_room(db_session, snapshot, location, check_in, check_out):
+    # the same as free_units() for every room in a location with a single query
+    rows = db_session.execute(
+        sa.select(RoomNight.room_name, sa.func.max(RoomNight.booked))
+        .where(
+            RoomNight.location == location,
+            RoomNight.night >= check_in,
+            RoomNight.night < check_out,
+        )
+        .group_by(RoomNight.room_name)
+    ).all()
+    booked = dict(rows)
+    return {
+        room.room_name: max(snapshot.units(room.room_name, location) - booked.get(room.room_name, 0), 0)
+        for room in snapshot.rooms_in(location)
+    }
+
+
+def available_rooms(db_session, snapshot, location, check_in, check_out, units=1):
+    free = free_units_by_room(db_session, snapshot, location, check_in, check_out)
+    return [room for room in snapshot.rooms_in(location) if free[room.room_name] >= units]
+
+
+def add_night_counts(db_session, counts):
+    # counts maps (location, room_name, night) to the number of units to add (or remove)
+    if not counts:
+        return
+    statement = upsert_statement(db_session, RoomNight)
+    statement = statement.on_conflict_do_update(
+        index_elements=[RoomNight.location, RoomNight.room_name, RoomNight.night],
+        set_={"booked": RoomNight.booked + statement.excluded.booked},
+    )
+    db_session.execute(statement, [
+        {"location": location, "room_name": room_name, "night": night, "booked": booked}
+        for (location, room_name, night), booked in counts.items()
+    ])
+
+
+def count_nights(stays):
+    # stays are (room_name, location, check_in, check_out) tuples
+    counts = {}
+    for room_name, location, check_in, check_out in stays:
+        for night in stay_nights(check_in, check_out):
+            key = (location, room_name, night)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def adjust_nights(db_session, room_name, location, check_in, check_out, delta):
+    # add (or with a negative delta remove) bookings from every night of the stay
+    add_night_counts(db_session, {
+        (location, room_name, night): delta for night in stay_nights(check_in, check_out)
+    })
+
+
+def reserve(db_session, snapshot, room_name, location, check_in, check_out):
+    if check_out <= check_in: # <-- no nights to reserve, the booking would be free or have a negative price
+        raise ValueError(f"a stay needs at least one night, got {check_in} to {check_out}")
+    if free_units(db_session, snapshot, room_name, location, check_in, check_out) < 1:
+        raise RoomUnavailable(room_name, location, check_in, check_out)
+    adjust_nights(db_session, room_name, location, check_in, check_out, 1)
+
+
+def release(db_session, room_name, location, check_in, check_out):
+    adjust_nights(db_session, room_name, location, check_in, check_out, -1)
+
+
+def ensure_inventory(db_session, default_units=DEFAULT_ROOM_UNITS):
+    # every room gets an inventory row at its own location, existing rows are left alone
+    known = set(db_session.execute(sa.select(RoomInventory.room_name, RoomInventory.location)).all())
+    missing = [
+        {"room_name": room_name, "location": location, "units": default_units}
+        for room_name, location in db_session.execute(sa.select(Rooms.room_name, Rooms.location))
+        if (room_name, location) not in known
+    ]
+    if missing:
+        db_session.execute(sa.insert(RoomInventory), missing)
+    return len(missing)
+
+
+def rebuild_occupancy(db_session):
+    # recomputes room_nights from the booking table, only needed once for an existing database
+    db_session.execute(sa.delete(RoomNight))
+    counts = count_nights(db_session.execute(
+        sa.select(Booking.room_selection, Booking.location, Booking.check_in, Booking.check_out)
+    ))
+    add_night_counts(db_session, counts)
+    return len(counts)
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+from benchmarks.common import summarize
+from benchmarks.micro import per_call, time_calls
+
+
+# What admission control adds to every login and booking request: taking a token from
+# each bucket backend, and admit() + release() with a concurrency slot, for many
+# clients (every call is admitted, rejecting costs the same). All numbers per call.
+
+
+def run_admission(workdir, repeat=20000, clients=1000):
+    from flask import Flask
+
+    from admission import AdmissionControl, ConcurrencyLimit, MemoryBuckets, SQLiteBuckets
+    from metrics import Metrics
+
+    keys = [(f"booking|10.0.{index // 256}.{index % 256}", 1000.0, 1000) for index in range(clients)]
+    metrics = {}
+    for name, buckets in (("memory", MemoryBuckets()), ("sqlite", SQLiteBuckets(os.path.join(workdir, "admission.db")))):
+        started = time.perf_counter()
+        timings = time_calls(buckets.take, keys, repeat)
+        metrics[f"take_{name}"] = per_call(summarize(timings, wall_seconds=time.perf_counter() - started, unit="us"))
+
+    limit = ConcurrencyLimit(2, 0.5)
+
+    def slot():
+        limit.acquire()
+        limit.release()
+
+    started = time.perf_counter()
+    timings = time_calls(slot, [()], repeat)
+    metrics["concurrency_slot"] = per_call(summarize(timings, wall_seconds=time.perf_counter() - started, unit="us"))
+
+    for backend in ("memory", "sqlite"):
+        app = Flask(__name__)
+        app.config.update(ADMISSION_BACKEND=backend, ADMISSION_SQLITE_PATH=os.path.join(workdir, "admission.db"),
+                          ADMISSION_POLICIES={"booking": {"rate": 1000.0, "burst": 1000}})
+        admission = AdmissionControl(Metrics(), app)
+        policy = admission.policies["booking"]
+
+        def admit(client):
+            admission.admit(policy, client)
+            admission.release(policy)
+
+        started = time.perf_counter()
+        timings = time_calls(admit, [(key.split("|")[1],) for key, _, _ in keys], repeat)
+        metrics[f"admit_{backend}"] = per_call(summarize(timings, wall_seconds=time.perf_counter() - started, unit="us"))
+
+    # the same buckets taken from by 4 threads at once, the SQLite write lock is what they share
+    buckets = SQLiteBuckets(os.path.join(workdir, "admission.db"))
+    contended = []
+
+    def worker():
+        contended.extend(time_calls(buckets.take, keys, repeat // 4))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics["take_sqlite_4_threads"] = per_call(summarize(contended, wall_seconds=time.perf_counter() - started, unit="us"))
+    return metrics
@@ -0,0 +1,283 @@
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+
+# Shared pieces of the benchmarks: a synthetic database, the booking funnel as a list
+# of requests, latency summaries and the baseline files regressions are checked against.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(REPO_ROOT, "benchmarks", "baselines")
+
+ROOM_TYPES = (  # <-- (type, price per night, bundle price or None, picture, size in sqm)
+    ("Standard", 15, None, "standard hotel room.png", 20),
+    ("Premium", 18, 100, "premium room.png", 25),
+    ("Exclusive", 25, 150, "exclusive hotel room.jpg", 30),
+    ("Deluxe", 30, 170, "deluxe room.jpg", 35),
+)
+MEAL_DEAL = "Bed & Breakfast"
+DEFAULT_TOLERANCE = 0.25  # <-- a timing 25% worse than the baseline is a regression
+
+
+@dataclass(frozen=True)
+class SyntheticConfig:
+    locations: int = 2
+    rooms_per_location: int = 20
+    bookings: int = 20000
+    units: int = 200
+    seed: int = 1
+
+
+def app_config(workdir, log_level="WARNING"):
+    # the settings given to create_app(), pointing at files in workdir
+    return {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "ARCHIVE_DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'archive.db')}",
+        "SESSION_SQLITE_PATH": os.path.join(workdir, "sessions.db"),
+        "RECEIPT_FOLDER": os.path.join(workdir, "receipts"),
+        "NOTIFICATION_FOLDER": os.path.join(workdir, "outbox"),
+        "LOG_LEVEL": log_level,
+        "SLOW_REQUEST_SECONDS": 60,
+        "ADMISSION_ENABLED": False,  # <-- every request comes from one client, the limits have a benchmark of their own
+    }
+
+
+def load_app(workdir, **config):
+    """Builds the application against the database in workdir. Returns it and the app.py module."""
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import app as appmodule
+    app = appmodule.create_app(dict(app_config(workdir), **config))
+    with app.app_context():
+        appmodule.prepare_database()  # <-- what "flask db-upgrade" does before a deploy
+    return app, appmodule
+
+
+def location_name(index):
+    return "United Kingdom" if index == 0 else f"Location {index}"
+
+
+def first_stay_day():
+    return date.today() + timedelta(days=30)
+
+
+def synthetic_catalog(config: SyntheticConfig):
+    # rooms, deals and inventory rows, the same for the same config so a load generator
+    # pointed at an already seeded server knows the room names
+    rooms, deals, inventory = [], [], []
+    for location_index in range(config.locations):
+        location = location_name(location_index)
+        for number in range(config.rooms_per_location):
+            room_type, price, bundle_price, picture, size = ROOM_TYPES[number % len(ROOM_TYPES)]
+            room_name = f"{room_type} Room {location_index}-{number}"
+            rooms.append({"room_name": room_name, "price_per_night": price, "size": f"{size} sqm", "bed": "double sized bed",
+                          "image_file_name": picture, "location": location, "description_pitch": "benchmark stay",
+                          "size_sqm": size, "capacity": 2})
+            inventory.append({"room_name": room_name, "location": location, "units": config.units})
+            if bundle_price is not None:
+                deals.append({"deal_name": f"{room_name} Bundle", "room_location": location, "room_name": room_name,
+                              "nights": "7 nights", "new_price": bundle_price, "old_price": price * 7})
+    return rooms, deals, inventory
+
+
+def seed_database(appmodule, config: SyntheticConfig):
+    """Writes rooms, meal deals, deals and `config.bookings` random bookings. Returns the rooms."""
+    import sqlalchemy as sa
+    from bookings import FIRST_SEQUENCE_VALUE, import_bookings, luhn_check_digit, sync_booking_sequence
+    from models import Deals, MealDeals, RoomInventory, Rooms
+    from persistence import bulk_upsert
+
+    rng = random.Random(config.seed)
+    rooms, deals, inventory = synthetic_catalog(config)
+
+    with appmodule.Session() as db_session:
+        bulk_upsert(db_session, MealDeals, [{"meal_deal_name": MEAL_DEAL, "meal_deal_price": 5},
+                                            {"meal_deal_name": "All Inclusive", "meal_deal_price": 10}])
+        bulk_upsert(db_session, Rooms, rooms)
+        bulk_upsert(db_session, Deals, deals)
+        bulk_upsert(db_session, RoomInventory, inventory)
+        db_session.commit()
+
+    def records():
+        start = first_stay_day()
+        for index in range(config.bookings):
+            room = rng.choice(rooms)
+            nights = rng.randint(1, 14)
+            check_in = start + timedelta(days=rng.randrange(365))
+            value = FIRST_SEQUENCE_VALUE + index
+            yield {
+                "booking_number": value * 10 + luhn_check_digit(value),
+                "check_in": check_in, "check_out": check_in + timedelta(days=nights), "nights": nights,
+                "room_selection": room["room_name"], "location": room["location"], "people": rng.randint(1, 4),
+                "meal_deal": MEAL_DEAL, "total_price": (room["price_per_night"] + 5) * nights,
+                "name": "Bench", "surname": f"Guest{index}", "email": "guest@example.com",
+                "address": "1 Benchmark Street", "telephone": "0123456789",
+            }
+
+    import_bookings(appmodule.Session, records())
+    with appmodule.Session() as db_session:
+        sync_booking_sequence(db_session)
+        db_session.execute(sa.text("ANALYZE"))  # <-- planner statistics for a realistically sized database
+        db_session.commit()
+    appmodule.catalog.invalidate()
+    return rooms
+
+
+@dataclass(frozen=True)
+class Step:
+    name: str
+    method: str
+    path: str
+    data: dict = None
+    status: int = 200
+    location: str = None  # <-- part of the redirect target a successful step must have
+
+
+def booking_funnel(rng, rooms, first_day):
+    """The requests of one customer: search, book, enter details, then log in, change and cancel.
+
+    A generator of Steps, the caller sends back the body of each response.
+    """
+    room = rng.choice(rooms)
+    check_in = first_day + timedelta(days=rng.randrange(365))
+    nights = rng.randint(1, 14)
+    surname = f"Load{rng.randrange(10 ** 9)}"
+    yield Step("search", "POST", "/", {
+        "location": room["location"], "check_in": check_in.isoformat(),
+        "check_out": (check_in + timedelta(days=nights)).isoformat(), "people": "2",
+    }, 302, "search_results")
+    yield Step("search_results", "GET", "/search_results")
+    yield Step("book", "POST", f"/rooms/{room['room_name']}", {"book": "", "meal_deal": MEAL_DEAL}, 302, "Booking")
+    yield Step("details", "POST", "/Details", {
+        "name": f"Load {surname}", "email": "load@example.com", "address": "1 Load Street", "number": "0123456789",
+    }, 302, "successful_booking")
+    body = yield Step("successful_booking", "GET", "/successful_booking")
+    booking_number = body.split("FH-", 1)[1].split("<", 1)[0].strip()
+
+    yield Step("login", "POST", "/login_booking", {"booking_number": booking_number, "surname": surname},
+               302, "manage_booking")
+    new_check_in = check_in + timedelta(days=rng.randint(1, 30))
+    yield Step("change_booking", "POST", "/change_booking", {
+        "check_in": new_check_in.isoformat(), "check_out": (new_check_in + timedelta(days=nights)).isoformat(),
+        "people": "2", "meal_deal": MEAL_DEAL,
+    }, 302, "change_booking_confirmation")
+    yield Step("change_confirmation", "POST", "/change_booking_confirmation", {"confirm": ""},
+               302, "change_booking_successful")
+    yield Step("cancel", "GET", "/cancel_booking")
+
+
+FUNNEL_STEPS = ("search", "search_results", "book", "details", "successful_booking",
+                "login", "change_booking", "change_confirmation", "cancel")
+
+
+class FunnelError(Exception):
+    pass
+
+
+def check_step(step, status, location):
+    if status != step.status or (step.location and step.location not in (location or "")):
+        raise FunnelError(f"{step.name}: expected {step.status} {step.location or ''}, got {status} {location or ''}")
+
+
+def drive_funnel(funnel, send, record):
+    """Runs one funnel: send(step) returns (status, redirect location, body), record(step, seconds) is called after each step."""
+    step = next(funnel)
+    while True:
+        started = time.perf_counter()
+        status, location, body = send(step)
+        elapsed = time.perf_counter() - started
+        check_step(step, status, location)
+        record(step, elapsed)
+        try:
+            step = funnel.send(body)
+        except StopIteration:
+            return
+
+
+def percentile(sorted_values, fraction):
+    # nearest rank, fine for the thousands of samples a run collects
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+UNITS = {"ms": 1e3, "us": 1e6, "ns": 1e9}
+
+
+def summarize(seconds, statements=None, wall_seconds=None, unit="ms"):
+    values = sorted(seconds)
+    scale = UNITS[unit]
+    summary = {
+        "count": len(values),
+        f"mean_{unit}": round(statistics.fmean(values) * scale, 3) if values else 0.0,
+        f"p50_{unit}": round(percentile(values, 0.50) * scale, 3),
+        f"p95_{unit}": round(percentile(values, 0.95) * scale, 3),
+        f"p99_{unit}": round(percentile(values, 0.99) * scale, 3),
+    }
+    if wall_seconds:
+        summary["requests_per_second"] = round(len(values) / wall_seconds, 1)
+    if statements is not None and values:
+        summary["sql_per_request"] = round(sum(statements) / len(values), 2)
+    return summary
+
+
+def result_document(name, config, metrics):
+    return {
+        "benchmark": name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": config,
+        "metrics": metrics,
+    }
+
+
+def baseline_path(name, directory=BASELINE_DIR):
+    return os.path.join(directory, f"{name}.json")
+
+
+def save_baseline(document, directory=BASELINE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with open(baseline_path(document["benchmark"], directory), "w", encoding="utf-8") as file:
+        json.dump(document, file, indent=2, sort_keys=True)
+
+
+def load_baseline(name, directory=BASELINE_DIR):
+    try:
+        with open(baseline_path(name, directory), encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def find_regressions(document, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Lists the numbers that got worse than the baseline by more than the tolerance.
+
+    Throughput has to stay above (1 - tolerance) x baseline, latencies and memory below
+    (1 + tolerance) x baseline, and SQL statements per request may not grow at all.
+    """
+    regressions = []
+    for group, values in document["metrics"].items():
+        old_values = baseline["metrics"].get(group, {})
+        for key, value in values.items():
+            old = old_values.get(key)
+            if old is None or key == "count":
+                continue
+            if key.endswith("_per_second"):
+                worse = value < old * (1 - tolerance)
+            elif key == "sql_per_request":
+                worse = value > old + 0.01
+            elif key.endswith(tuple(f"_{unit}" for unit in UNITS)) or key.endswith("_mib"):
+                worse = value > old * (1 + tolerance)
+            else:
+                continue
+            if worse:
+                regressions.append(f"{group}.{key}: {old} -> {value}")
+    return regressions
@@ -0,0 +1,59 @@
+import random
+import time
+
+import sqlalchemy as sa
+
+from benchmarks.common import FUNNEL_STEPS, booking_funnel, drive_funnel, first_stay_day, summarize
+
+
+# The booking funnel through Flask's test client: no network and no server, so the
+# numbers are the cost of the views, templates, sessions and SQL themselves.
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        sa.event.listen(engine, "after_cursor_execute", self.after_statement)
+
+    def after_statement(self, *args):
+        self.count += 1
+
+
+def run_funnel(app, appmodule, rooms, iterations=200, warmup=5, seed=2):
+    client = app.test_client()
+    counter = StatementCounter(appmodule.database.engine)
+    rng = random.Random(seed)
+    first_day = first_stay_day()
+    latencies = {step: [] for step in FUNNEL_STEPS}
+    statements = {step: [] for step in FUNNEL_STEPS}
+    recording = False
+    last_count = 0
+
+    def send(step):
+        nonlocal last_count
+        before = counter.count
+        response = client.open(step.path, method=step.method, data=step.data)
+        last_count = counter.count - before
+        return response.status_code, response.headers.get("Location"), response.get_data(as_text=True)
+
+    def record(step, seconds):
+        if recording:
+            latencies[step.name].append(seconds)
+            statements[step.name].append(last_count)
+
+    for _ in range(warmup):
+        drive_funnel(booking_funnel(rng, rooms, first_day), send, record)
+    recording = True
+    started = time.perf_counter()
+    for _ in range(iterations):
+        drive_funnel(booking_funnel(rng, rooms, first_day), send, record)
+    wall_seconds = time.perf_counter() - started
+
+    metrics = {step: summarize(latencies[step], statements[step]) for step in FUNNEL_STEPS}
+    metrics["total"] = summarize(
+        [value for values in latencies.values() for value in values],
+        [value for values in statements.values() for value in values],
+        wall_seconds,
+    )
+    metrics["total"]["funnels_per_second"] = round(iterations / wall_seconds, 2)
+    return metrics
@@ -0,0 +1,146 @@
+import http.client
+import logging
+import multiprocessing
+import os
+import random
+import re
+import socket
+import time
+from urllib.parse import quote, urlencode, urlsplit
+
+from benchmarks.common import FUNNEL_STEPS, FunnelError, booking_funnel, drive_funnel, first_stay_day, summarize
+
+
+# The booking funnel over real HTTP: a local server in its own process and several
+# load generator processes, each running whole funnels with its own session cookie
+# until the time is up.
+
+SCRAPE_TOKEN = os.environ.get("FLASK_REPORTS_TOKEN", "benchmark")  # <-- /metrics needs the reports token, a server of our own gets this one
+SQL_SAMPLE = re.compile(r'^hotel_http_request_sql_statements_(sum|count)\{route="([^"]*)"\} (\S+)$', re.MULTILINE)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def serve(workdir, port):
+    # runs in the server process, the application is built here against the same database files
+    from werkzeug.serving import make_server
+
+    from benchmarks.common import load_app
+
+    app, _ = load_app(workdir, REPORTS_TOKEN=SCRAPE_TOKEN)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # <-- no access log line per request
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def wait_for_server(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"the server on {host}:{port} did not start")
+
+
+class HttpClient:
+    """One browser: a keep-alive connection and the session cookie."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookie = None
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+
+    def send(self, step):
+        body = urlencode(step.data) if step.data is not None else None
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body is not None else {}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        for attempt in range(2):
+            try:
+                self.connection.request(step.method, quote(step.path), body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read().decode("utf-8", "replace")
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()  # <-- the server closed the keep-alive connection, open a new one
+                if attempt:
+                    raise
+        set_cookie = response.getheader("Set-Cookie")
+        if set_cookie:
+            self.cookie = set_cookie.split(";", 1)[0]
+        return response.status, response.getheader("Location"), data
+
+
+def load_worker(arguments):
+    host, port, rooms, duration, seed = arguments
+    rng = random.Random(seed)
+    first_day = first_stay_day()
+    latencies = {step: [] for step in FUNNEL_STEPS}
+    errors = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        client = HttpClient(host, port)  # <-- a new visitor for every funnel
+        try:
+            drive_funnel(booking_funnel(rng, rooms, first_day), client.send,
+                         lambda step, seconds: latencies[step.name].append(seconds))
+        except (FunnelError, OSError, http.client.HTTPException) as error:
+            errors.append(str(error))
+        finally:
+            client.connection.close()
+    return latencies, errors
+
+
+def scrape_sql_per_route(host, port):
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    connection.request("GET", "/metrics", headers={"Authorization": f"Bearer {SCRAPE_TOKEN}"})
+    text = connection.getresponse().read().decode()
+    connection.close()
+    totals = {}
+    for kind, route, value in SQL_SAMPLE.findall(text):
+        totals.setdefault(route, {})[kind] = float(value)
+    return {route: round(values["sum"] / values["count"], 2) for route, values in totals.items() if values.get("count")}
+
+
+def run_http_load(workdir, rooms, workers=4, duration=20.0, url=None, seed=4):
+    """Runs `workers` load generator processes for `duration` seconds.
+
+    Without a url a threaded development server is started on the database in workdir,
+    with one (e.g. a gunicorn server) that server is used and has to be seeded already.
+    """
+    server = None
+    if url is None:
+        host, port = "127.0.0.1", free_port()
+        context = multiprocessing.get_context("spawn")  # <-- the server imports app.py fresh
+        server = context.Process(target=serve, args=(workdir, port), daemon=True)
+        server.start()
+    else:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+    try:
+        wait_for_server(host, port)
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            started = time.perf_counter()
+            results = pool.map(load_worker, [(host, port, rooms, duration, seed + index) for index in range(workers)])
+            wall_seconds = time.perf_counter() - started
+        sql_per_route = scrape_sql_per_route(host, port)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    latencies = {step: [value for worker_latencies, _ in results for value in worker_latencies[step]]
+                 for step in FUNNEL_STEPS}
+    errors = [error for _, worker_errors in results for error in worker_errors]
+    metrics = {step: summarize(latencies[step]) for step in FUNNEL_STEPS}
+    metrics["total"] = summarize([value for values in latencies.values() for value in values], wall_seconds=wall_seconds)
+    metrics["total"]["funnels_per_second"] = round(len(latencies["cancel"]) / wall_seconds, 2)
+    metrics["total"]["errors"] = len(errors)
+    for route, value in sql_per_route.items():
+        metrics[f"route {route}"] = {"sql_per_request": value}  # <-- from the server's own /metrics
+    return metrics, errors[:10]
@@ -0,0 +1,66 @@
+import random
+import time
+from datetime import timedelta
+
+from benchmarks.common import MEAL_DEAL, first_stay_day, summarize
+from benchmarks.funnel import StatementCounter
+
+
+# Single functions timed in a loop: the one-stay price, the batch quote engine and
+# create_booking() with its transaction.
+
+
+def time_calls(function, arguments, repeat):
+    # per call latencies in seconds, arguments are cycled through
+    timings = []
+    for index in range(repeat):
+        args = arguments[index % len(arguments)]
+        started = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def per_call(summary):
+    return {key.replace("requests_per_second", "calls_per_second"): value for key, value in summary.items()}
+
+
+def run_micro(app, appmodule, rooms, repeat=20000, bookings=300, seed=3):
+    from quotes import make_stays, price_table, quote
+
+    rng = random.Random(seed)
+    snapshot = appmodule.catalog.get()
+    meal_deal = snapshot.meal_deal(MEAL_DEAL)
+    cases = []
+    for _ in range(256):
+        room = snapshot.room(rng.choice(rooms)["room_name"])
+        cases.append((room, rng.randint(1, 14), meal_deal, snapshot.deal_for_room(room.room_name)))
+    metrics = {}
+
+    started = time.perf_counter()
+    timings = time_calls(appmodule.room_deal_condition, cases, repeat)
+    metrics["room_deal_condition"] = per_call(summarize(timings, wall_seconds=time.perf_counter() - started, unit="us"))
+
+    table = price_table(snapshot)
+    stays = make_stays(table, [(room.room_name, MEAL_DEAL, nights) for room, nights, _, _ in cases] * 40)
+    started = time.perf_counter()
+    timings = time_calls(quote, [(table, stays)], 50)
+    elapsed = time.perf_counter() - started
+    metrics["quote_batch"] = summarize([timing / len(stays) for timing in timings], unit="ns")  # <-- per stay
+    metrics["quote_batch"]["stays_per_second"] = round(len(stays) * 50 / elapsed)
+
+    counter = StatementCounter(appmodule.database.engine)
+    first_day = first_stay_day()
+    arguments = []
+    for _ in range(bookings):
+        room, nights, _, room_deal = rng.choice(cases)
+        check_in = first_day + timedelta(days=rng.randrange(365))
+        arguments.append((room, meal_deal, nights, 2, room.location, check_in,
+                          check_in + timedelta(days=nights), room_deal))
+    before = counter.count
+    started = time.perf_counter()
+    with app.app_context():
+        timings = time_calls(appmodule.create_booking, arguments, bookings)
+    metrics["create_booking"] = per_call(summarize(timings, wall_seconds=time.perf_counter() - started))
+    metrics["create_booking"]["sql_per_request"] = round((counter.count - before) / bookings, 2)
+    return metrics
@@ -0,0 +1,102 @@
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+from dataclasses import asdict
+
+from benchmarks.common import (BASELINE_DIR, DEFAULT_TOLERANCE, SyntheticConfig, find_regressions, load_app,
+                               load_baseline, result_document, save_baseline, seed_database, synthetic_catalog)
+
+
+# python -m benchmarks.run funnel micro http startup --bookings 50000 --save-baseline
+#
+# Seeds a synthetic database in a temporary folder, runs the chosen benchmarks, prints
+# the results and compares them with benchmarks/baselines/<name>.json. The exit code
+# is 1 when something regressed past the tolerance.
+
+BENCHMARKS = ("funnel", "micro", "http", "startup", "admission", "stress")
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Booking funnel benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", choices=BENCHMARKS, default=["funnel", "micro"])
+    parser.add_argument("--locations", type=int, default=SyntheticConfig.locations)
+    parser.add_argument("--rooms", type=int, default=SyntheticConfig.rooms_per_location, help="Rooms per location.")
+    parser.add_argument("--bookings", type=int, default=SyntheticConfig.bookings, help="Bookings seeded before the run.")
+    parser.add_argument("--units", type=int, default=SyntheticConfig.units, help="Units of every room.")
+    parser.add_argument("--iterations", type=int, default=200, help="Funnels run through the test client.")
+    parser.add_argument("--workers", type=int, default=4, help="Load generator processes for http, forked workers for startup and stress.")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds the http load runs.")
+    parser.add_argument("--url", help="Load an already running, already seeded server instead of starting one.")
+    parser.add_argument("--baseline-dir", default=BASELINE_DIR)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baselines.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--output", help="Also write all results to this JSON file.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    config = SyntheticConfig(arguments.locations, arguments.rooms, arguments.bookings, arguments.units)
+    workdir = tempfile.mkdtemp(prefix="hotel-bench-")
+    documents = []
+
+    if arguments.url:
+        rooms = synthetic_catalog(config)[0]
+    else:
+        app, appmodule = load_app(workdir)
+        print(f"Seeding {config.bookings} bookings in {workdir}", file=sys.stderr)
+        rooms = seed_database(appmodule, config)
+    settings = asdict(config)
+
+    for name in arguments.benchmarks:
+        print(f"Running {name}", file=sys.stderr)
+        if name == "funnel":
+            from benchmarks.funnel import run_funnel
+            metrics = run_funnel(app, appmodule, rooms, arguments.iterations)
+            documents.append(result_document(name, dict(settings, iterations=arguments.iterations), metrics))
+        elif name == "micro":
+            from benchmarks.micro import run_micro
+            documents.append(result_document(name, settings, run_micro(app, appmodule, rooms)))
+        elif name == "http":
+            from benchmarks.http_load import run_http_load
+            metrics, errors = run_http_load(workdir, rooms, arguments.workers, arguments.duration, arguments.url)
+            for error in errors:
+                print(f"  funnel failed: {error}", file=sys.stderr)
+            documents.append(result_document(name, dict(settings, workers=arguments.workers,
+                                                        duration=arguments.duration), metrics))
+        elif name == "startup":
+            from benchmarks.startup import run_startup
+            documents.append(result_document(name, dict(settings, workers=arguments.workers),
+                                             run_startup(workdir, config, arguments.workers)))
+        elif name == "admission":
+            from benchmarks.admission import run_admission
+            documents.append(result_document(name, settings, run_admission(workdir)))
+        elif name == "stress":
+            from benchmarks.stress import run_stress
+            documents.append(result_document(name, dict(settings, workers=arguments.workers),
+                                             run_stress(app, appmodule, rooms, arguments.workers)))
+
+    regressed = False
+    print(json.dumps(documents, indent=2))
+    for document in documents:
+        baseline = load_baseline(document["benchmark"], arguments.baseline_dir)
+        if baseline is not None and baseline["config"] != document["config"]:
+            print(f"{document['benchmark']}: baseline was run with other settings, not compared", file=sys.stderr)
+        elif baseline is not None:
+            regressions = find_regressions(document, baseline, arguments.tolerance)
+            for regression in regressions:
+                print(f"REGRESSION {document['benchmark']} {regression}", file=sys.stderr)
+            regressed = regressed or bool(regressions)
+        if arguments.save_baseline:
+            save_baseline(document, arguments.baseline_dir)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(documents, file, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
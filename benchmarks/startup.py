@@ -0,0 +1,141 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import traceback
+
+from benchmarks.common import (REPO_ROOT, SyntheticConfig, app_config, booking_funnel, drive_funnel, first_stay_day,
+                               summarize, synthetic_catalog)
+
+
+# Startup time and memory per worker. Everything runs in fresh interpreters, the way a
+# server starts: the time to import app.py and to build the application, then a pool of
+# forked workers that each serve a few funnels, once forked from a preloaded master (what
+# gunicorn.conf.py does) and once with every worker building its own application.
+
+MEMORY_FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+
+def memory_kib(pid="self"):
+    # from /proc/<pid>/smaps_rollup, Linux only; Pss splits each shared page between the processes sharing it
+    values = dict.fromkeys(MEMORY_FIELDS, 0)
+    with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as file:
+        for line in file:
+            name, _, rest = line.partition(":")
+            if name in values:
+                values[name] = int(rest.split()[0])
+    return values
+
+
+def python(*arguments):
+    completed = subprocess.run([sys.executable, "-m", "benchmarks.startup", *arguments], cwd=REPO_ROOT,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def time_startup(workdir, preload):
+    # runs in a fresh interpreter: seconds to import app.py, then to build the application
+    started = time.perf_counter()
+    import app as appmodule
+    imported = time.perf_counter()
+    appmodule.create_app(dict(app_config(workdir), PRELOAD=preload))
+    return {"import": imported - started, "create_app": time.perf_counter() - imported}
+
+
+def serve_funnels(app, rooms, funnels, seed):
+    client = app.test_client()
+    rng = random.Random(seed)
+
+    def send(step):
+        response = client.open(step.path, method=step.method, data=step.data)
+        return response.status_code, response.headers.get("Location"), response.get_data(as_text=True)
+
+    for _ in range(funnels):
+        drive_funnel(booking_funnel(rng, rooms, first_stay_day()), send, lambda step, seconds: None)
+
+
+def fork_workers(workdir, rooms, workers, funnels, preload):
+    """Forks the workers, waits until every one has served its funnels and returns their memory.
+
+    With preload the application is built and preloaded here first, otherwise each worker
+    builds its own after the fork. The workers are kept alive until all of them have been
+    measured, so the pages they share are counted as shared.
+    """
+    app = None
+    if preload:
+        import app as appmodule
+        app = appmodule.create_app(dict(app_config(workdir), PRELOAD=True))
+    report_read, report_write = os.pipe()
+    release_read, release_write = os.pipe()
+    pids = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(report_read)
+            os.close(release_write)
+            try:
+                if app is None:
+                    import app as appmodule
+                    app = appmodule.create_app(app_config(workdir))
+                serve_funnels(app, rooms, funnels, seed=index)
+                os.write(report_write, (json.dumps(memory_kib()) + "\n").encode())
+                os.close(report_write)
+                os.read(release_read, 1)  # <-- returns once the master closes its end
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    os.close(report_write)
+    os.close(release_read)
+    with os.fdopen(report_read) as reports:
+        samples = [json.loads(line) for line in reports if line.strip()][:workers]
+    master = memory_kib()
+    os.close(release_write)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    if len(samples) < workers:
+        raise RuntimeError(f"only {len(samples)} of {workers} workers reported")
+    return {"master": master, "workers": samples}
+
+
+def memory_summary(result):
+    workers = result["workers"]
+
+    def mean_mib(*fields):
+        return round(sum(sum(sample[field] for field in fields) for sample in workers) / len(workers) / 1024, 2)
+
+    return {
+        "workers": len(workers),
+        "rss_per_worker_mib": mean_mib("Rss"),
+        "pss_per_worker_mib": mean_mib("Pss"),
+        "private_per_worker_mib": mean_mib("Private_Clean", "Private_Dirty"),  # <-- what each extra worker really costs
+        "master_rss_mib": round(result["master"]["Rss"] / 1024, 2),
+    }
+
+
+def run_startup(workdir, config: SyntheticConfig, workers=4, runs=5, funnels=3):
+    plain = [python("time", workdir, "false") for _ in range(runs)]
+    preloaded = [python("time", workdir, "true") for _ in range(runs)]
+    metrics = {
+        "import": summarize([timing["import"] for timing in plain + preloaded]),
+        "create_app": summarize([timing["create_app"] for timing in plain]),
+        "create_app_preload": summarize([timing["create_app"] for timing in preloaded]),
+    }
+    if os.path.exists("/proc/self/smaps_rollup") and hasattr(os, "fork"):
+        arguments = (workdir, json.dumps(synthetic_catalog(config)[0]), str(workers), str(funnels))
+        metrics["workers"] = memory_summary(python("workers", *arguments, "false"))
+        metrics["workers_preload"] = memory_summary(python("workers", *arguments, "true"))
+    return metrics
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.startup time <workdir> <preload> | workers <workdir> <rooms json> <workers> <funnels> <preload>
+    mode, workdir, *rest = sys.argv[1:]
+    if mode == "time":
+        result = time_startup(workdir, json.loads(rest[0]))
+    else:
+        result = fork_workers(workdir, json.loads(rest[0]), int(rest[1]), int(rest[2]), json.loads(rest[3]))
+    print(json.dumps(result))
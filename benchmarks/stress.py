@@ -0,0 +1,144 @@
+import json
+import os
+import random
+import time
+import traceback
+from datetime import timedelta
+
+import sqlalchemy as sa
+
+from benchmarks.common import MEAL_DEAL, first_stay_day, summarize
+
+
+# Several forked processes book the same room, with few units, for overlapping stays at
+# the same time, the way gunicorn workers would. Afterwards the database has to agree
+# with itself: no night booked past the room's units, no booking number handed out
+# twice, and room_nights counting exactly the bookings there are. A failed check
+# raises AssertionError, so the run exits with an error.
+
+STRESS_WINDOW_DAYS = 10  # <-- every stay falls in these nights, so the workers fight over them
+STRESS_UNITS = 3  # <-- units of the room while the workers book it
+
+
+def book_stays(app, appmodule, room_name, first_night, attempts, seed):
+    # runs in a forked worker: returns the booking numbers it got, the refusals and the latencies
+    from availability import RoomUnavailable
+
+    rng = random.Random(seed)
+    numbers, refused, timings = [], 0, []
+    with app.app_context():
+        snapshot = appmodule.catalog.get()
+        room = snapshot.room(room_name)
+        meal_deal = snapshot.meal_deal(MEAL_DEAL)
+        room_deal = snapshot.deal_for_room(room.room_name)
+        for _ in range(attempts):
+            nights = rng.randint(1, 4)
+            check_in = first_night + timedelta(days=rng.randrange(STRESS_WINDOW_DAYS - nights + 1))
+            started = time.perf_counter()
+            try:
+                booking = appmodule.create_booking(room, meal_deal, nights, 2, room.location, check_in,
+                                                   check_in + timedelta(days=nights), room_deal)
+                numbers.append(booking.booking_number)
+            except RoomUnavailable:
+                refused += 1
+            timings.append(time.perf_counter() - started)
+    return {"numbers": numbers, "refused": refused, "timings": timings}
+
+
+def fork_bookers(app, appmodule, room_name, first_night, workers, attempts):
+    appmodule.database.remove_session()
+    appmodule.database.dispose()  # <-- every worker opens its own connections
+    read_end, write_end = os.pipe()
+    pids = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            try:
+                result = book_stays(app, appmodule, room_name, first_night, attempts, seed=index)
+                os.write(write_end, (json.dumps(result) + "\n").encode())
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    os.close(write_end)
+    with os.fdopen(read_end) as reports:
+        results = [json.loads(line) for line in reports if line.strip()]
+    for pid in pids:
+        os.waitpid(pid, 0)
+    if len(results) < workers:
+        raise RuntimeError(f"only {len(results)} of {workers} workers reported")
+    return results
+
+
+def check_consistency(appmodule, room_name, location, first_night, numbers):
+    from models import Booking, RoomInventory, RoomNight
+
+    problems = []
+    if len(numbers) != len(set(numbers)):
+        problems.append(f"{len(numbers) - len(set(numbers))} booking numbers were handed out twice")
+    last_night = first_night + timedelta(days=STRESS_WINDOW_DAYS)
+    with appmodule.partitions.for_location(location).Session() as db_session:
+        units = db_session.get(RoomInventory, (room_name, location)).units
+        stored = set(db_session.scalars(sa.select(Booking.booking_number).where(Booking.booking_number.in_(numbers))))
+        if stored != set(numbers):
+            problems.append(f"{len(set(numbers) - stored)} confirmed bookings are missing from the database")
+        stays = db_session.execute(
+            sa.select(Booking.check_in, Booking.check_out)
+            .where(Booking.room_selection == room_name, Booking.location == location,
+                   Booking.check_in < last_night, Booking.check_out > first_night)
+        ).all()
+        counted = dict(db_session.execute(
+            sa.select(RoomNight.night, RoomNight.booked)
+            .where(RoomNight.room_name == room_name, RoomNight.location == location,
+                   RoomNight.night >= first_night, RoomNight.night < last_night)
+        ).all())
+    booked = {}
+    for check_in, check_out in stays:
+        for offset in range((check_out - check_in).days):
+            night = check_in + timedelta(days=offset)
+            booked[night] = booked.get(night, 0) + 1
+    overbooked = sorted(night for night, count in booked.items() if count > units)
+    if overbooked:
+        problems.append(f"{len(overbooked)} nights booked past {units} units, first {overbooked[0]}")
+    mismatched = sorted(night for night in set(booked) | set(counted) if booked.get(night, 0) != counted.get(night, 0))
+    if mismatched:
+        problems.append(f"room_nights disagrees with the bookings on {len(mismatched)} nights, first {mismatched[0]}")
+    if problems:
+        raise AssertionError("; ".join(problems))
+    return units, booked
+
+
+def set_units(appmodule, room_name, location, units):
+    # returns the units the room had; the catalog is reloaded so the workers see the new number
+    from models import RoomInventory
+
+    with appmodule.Session() as db_session:
+        inventory = db_session.get(RoomInventory, (room_name, location))
+        previous, inventory.units = inventory.units, units
+        db_session.commit()
+    appmodule.partitions.sync_catalog()
+    appmodule.catalog.invalidate()
+    return previous
+
+
+def run_stress(app, appmodule, rooms, workers=8, attempts=25):
+    room = rooms[0]
+    first_night = first_stay_day() + timedelta(days=1000)  # <-- past the seeded bookings, only the workers book here
+    previous = set_units(appmodule, room["room_name"], room["location"], STRESS_UNITS)
+    try:
+        started = time.perf_counter()
+        results = fork_bookers(app, appmodule, room["room_name"], first_night, workers, attempts)
+        elapsed = time.perf_counter() - started
+        numbers = [number for result in results for number in result["numbers"]]
+        units, booked = check_consistency(appmodule, room["room_name"], room["location"], first_night, numbers)
+    finally:
+        set_units(appmodule, room["room_name"], room["location"], previous)  # <-- the other benchmarks book this room too
+    metrics = {"bookings": summarize([timing for result in results for timing in result["timings"]], wall_seconds=elapsed)}
+    metrics["bookings"].update({
+        "booked": len(numbers),
+        "refused": sum(result["refused"] for result in results),
+        "full_nights": sum(count == units for count in booked.values()),
+    })
+    return metrics
@@ -0,0 +1,262 @@
+import random
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.orm import contains_eager, joinedload
+
+from models import Booking, BookingSequence, Customer, utc_now
+from availability import reserve, release, add_night_counts, count_nights
+from persistence import DEFAULT_BATCH_SIZE, batched, coerce_row, upsert_statement
+from reporting import add_revenue, record_booking, revenue_deltas
+from tasks import enqueue
+
+
+# Booking numbers come from a counter in the database plus a Luhn check digit, so two
+# workers can never hand out the same number and a mistyped number is caught before
+# it reaches a query. Numbers from before the counter existed are six digits long.
+# Every partition (see partitions.py) has its own counter in its own range, so the
+# number of a booking tells which database it is in.
+
+BOOKING_SEQUENCE = "booking"
+FIRST_SEQUENCE_VALUE = 100000  # <-- gives 7 digit numbers, the random legacy ones have 6
+PARTITION_SPAN = 10 ** 7  # <-- counter values per partition, partition 1 numbers its bookings from 101000000
+TRANSACTION_RETRIES = 5
+
+
+def luhn_check_digit(value):
+    total = 0
+    for position, digit in enumerate(reversed(str(value))):
+        digit = int(digit)
+        if position % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return (10 - total % 10) % 10
+
+
+def valid_booking_number(number):
+    number = str(number)
+    if not number.isdigit():
+        return False
+    if len(number) == 6:
+        return True  # <-- legacy random number without a check digit
+    return len(number) > 6 and luhn_check_digit(number[:-1]) == int(number[-1])
+
+
+def first_sequence_value(partition=0):
+    return partition * PARTITION_SPAN + FIRST_SEQUENCE_VALUE
+
+
+def booking_partition(number):
+    # the partition a booking number was handed out by, 0 for the main database and the legacy numbers
+    return int(number) // 10 // PARTITION_SPAN
+
+
+def next_booking_number(db_session):
+    # must run inside the write transaction so the counter update is serialized
+    partition = db_session.info.get("partition", 0)  # <-- set by the partition's Database.Session()
+    value = db_session.execute(
+        sa.update(BookingSequence)
+        .where(BookingSequence.name == BOOKING_SEQUENCE)
+        .values(value=BookingSequence.value + 1)
+        .returning(BookingSequence.value)
+    ).scalar()
+    if value is None:
+        value = first_sequence_value(partition)
+        db_session.add(BookingSequence(name=BOOKING_SEQUENCE, value=value))
+        db_session.flush()
+    if value >= (partition + 1) * PARTITION_SPAN:
+        raise RuntimeError(f"partition {partition} has handed out all of its booking numbers")
+    return value * 10 + luhn_check_digit(value)
+
+
+def begin_write(db_session):
+    # SQLite: take the write lock up front so the availability check and the insert see
+    # the same data, other databases get a serializable transaction instead
+    if db_session.bind.dialect.name == "sqlite":
+        db_session.execute(sa.text("BEGIN IMMEDIATE"))
+    else:
+        db_session.connection(execution_options={"isolation_level": "SERIALIZABLE"})
+
+
+def run_in_transaction(db_session, work, retries=TRANSACTION_RETRIES):
+    """Runs ``work(db_session)`` in a write transaction and commits it.
+
+    Lock timeouts, serialization failures and duplicate keys are retried with a
+    jittered backoff, any other exception (e.g. RoomUnavailable) is rolled back
+    and raised as is.
+    """
+    for attempt in range(retries + 1):
+        db_session.commit()  # <-- ends the read transaction of the request so the write one starts fresh
+        try:
+            begin_write(db_session)
+            result = work(db_session)
+            db_session.commit()
+            return result
+        except (sa.exc.OperationalError, sa.exc.IntegrityError):
+            db_session.rollback()
+            if attempt == retries:
+                raise
+        except Exception:
+            db_session.rollback()
+            raise
+        time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+
+def load_booking(db_session, booking_number):
+    # booking, customer, room and meal deal in one SELECT with outer joins
+    return db_session.execute(
+        sa.select(Booking)
+        .options(joinedload(Booking.customer), joinedload(Booking.room), joinedload(Booking.meal_deal_details))
+        .where(Booking.booking_number == booking_number)
+    ).unique().scalar_one_or_none()
+
+
+def find_booking(db_session, booking_number, surname):
+    # the login check: the booking only comes back when the surname on it matches
+    return db_session.execute(
+        sa.select(Booking)
+        .join(Booking.customer)
+        .options(contains_eager(Booking.customer))
+        .where(Booking.booking_number == booking_number, Customer.surname == surname)
+    ).scalar_one_or_none()
+
+
+def delete_booking(db_session, booking_number, without_customer=False):
+    # one DELETE, the customer row goes with it (ON DELETE CASCADE) and the nights are given back
+    statement = sa.delete(Booking).where(Booking.booking_number == booking_number)
+    if without_customer:
+        statement = statement.where(~sa.exists().where(Customer.booking_number == Booking.booking_number))
+    booking = db_session.execute(statement.returning(Booking)).scalar_one_or_none()
+    if booking is not None:
+        release(db_session, booking.room_selection, booking.location, booking.check_in, booking.check_out)
+        record_booking(db_session, booking, -1)
+    return booking
+
+
+def expire_held_bookings(db_session, cutoff, limit=500):
+    """Deletes bookings made before cutoff that still have no customer, returns their numbers.
+
+    Those are holds from the booking pages where the details form was never sent.
+    Each one is deleted in its own transaction, and only if no customer was added
+    in the meantime.
+    """
+    numbers = db_session.execute(
+        sa.select(Booking.booking_number)
+        .outerjoin(Booking.customer)
+        .where(Customer.booking_number.is_(None), Booking.created_at < cutoff)
+        .order_by(Booking.created_at)
+        .limit(limit)
+    ).scalars().all()
+    expired = []
+    for number in numbers:
+        booking = run_in_transaction(db_session, lambda db_session: delete_booking(db_session, number, without_customer=True))
+        if booking is not None:
+            expired.append(number)
+    return expired
+
+
+def book_room(db_session, snapshot, customer=None, after=None, **booking_fields):
+    # reserve the nights, pick a booking number and insert the booking (and its customer
+    # when the fields are given) in one transaction
+    # after(db_session, booking) runs in the same transaction once the booking is written
+    def work(db_session):
+        reserve(db_session, snapshot, booking_fields["room_selection"], booking_fields["location"],
+                booking_fields["check_in"], booking_fields["check_out"])
+        booking = Booking(booking_number=next_booking_number(db_session), created_at=utc_now(), **booking_fields)
+        if customer is not None:
+            booking.customer = Customer(**customer)
+        db_session.add(booking)
+        db_session.flush()
+        record_booking(db_session, booking)
+        if after is not None:
+            after(db_session, booking)
+        return booking
+
+    return run_in_transaction(db_session, work)
+
+
+def queue_booking_job(kind):
+    # for book_room(after=...) and move_booking(after=...): the job is queued in the transaction that writes the booking
+    return lambda db_session, booking: enqueue(db_session, kind, {"booking_number": booking.booking_number})
+
+
+def move_booking(db_session, snapshot, booking_number, after=None, **changes):
+    # move an existing booking to new dates, the old nights are given back first
+    # after(db_session, booking) runs in the same transaction once the booking is changed
+    # returns the changed booking, None when it was cancelled (or archived) in the meantime
+    def work(db_session):
+        booking = db_session.get(Booking, booking_number, populate_existing=True)  # <-- re-read under the write lock
+        if booking is None:
+            return None
+        release(db_session, booking.room_selection, booking.location, booking.check_in, booking.check_out)
+        reserve(db_session, snapshot, booking.room_selection, booking.location,
+                changes["check_in"], changes["check_out"])
+        record_booking(db_session, booking, -1)  # <-- the old stay comes out of the reports, the new one goes in below
+        for field, value in changes.items():
+            setattr(booking, field, value)
+        db_session.flush()
+        record_booking(db_session, booking)
+        if after is not None:
+            after(db_session, booking)
+        return booking
+
+    return run_in_transaction(db_session, work)
+
+
+CUSTOMER_FIELDS = ("name", "surname", "email", "address", "telephone")
+
+
+def import_bookings(session_factory, records, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """Loads historical bookings, and their customer when the record has a surname.
+
+    Every batch is one transaction: bookings and customers are inserted with
+    executemany and each room_nights counter the batch touches is updated once.
+    """
+    imported = 0
+    for batch in batched(records, batch_size):
+        bookings = [coerce_row(Booking, record) for record in batch]
+        customers = [
+            coerce_row(Customer, {"booking_number": record["booking_number"],
+                                  **{field: record[field] for field in CUSTOMER_FIELDS if field in record}})
+            for record in batch if record.get("surname")
+        ]
+        with session_factory() as db_session:
+            db_session.execute(sa.insert(Booking), bookings)
+            if customers:
+                db_session.execute(sa.insert(Customer), customers)
+            add_night_counts(db_session, count_nights(
+                (booking["room_selection"], booking["location"], booking["check_in"], booking["check_out"])
+                for booking in bookings
+            ))
+            add_revenue(db_session, revenue_deltas(
+                (booking["room_selection"], booking["location"], booking["meal_deal"],
+                 booking["check_in"], booking["check_out"], booking["total_price"])
+                for booking in bookings
+            ))
+            db_session.commit()
+        imported += len(bookings)
+        if on_batch is not None:
+            on_batch(imported)
+    return imported
+
+
+def sync_booking_sequence(db_session):
+    # imported bookings may already use numbers from the counter, move the counter past them
+    partition = db_session.info.get("partition", 0)
+    highest = db_session.execute(
+        sa.select(sa.func.max(Booking.booking_number)).where(
+            Booking.booking_number >= first_sequence_value(partition) * 10,
+            Booking.booking_number < (partition + 1) * PARTITION_SPAN * 10,  # <-- not the numbers of another partition
+        )
+    ).scalar()
+    if highest is None:
+        return
+    greatest = sa.func.greatest if db_session.bind.dialect.name == "postgresql" else sa.func.max
+    statement = upsert_statement(db_session, BookingSequence).values(name=BOOKING_SEQUENCE, value=highest // 10)
+    statement = statement.on_conflict_do_update(
+        index_elements=[BookingSequence.name],
+        set_={"value": greatest(BookingSequence.value, statement.excluded.value)},
+    )
+    db_session.execute(statement)
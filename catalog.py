@@ -0,0 +1,159 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from models import Rooms, MealDeals, Deals, RoomInventory
+
+
+# The catalog (rooms, meal deals and deals) is reference data that barely changes,
+# so instead of querying it on every page we keep an immutable snapshot in memory
+# and only go back to the database when the snapshot expires or is invalidated.
+
+@dataclass(frozen=True)
+class RoomInfo:
+    room_name: str
+    price_per_night: int
+    size: str
+    bed: str
+    image_file_name: str
+    location: str
+    description_pitch: str
+    size_sqm: int = 0
+    capacity: int = 2
+
+
+@dataclass(frozen=True)
+class MealDealInfo:
+    meal_deal_name: str
+    meal_deal_price: int
+
+
+@dataclass(frozen=True)
+class DealInfo:
+    deal_name: str
+    room_location: str
+    room_name: str
+    nights: str
+    new_price: int
+    old_price: int
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    rooms: tuple
+    meal_deals: tuple
+    deals: tuple
+    rooms_by_name: Mapping[str, RoomInfo]
+    rooms_by_location: Mapping[str, tuple]
+    meal_deals_by_name: Mapping[str, MealDealInfo]
+    deals_by_room: Mapping[str, DealInfo]
+    inventory: Mapping[tuple, int]
+    version: int
+    fingerprint: str  # <-- changes whenever a room, meal deal or deal changes, even in another process
+    loaded_at: float
+
+    def room(self, room_name, location=None) -> Optional[RoomInfo]:
+        room = self.rooms_by_name.get(room_name)
+        if room is None or (location is not None and room.location != location):
+            return None
+        return room
+
+    def rooms_in(self, location) -> tuple:
+        return self.rooms_by_location.get(location, ())
+
+    def meal_deal(self, meal_deal_name) -> Optional[MealDealInfo]:
+        return self.meal_deals_by_name.get(meal_deal_name)
+
+    def deal_for_room(self, room_name) -> Optional[DealInfo]:
+        return self.deals_by_room.get(room_name)
+
+    def units(self, room_name, location) -> int:
+        return self.inventory.get((room_name, location), 0)
+
+
+def build_snapshot(rooms, meal_deals, deals, inventory=(), version=0) -> CatalogSnapshot:
+    rooms = tuple(rooms)
+    meal_deals = tuple(meal_deals)
+    deals = tuple(deals)
+
+    rooms_by_location = {}
+    for room in rooms:
+        rooms_by_location.setdefault(room.location, []).append(room)
+
+    deals_by_room = {}
+    for deal in deals:
+        deals_by_room.setdefault(deal.room_name, deal)  # <-- first deal wins, same as query(...).first()
+
+    return CatalogSnapshot(
+        rooms=rooms,
+        meal_deals=meal_deals,
+        deals=deals,
+        rooms_by_name=MappingProxyType({room.room_name: room for room in rooms}),
+        rooms_by_location=MappingProxyType({key: tuple(value) for key, value in rooms_by_location.items()}),
+        meal_deals_by_name=MappingProxyType({meal_deal.meal_deal_name: meal_deal for meal_deal in meal_deals}),
+        deals_by_room=MappingProxyType(deals_by_room),
+        inventory=MappingProxyType({(room_name, location): units for room_name, location, units in inventory}),
+        version=version,
+        fingerprint=hashlib.sha256(repr((rooms, meal_deals, deals)).encode()).hexdigest()[:16],
+        loaded_at=time.monotonic(),
+    )
+
+
+def load_snapshot(db_session, version=0) -> CatalogSnapshot:
+    rooms = [
+        RoomInfo(r.room_name, r.price_per_night, r.size, r.bed, r.image_file_name, r.location, r.description_pitch,
+                 r.size_sqm, r.capacity)
+        for r in db_session.query(Rooms)
+    ]
+    meal_deals = [
+        MealDealInfo(m.meal_deal_name, m.meal_deal_price)
+        for m in db_session.query(MealDeals)
+    ]
+    deals = [
+        DealInfo(d.deal_name, d.room_location, d.room_name, d.nights, d.new_price, d.old_price)
+        for d in db_session.query(Deals)
+    ]
+    inventory = [(i.room_name, i.location, i.units) for i in db_session.query(RoomInventory)]
+    return build_snapshot(rooms, meal_deals, deals, inventory, version)
+
+
+class CatalogCache:
+    """Read-through cache holding the current CatalogSnapshot.
+
+    The snapshot is reloaded when it is older than ``ttl`` seconds or after
+    ``invalidate()`` has been called (e.g. when a catalog row is written).
+    """
+
+    def __init__(self, session_factory, ttl=300.0):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and not self._expired(snapshot):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or self._expired(snapshot):  # <-- another thread may have reloaded it already
+                with self.session_factory() as db_session:
+                    snapshot = load_snapshot(db_session, self._version)
+                self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+    def _expired(self, snapshot):
+        return self.ttl is not None and time.monotonic() - snapshot.loaded_at > self.ttl
+
+
+def is_catalog_object(obj):
+    return isinstance(obj, (Rooms, MealDeals, Deals, RoomInventory))
@@ -0,0 +1,167 @@
+import os
+import threading
+
+import sqlalchemy as sa
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+
+# Engine and session setup. Everything is read from the Flask config, so the same code
+# runs on the SQLite file in instance/ or, with DATABASE_URL, on PostgreSQL.
+# DATABASE_PARTITIONS adds one database per group of locations, see partitions.py.
+
+DATABASE_FILE_NAME = "Flora_Hotel.db"
+
+# applied to every new SQLite connection: WAL lets readers carry on while one worker
+# writes, busy_timeout waits for the write lock instead of failing with "database is locked"
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": 5000,  # <-- milliseconds
+    "synchronous": "NORMAL",  # <-- safe with WAL, only the last commits can be lost on power failure
+    "foreign_keys": "ON",  # <-- SQLite ignores ON DELETE CASCADE without it
+    "cache_size": -32000,  # <-- negative means KiB, so 32 MB per connection
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_RECYCLE = 1800
+
+
+def is_memory_database(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def default_database_url(instance_path):
+    # an absolute path, so the database is the same whatever folder the server is started from
+    return "sqlite:///" + os.path.join(instance_path, DATABASE_FILE_NAME)
+
+
+def partition_config(config):
+    """{number: (url, locations)} from DATABASE_PARTITIONS, e.g.
+    {"1": {"url": "sqlite:////srv/hotel/uk.db", "locations": ["United Kingdom"]}}.
+
+    Partition 0 is DATABASE_URL itself and keeps every location not listed here.
+    """
+    partitions = {}
+    seen = {}
+    for number, options in (config.get("DATABASE_PARTITIONS") or {}).items():
+        number = int(number)  # <-- JSON object keys are strings
+        if number < 1:
+            raise ValueError("DATABASE_PARTITIONS are numbered from 1, partition 0 is DATABASE_URL")
+        locations = tuple(options.get("locations") or ())
+        for location in locations:
+            if location in seen:
+                raise ValueError(f"{location!r} is in partitions {seen[location]} and {number}")
+            seen[location] = number
+        partitions[number] = (options["url"], locations)
+    return partitions
+
+
+def create_engine_from_config(config):
+    url = sa.engine.make_url(config["DATABASE_URL"])
+    options = {}
+    if not is_memory_database(url):  # <-- in-memory SQLite keeps a single connection, no pool to size
+        options.update(
+            pool_size=int(config.get("DATABASE_POOL_SIZE", DEFAULT_POOL_SIZE)),
+            max_overflow=int(config.get("DATABASE_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW)),
+            pool_recycle=int(config.get("DATABASE_POOL_RECYCLE", DEFAULT_POOL_RECYCLE)),
+        )
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}  # <-- pooled connections move between threads
+    else:
+        options["pool_pre_ping"] = True  # <-- drops connections the server closed while they sat in the pool
+    engine = sa.create_engine(url, **options)
+
+    if url.get_backend_name() == "sqlite":
+        pragmas = dict(DEFAULT_SQLITE_PRAGMAS, **config.get("SQLITE_PRAGMAS", {}))
+        if is_memory_database(url):
+            pragmas.pop("journal_mode")  # <-- WAL needs a file
+
+        @sa.event.listens_for(engine, "connect")
+        def apply_pragmas(dbapi_connection, connection_record):
+            for name, value in pragmas.items():
+                dbapi_connection.execute(f"PRAGMA {name}={value}")
+
+    return engine
+
+
+class Database:
+    """The engine, the session factory and one scoped session per request.
+
+    ``Session()`` opens independent sessions (CLI commands, the catalog cache),
+    ``session`` is the session of the current request and is removed by
+    ``teardown_appcontext`` once the request is over.
+
+    The engine is only created when it is first used, and again in every process
+    forked after that, so gunicorn workers never share the pooled connections of
+    the master they were forked from.
+
+    With DATABASE_PARTITIONS every other partition gets a Database of its own in
+    ``partitions``, and the sessions of each one carry its number in ``info``.
+    """
+
+    def __init__(self, config=None, number=0):
+        self.config = config
+        self.number = number
+        self.partitions = {}  # <-- number -> Database, only on the main one
+        self.engine_listeners = []
+        self._engine = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._sessionmaker = sessionmaker(expire_on_commit=False)
+        self.scoped = scoped_session(self.Session)
+
+    @property
+    def engine(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    if self._engine is not None:
+                        self._engine.dispose(close=False)  # <-- the parent's connections, only the parent may close them
+                    self._engine = create_engine_from_config(self.config)
+                    for listener in self.engine_listeners:
+                        listener(self._engine)
+                    self._pid = os.getpid()
+        return self._engine
+
+    def Session(self, **options):  # <-- called like the sessionmaker it wraps: "with Session() as db_session"
+        return self._sessionmaker(bind=self.engine, info={"partition": self.number}, **options)
+
+    @property
+    def session(self):
+        return self.scoped()
+
+    def init_app(self, app):
+        self.config = app.config
+        self.dispose()  # <-- an engine made for an earlier config, and the partitions made for it
+        self.partitions = {}
+        for number, (url, locations) in partition_config(app.config).items():
+            partition = Database(dict(app.config, DATABASE_URL=url, DATABASE_PARTITIONS={}), number)
+            partition.engine_listeners = self.engine_listeners  # <-- on_engine() covers every partition
+            self.partitions[number] = partition
+        app.teardown_appcontext(self.remove_session)
+
+    def all(self):
+        # this database and its partitions, in partition order
+        return [self, *(self.partitions[number] for number in sorted(self.partitions))]
+
+    def on_engine(self, listener):
+        # listener(engine) runs for every engine this creates, e.g. to add event listeners
+        if listener not in self.engine_listeners:
+            self.engine_listeners.append(listener)
+
+    def dispose(self):
+        # closes the pooled connections, the next use opens a new engine
+        for partition in self.partitions.values():
+            partition.dispose()
+        with self._lock:
+            if self._engine is not None and self._pid == os.getpid():
+                self._engine.dispose()
+            self._engine = None
+            self._pid = None
+
+    def remove_session(self, exception=None):
+        for partition in self.partitions.values():
+            partition.remove_session()
+        self.scoped.remove()
@@ -0,0 +1,29 @@
+import glob
+import multiprocessing
+import os
+
+
+# gunicorn -c gunicorn.conf.py
+#
+# The application is built once in the master with PRELOAD (catalog loaded, templates
+# compiled, garbage collector frozen) and the workers are forked from it, so they start
+# at once and share those pages copy-on-write. Each worker opens its own database engine
+# and session store connection the first time it uses them. Every worker writes its
+# /metrics numbers to FLASK_METRICS_DIRECTORY, a scrape of any of them adds them all up.
+
+wsgi_app = "app:create_app({'PRELOAD': True})"
+preload_app = True
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))  # <-- requests mostly wait on SQLite, a few threads per worker keep it busy
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))  # <-- 0 never recycles; a recycled worker is forked from the preloaded master again
+max_requests_jitter = max_requests // 10
+accesslog = None  # <-- the metrics at /metrics cover requests, the JSON log covers the rest
+
+os.environ.setdefault("FLASK_METRICS_DIRECTORY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "metrics"))
+
+
+def on_starting(server):
+    # the files of the last run's workers, a restarted server counts from 0 like a restarted worker
+    for path in glob.glob(os.path.join(os.environ["FLASK_METRICS_DIRECTORY"], "worker-*.json")):
+        os.remove(path)
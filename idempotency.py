@@ -0,0 +1,130 @@
+import hashlib
+import json
+import secrets
+import time
+from datetime import timedelta
+
+import sqlalchemy as sa
+
+from models import IdempotencyKey, utc_now
+
+
+# A booking or change form that is sent twice (double click, browser retry, a client
+# retrying after a timeout) carries the same idempotency key both times. The first
+# request stores its result under the key, the second one gets that result back instead
+# of booking again. Keys are kept for DEFAULT_TTL and then removed by the sweeper.
+
+DEFAULT_TTL = 24 * 3600
+PENDING_TIMEOUT = 30  # <-- a key still pending after this long belongs to a request that died
+WAIT_SECONDS = 5  # <-- how long a replay waits for the first request to finish
+POLL_SECONDS = 0.05
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+def new_key():
+    return secrets.token_urlsafe(16)
+
+
+def scoped_key(scope, key):
+    # the key as stored: who sent it (session id, "api") and what for, hashed to a fixed length
+    return hashlib.sha256(f"{scope}\0{key}".encode()).hexdigest()
+
+
+def fingerprint(*values):
+    return hashlib.sha256(json.dumps(values, default=str).encode()).hexdigest()
+
+
+class IdempotencyKeys:
+    """Idempotency keys in the database, shared by every worker.
+
+    Uses its own sessions, so a key is claimed and its result saved independently of
+    the request's transaction. ``run(..., session_factory=...)`` keeps the key in the
+    database the request writes to (the partition of its location or booking), by
+    default ``session_factory``; ``sources`` returns every one of them for sweep().
+    """
+
+    def __init__(self, session_factory, ttl=DEFAULT_TTL, pending_timeout=PENDING_TIMEOUT, wait_seconds=WAIT_SECONDS,
+                 sources=None):
+        self.session_factory = session_factory
+        self.sources = sources or (lambda: [session_factory])
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self.wait_seconds = wait_seconds
+
+    def begin(self, key, request_fingerprint, session_factory=None):
+        """Claims the key and returns None, or returns the stored result of an earlier request.
+
+        Raises IdempotencyConflict when the key was used for a different request, or
+        when the first request is still running after wait_seconds.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            now = utc_now()
+            with (session_factory or self.session_factory)() as db_session:
+                row = db_session.get(IdempotencyKey, key)
+                if row is None or row.expires_at < now:
+                    if row is not None:
+                        db_session.delete(row)
+                        db_session.flush()
+                    db_session.add(IdempotencyKey(key=key, fingerprint=request_fingerprint, result=None,
+                                                  created_at=now, expires_at=now + timedelta(seconds=self.ttl)))
+                    try:
+                        db_session.commit()
+                        return None
+                    except sa.exc.IntegrityError:
+                        db_session.rollback()  # <-- claimed by a request running at the same time
+                        continue
+                if row.fingerprint != request_fingerprint:
+                    raise IdempotencyConflict("this idempotency key was already used for a different request")
+                if row.result is not None:
+                    return json.loads(row.result)
+                if now - row.created_at > timedelta(seconds=self.pending_timeout):
+                    row.created_at = now  # <-- take over the key of a request that never finished
+                    db_session.commit()
+                    return None
+            if time.monotonic() > deadline:
+                raise IdempotencyConflict("the first request with this idempotency key is still running")
+            time.sleep(POLL_SECONDS)
+
+    def finish(self, key, result, session_factory=None):
+        with (session_factory or self.session_factory)() as db_session:
+            db_session.execute(
+                sa.update(IdempotencyKey).where(IdempotencyKey.key == key).values(result=json.dumps(result, default=str))
+            )
+            db_session.commit()
+
+    def abandon(self, key, session_factory=None):
+        # the request failed, a retry with the same key runs again instead of replaying the error
+        with (session_factory or self.session_factory)() as db_session:
+            db_session.execute(sa.delete(IdempotencyKey).where(IdempotencyKey.key == key))
+            db_session.commit()
+
+    def run(self, key, request_fingerprint, work, session_factory=None):
+        """Runs work() once per key and returns (result, replayed).
+
+        work() returns a JSON serialisable result. If it raises, the key is released.
+        """
+        stored = self.begin(key, request_fingerprint, session_factory)
+        if stored is not None:
+            return stored, True
+        try:
+            result = work()
+        except BaseException:
+            self.abandon(key, session_factory)
+            raise
+        self.finish(key, result, session_factory)
+        return result, False
+
+    def sweep(self, now=None):
+        cutoff = now or utc_now()
+        deleted = 0
+        for session_factory in self.sources():
+            with session_factory() as db_session:
+                deleted += db_session.execute(
+                    sa.delete(IdempotencyKey).where(IdempotencyKey.expires_at < cutoff)
+                ).rowcount
+                db_session.commit()
+        return deleted
@@ -0,0 +1,93 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+
+# Logging goes through a queue: the request thread only puts the record on the queue
+# and a background thread formats it and writes it out, so a slow terminal or log
+# file never holds up a request the way print() does.
+
+DEFAULT_LOG_LEVEL = "INFO"
+
+# attributes every LogRecord has, anything else on a record came from extra={...}
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line with the time, level, logger, message and the extra fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in STANDARD_ATTRIBUTES})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # the standard prepare() formats the whole record into the message, this keeps
+        # the extra fields and the traceback apart for StructuredFormatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_settings = None
+
+
+def configure_logging(level=DEFAULT_LOG_LEVEL, stream=None):
+    """Sends every log record through a queue to a JSON lines handler on stderr.
+
+    Calling it again replaces the previous setup.
+    """
+    global _listener, _settings
+    _settings = (level, stream)
+    if _listener is not None:
+        _listener.stop()
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(StructuredFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+    return _listener
+
+
+def restart_after_fork():
+    # the listener thread is not copied by fork(), a forked worker starts its own
+    global _listener
+    if _listener is not None:
+        _listener = None
+        configure_logging(*_settings)
+
+
+os.register_at_fork(after_in_child=restart_after_fork)
+
+
+@atexit.register
+def stop_logging():
+    # writes out whatever is still on the queue when the process exits
+    if _listener is not None:
+        _listener.stop()
@@ -0,0 +1,345 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+import sqlalchemy as sa
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+
+
+# Per-request timings kept in memory and exported at /metrics in the Prometheus text
+# format. Every worker process counts on its own, and gunicorn's workers share one
+# port, so a scrape reaches whichever worker accepts it. With METRICS_DIRECTORY set
+# (gunicorn.conf.py does) each worker also writes its numbers to a file there and
+# /metrics adds up the files of every worker, the way prometheus_client's
+# multiprocess mode does.
+
+logger = logging.getLogger("hotel.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+DEFAULT_SLOW_REQUEST_SECONDS = 0.5
+SLOW_LOG_MAX_QUERIES = 50
+WORKER_FILE_SECONDS = 1.0  # <-- a worker writes its file at most this often, and whenever it answers /metrics
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    @staticmethod
+    def combine(value, other):
+        return value + other
+
+    def samples(self, values=None):
+        values = self.snapshot() if values is None else values
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labels, label_values)} {format_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # <-- label values -> [count per bucket..., count above the last, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)  # <-- buckets are "less than or equal"
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    @staticmethod
+    def combine(series, other):
+        return [count + other_count for count, other_count in zip(series, other)]
+
+    def samples(self, all_series=None):
+        all_series = self.snapshot() if all_series is None else all_series
+        for label_values, series in sorted(all_series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{format_number(bound) if bound != "+Inf" else bound}"'
+                yield f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, label_values)} {format_number(series[-1])}"
+            yield f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        os.register_at_fork(after_in_child=self.reset)  # <-- a forked worker counts from 0, not from what the master did
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self, snapshots=None):
+        # snapshots: {metric name: {label values: value}} of every worker, added up; this process's own by default
+        lines = []
+        for metric in self.metrics:
+            values = None
+            if snapshots is not None:
+                values = {}
+                for snapshot in snapshots:
+                    for label_values, value in snapshot.get(metric.name, {}).items():
+                        values[label_values] = metric.combine(values[label_values], value) if label_values in values else value
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(values))
+        return "\n".join(lines) + "\n"
+
+
+class WorkerFiles:
+    """The registry of every worker process as a JSON file in ``directory``.
+
+    Each process writes its own file (worker-<pid>-<random>.json, replaced whole) and
+    read() returns all of them. The files of workers that exited stay, what they
+    counted still counts; gunicorn.conf.py empties the directory when the server starts.
+    """
+
+    def __init__(self, directory, interval=WORKER_FILE_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self._path = None
+        self._pid = None
+        self._next_write = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        if self._pid != os.getpid():  # <-- a forked worker writes a file of its own, a new pid can't take over an old file
+            self._path = os.path.join(self.directory, f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+            self._pid = os.getpid()
+            self._next_write = 0.0
+        return self._path
+
+    def write(self, registry, force=False):
+        if not force and time.monotonic() < self._next_write:
+            return
+        if not self._lock.acquire(blocking=force):
+            return  # <-- another thread of this worker is writing it right now
+        try:
+            path = self.path
+            self._next_write = time.monotonic() + self.interval
+            document = {name: [[list(label_values), value] for label_values, value in values.items()]
+                        for name, values in registry.snapshot().items()}
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(document, file, separators=(",", ":"))
+            os.replace(path + ".tmp", path)  # <-- a reader sees the old file or the new one, never half of one
+        finally:
+            self._lock.release()
+
+    def read(self):
+        snapshots = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return snapshots
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as file:
+                    document = json.load(file)
+            except (OSError, ValueError):
+                continue  # <-- removed since listdir()
+            snapshots.append({metric: {tuple(label_values): value for label_values, value in rows}
+                              for metric, rows in document.items()})
+        return snapshots
+
+
+class RequestStats:
+    # what one request did, kept on flask.g
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []  # <-- (statement, seconds)
+        self.sql_seconds = 0.0
+        self.template_starts = []
+        self.status = None
+
+
+class Metrics:
+    """Request latency, SQL statements, template render time and database lock wait.
+
+    The SQL numbers come from engine events, so every query counts, including the
+    ones the ORM issues on its own (lazy loads, flushes).
+    """
+
+    def __init__(self, app=None, engine=None):
+        self.registry = Registry()
+        self.worker_files = None
+        self.allowed = None  # <-- a callable, /metrics answers 403 when it returns False
+        self.request_seconds = self.registry.add(Histogram(
+            "hotel_http_request_duration_seconds", "Time spent handling a request.", ("route", "method", "status")))
+        self.request_statements = self.registry.add(Histogram(
+            "hotel_http_request_sql_statements", "SQL statements run by one request.", ("route",), COUNT_BUCKETS))
+        self.request_sql_seconds = self.registry.add(Histogram(
+            "hotel_http_request_sql_seconds", "Time one request spent in SQL statements.", ("route",)))
+        self.statements = self.registry.add(Counter(
+            "hotel_sql_statements_total", "SQL statements run, inside and outside requests."))
+        self.template_seconds = self.registry.add(Histogram(
+            "hotel_template_render_seconds", "Time spent rendering a template.", ("template",)))
+        self.lock_wait_seconds = self.registry.add(Histogram(
+            "hotel_db_lock_wait_seconds", "Time spent waiting for the SQLite write lock (BEGIN IMMEDIATE)."))
+        self.slow_requests = self.registry.add(Counter(
+            "hotel_slow_requests_total", "Requests slower than SLOW_REQUEST_SECONDS.", ("route",)))
+        if engine is not None:
+            self.instrument_engine(engine)
+        if app is not None:
+            self.init_app(app)
+        atexit.register(self.write_worker_file)  # <-- what a worker counted since its last write
+
+    def init_app(self, app):
+        self.slow_request_seconds = float(app.config.get("SLOW_REQUEST_SECONDS", DEFAULT_SLOW_REQUEST_SECONDS))
+        directory = app.config.get("METRICS_DIRECTORY")
+        self.worker_files = WorkerFiles(directory) if directory else None
+        app.before_request(self.start_request)
+        app.after_request(self.remember_status)
+        app.teardown_request(self.finish_request)
+        before_render_template.connect(self.start_template, app, weak=False)
+        template_rendered.connect(self.finish_template, app, weak=False)
+        if app.config.get("METRICS_ENDPOINT", True):
+            app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def instrument_engine(self, engine):
+        sa.event.listen(engine, "before_cursor_execute", self.before_statement)
+        sa.event.listen(engine, "after_cursor_execute", self.after_statement)
+
+    # SQL
+
+    def before_statement(self, connection, cursor, statement, parameters, context, executemany):
+        connection.info["statement_started"] = time.perf_counter()
+
+    def after_statement(self, connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info.pop("statement_started")
+        self.statements.inc()
+        if statement.startswith("BEGIN IMMEDIATE"):
+            self.lock_wait_seconds.observe(elapsed)  # <-- returns once the write lock is ours
+        stats = g.get("request_stats") if has_request_context() else None
+        if stats is not None:
+            stats.queries.append((statement, elapsed))
+            stats.sql_seconds += elapsed
+
+    # templates
+
+    def start_template(self, sender, template, context, **extra):
+        stats = g.get("request_stats")
+        if stats is not None:
+            stats.template_starts.append(time.perf_counter())
+
+    def finish_template(self, sender, template, context, **extra):
+        stats = g.get("request_stats")
+        if stats is not None and stats.template_starts:
+            self.template_seconds.observe(time.perf_counter() - stats.template_starts.pop(), template.name)
+
+    # requests
+
+    def start_request(self):
+        g.request_stats = RequestStats()
+
+    def remember_status(self, response):
+        stats = g.get("request_stats")
+        if stats is not None:
+            stats.status = response.status_code
+        return response
+
+    def finish_request(self, exception=None):
+        stats = g.pop("request_stats", None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        status = stats.status or 500  # <-- after_request is skipped when the view raised
+        self.request_seconds.observe(elapsed, route, request.method, str(status))
+        self.request_statements.observe(len(stats.queries), route)
+        self.request_sql_seconds.observe(stats.sql_seconds, route)
+        if elapsed >= self.slow_request_seconds:
+            self.slow_requests.inc(route)
+            logger.warning("slow request", extra={
+                "route": route,
+                "method": request.method,
+                "status": status,
+                "duration_ms": round(elapsed * 1000, 1),
+                "sql_ms": round(stats.sql_seconds * 1000, 1),
+                "query_count": len(stats.queries),
+                "queries": [
+                    {"sql": " ".join(statement.split()), "ms": round(seconds * 1000, 2)}
+                    for statement, seconds in stats.queries[:SLOW_LOG_MAX_QUERIES]
+                ],
+            })
+        if self.worker_files is not None:
+            self.worker_files.write(self.registry)
+
+    def write_worker_file(self):
+        if self.worker_files is not None:
+            self.worker_files.write(self.registry, force=True)
+
+    def metrics_view(self):
+        if self.allowed is not None and not self.allowed():
+            abort(403)
+        if self.worker_files is None:
+            return Response(self.registry.render(), mimetype="text/plain; version=0.0.4")
+        self.write_worker_file()  # <-- this worker's numbers as of now, the others' as of their last request
+        return Response(self.registry.render(self.worker_files.read()), mimetype="text/plain; version=0.0.4")
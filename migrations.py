@@ -0,0 +1,115 @@
+import re
+
+import sqlalchemy as sa
+
+from models import Base, Customer, Rooms
+
+
+# Schema upgrades for databases that were created before a change to models.py.
+# Every migration runs once, in order, and the last one applied is remembered in the
+# schema_version table, so upgrade_schema() is cheap to call on every start.
+
+schema_version = sa.Table(
+    "schema_version",
+    Base.metadata,
+    sa.Column("version", sa.Integer, primary_key=True),
+    sa.Column("name", sa.String, nullable=False),
+)
+
+
+def create_missing_indexes(connection):
+    # create_all() skips tables that already exist, so their new indexes are added here
+    inspector = sa.inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if all(column.name in columns for column in index.columns):  # <-- a later migration adds the column and its index
+                index.create(connection, checkfirst=True)
+
+
+def cascade_customer_delete(connection):
+    # customers.booking_number gets ON DELETE CASCADE so cancelling is a single DELETE on booking
+    foreign_keys = sa.inspect(connection).get_foreign_keys("customers")
+    if any(key["options"].get("ondelete", "").upper() == "CASCADE" for key in foreign_keys):
+        return  # <-- created by create_all() with the current models
+    if connection.dialect.name != "sqlite":
+        for key in foreign_keys:
+            connection.exec_driver_sql(f"ALTER TABLE customers DROP CONSTRAINT {key['name']}")
+        connection.exec_driver_sql(
+            "ALTER TABLE customers ADD FOREIGN KEY (booking_number) REFERENCES booking (booking_number) ON DELETE CASCADE"
+        )
+        return
+    # SQLite cannot change a foreign key in place, the table is rebuilt from a copy
+    table = Customer.__table__
+    columns = ", ".join(column.name for column in table.columns)
+    connection.exec_driver_sql("ALTER TABLE customers RENAME TO customers_old")
+    for index in table.indexes:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    table.create(connection)
+    connection.exec_driver_sql(f"INSERT INTO customers ({columns}) SELECT {columns} FROM customers_old")
+    connection.exec_driver_sql("DROP TABLE customers_old")
+
+
+def size_in_sqm(size):
+    # "20-30 sqm" -> 20, the smallest size a guest gets
+    match = re.search(r"\d+", size or "")
+    return int(match.group()) if match else 0
+
+
+def capacity_for_bed(bed):
+    return 1 if "single" in (bed or "").lower() else 2
+
+
+def room_size_and_capacity(connection):
+    # size_sqm and capacity columns for the search filters, filled in from the text columns
+    columns = {column["name"] for column in sa.inspect(connection).get_columns("rooms")}
+    if "size_sqm" not in columns:
+        connection.exec_driver_sql("ALTER TABLE rooms ADD COLUMN size_sqm INTEGER NOT NULL DEFAULT 0")
+    if "capacity" not in columns:
+        connection.exec_driver_sql("ALTER TABLE rooms ADD COLUMN capacity INTEGER NOT NULL DEFAULT 2")
+    rooms = Rooms.__table__
+    for room_name, size, bed in connection.execute(sa.select(rooms.c.room_name, rooms.c.size, rooms.c.bed)):
+        connection.execute(
+            sa.update(rooms).where(rooms.c.room_name == room_name)
+            .values(size_sqm=size_in_sqm(size), capacity=capacity_for_bed(bed))
+        )
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_rooms_location_price")  # <-- ix_rooms_location_price_name covers it
+    create_missing_indexes(connection)
+
+
+def booking_created_at(connection):
+    # when a booking was made, so bookings that never got customer details can expire
+    columns = {column["name"] for column in sa.inspect(connection).get_columns("booking")}
+    if "created_at" not in columns:
+        connection.exec_driver_sql("ALTER TABLE booking ADD COLUMN created_at DATETIME")
+    create_missing_indexes(connection)
+
+
+MIGRATIONS = [
+    (1, "booking, customer, room and deal indexes", create_missing_indexes),
+    (2, "cascade customer delete", cascade_customer_delete),
+    (3, "room size and capacity", room_size_and_capacity),
+    (4, "booking created_at", booking_created_at),
+]
+
+
+def current_version(connection):
+    return connection.execute(sa.select(sa.func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade_schema(engine, migrations=MIGRATIONS):
+    """Creates missing tables and applies the migrations this database has not seen yet.
+
+    Returns the names of the migrations that were applied.
+    """
+    applied = []
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)  # <-- only creates the tables that are missing
+        version = current_version(connection)
+        for number, name, migrate in migrations:
+            if number <= version:
+                continue
+            migrate(connection)
+            connection.execute(sa.insert(schema_version).values(version=number, name=name))
+            applied.append(name)
+    return applied
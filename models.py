@@ -0,0 +1,197 @@
+from datetime import date, datetime, timezone
+from typing import Optional
+from sqlalchemy import ForeignKey, Index, Integer
+from sqlalchemy.orm import Mapped, mapped_column, declarative_base, relationship
+
+Base = declarative_base()
+
+
+def utc_now():
+    # naive UTC, what DateTime columns store on SQLite
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Creating the models of our database
+# model = table
+
+class Booking(Base):
+    __tablename__ = "booking"
+
+    booking_number: Mapped[int] = mapped_column(
+        Integer,
+        primary_key=True,
+        autoincrement=False  # <-- numbers are handed out by bookings.next_booking_number()
+    )
+    check_in: Mapped[date]
+    check_out: Mapped[date]
+    room_selection: Mapped[str] = mapped_column(ForeignKey("rooms.room_name"))
+    nights: Mapped[int]
+    people: Mapped[int]
+    total_price: Mapped[int]
+    location: Mapped[str]
+    meal_deal: Mapped[str]
+    created_at: Mapped[Optional[datetime]]  # <-- set by book_room(), empty for imported bookings
+
+    customer: Mapped[Optional["Customer"]] = relationship(back_populates="booking", passive_deletes=True)  # <-- the database deletes it with the booking
+    room: Mapped["Rooms"] = relationship(viewonly=True)
+    meal_deal_details: Mapped[Optional["MealDeals"]] = relationship(
+        primaryjoin="foreign(Booking.meal_deal) == MealDeals.meal_deal_name", viewonly=True
+    )
+
+    __table_args__ = (
+        Index("ix_booking_room_dates", "room_selection", "location", "check_in", "check_out"),  # <-- overlap checks and reports per room
+        Index("ix_booking_check_in", "check_in", "check_out"),  # <-- reports by date range
+        Index("ix_booking_check_out", "check_out"),  # <-- archive.py looking for stays that are over
+        Index("ix_booking_created_at", "created_at"),  # <-- the sweeper looking for old bookings without customer
+    )
+
+    def __repr__(self):
+        return f"<Booking(booking_number={self.booking_number}, check_in={self.check_in}, check_out={self.check_out}, room_selection={self.room_selection}, nights={self.nights}, people={self.people}, total_price={self.total_price}, location={self.location}, meal_deal={self.meal_deal})>"
+
+
+class Customer(Base):
+    __tablename__ = "customers"
+    booking_number: Mapped[int] = mapped_column(Integer, ForeignKey("booking.booking_number", ondelete="CASCADE"), primary_key=True,
+                                                default="booking.booking_number")
+    name: Mapped[str]
+    surname: Mapped[str]
+    email: Mapped[str]
+    address: Mapped[str]
+    telephone: Mapped[int]
+
+    booking: Mapped["Booking"] = relationship(back_populates="customer")
+
+    __table_args__ = (
+        Index("ix_customers_booking_number_surname", "booking_number", "surname"),  # <-- covers the login_booking lookup
+        Index("ix_customers_surname", "surname"),
+    )
+
+    def __repr__(self):
+        return f"<Customer(booking_number={self.booking_number}, name={self.name}, surname={self.surname}, email={self.email}, address={self.address}, telephone={self.telephone})>"
+
+class MealDeals(Base):
+    __tablename__ = "meal_deals"
+
+    meal_deal_name: Mapped[str] = mapped_column(primary_key=True)
+    meal_deal_price: Mapped[int]
+
+    def __repr__(self):
+        return f"<MealDeals(meal_deal_name={self.meal_deal_name}, meal_deal_price={self.meal_deal_price})>"
+
+class Rooms(Base):
+    __tablename__ = "rooms"
+
+    room_name: Mapped[str] = mapped_column(primary_key=True)
+    price_per_night: Mapped[int]
+    size: Mapped[str]
+    bed: Mapped[str]
+    image_file_name: Mapped[str]
+    location: Mapped[str]
+    description_pitch: Mapped[str]
+    size_sqm: Mapped[int] = mapped_column(server_default="0")  # <-- the smallest size in "size", for filtering and sorting
+    capacity: Mapped[int] = mapped_column(server_default="2")  # <-- how many people the room sleeps
+
+    __table_args__ = (
+        Index("ix_rooms_location_price_name", "location", "price_per_night", "room_name"),  # <-- search results by price, one page at a time
+        Index("ix_rooms_location_size_name", "location", "size_sqm", "room_name"),  # <-- search results by size
+    )
+
+    def __repr__(self):
+        return f"<Rooms(room_name={self.room_name}, price_per_night={self.price_per_night}, size={self.size}, image_path={self.image_file_name}, location={self.location}, description={self.description_pitch}, capacity={self.capacity})>"
+
+class Deals(Base):
+    __tablename__ = "deals"
+
+    deal_name: Mapped[str] = mapped_column(primary_key=True)
+    room_location: Mapped[str]
+    room_name: Mapped[str]
+    nights: Mapped[str]
+    new_price: Mapped[int]
+    old_price: Mapped[int]
+
+    __table_args__ = (
+        Index("ix_deals_room_name", "room_name", "room_location"),
+    )
+
+    def __repr__(self):
+        return f"Deals(deal_name={self.deal_name}, room_location={self.room_location}, room_name={self.room_name}, new_price={self.new_price}, old_price={self.old_price})"
+
+class RoomInventory(Base):
+    __tablename__ = "room_inventory"
+
+    room_name: Mapped[str] = mapped_column(ForeignKey("rooms.room_name"), primary_key=True)
+    location: Mapped[str] = mapped_column(primary_key=True)
+    units: Mapped[int]  # <-- how many physical rooms of this type the location has
+
+    def __repr__(self):
+        return f"<RoomInventory(room_name={self.room_name}, location={self.location}, units={self.units})>"
+
+class RoomNight(Base):
+    __tablename__ = "room_nights"
+
+    # one row per room type, location and night that has at least one booking,
+    # the primary key doubles as the index for "location + room + night range" lookups
+    location: Mapped[str] = mapped_column(primary_key=True)
+    room_name: Mapped[str] = mapped_column(primary_key=True)
+    night: Mapped[date] = mapped_column(primary_key=True)
+    booked: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self):
+        return f"<RoomNight(location={self.location}, room_name={self.room_name}, night={self.night}, booked={self.booked})>"
+
+class DailyRevenue(Base):
+    __tablename__ = "daily_revenue"
+
+    # one row per night, location, room type and meal deal that has at least one booking,
+    # kept up to date by reporting.record_booking() in the transaction that writes the booking
+    night: Mapped[date] = mapped_column(primary_key=True)
+    location: Mapped[str] = mapped_column(primary_key=True)
+    room_name: Mapped[str] = mapped_column(primary_key=True)
+    meal_deal: Mapped[str] = mapped_column(primary_key=True)
+    rooms_sold: Mapped[int] = mapped_column(default=0)
+    revenue: Mapped[int] = mapped_column(default=0)  # <-- the booking's total_price spread over its nights
+    arrivals: Mapped[int] = mapped_column(default=0)  # <-- bookings checking in on this night
+
+    def __repr__(self):
+        return f"<DailyRevenue(night={self.night}, location={self.location}, room_name={self.room_name}, meal_deal={self.meal_deal}, rooms_sold={self.rooms_sold}, revenue={self.revenue}, arrivals={self.arrivals})>"
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(primary_key=True)  # <-- sha256 of who sent it and the key itself
+    fingerprint: Mapped[str]  # <-- the request the key was first used for
+    result: Mapped[Optional[str]]  # <-- JSON, empty while the first request is still running
+    created_at: Mapped[datetime]
+    expires_at: Mapped[datetime] = mapped_column(index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key={self.key}, created_at={self.created_at}, expires_at={self.expires_at})>"
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str]  # <-- which handler runs it, e.g. "booking_confirmed"
+    payload: Mapped[str]  # <-- JSON
+    status: Mapped[str]  # <-- pending, running, done or failed
+    attempts: Mapped[int]
+    run_after: Mapped[datetime]  # <-- when a pending job may start, for a running one when its lease ends
+    created_at: Mapped[datetime]
+    finished_at: Mapped[Optional[datetime]]
+    last_error: Mapped[Optional[str]]
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_after", "status", "run_after"),  # <-- the workers looking for the next job
+    )
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind={self.kind}, status={self.status}, attempts={self.attempts}, run_after={self.run_after})>"
+
+class BookingSequence(Base):
+    __tablename__ = "booking_sequence"
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[int]
+
+    def __repr__(self):
+        return f"<BookingSequence(name={self.name}, value={self.value})>"
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import logging
+import os
+
+
+# Messages to customers (booking confirmed, changed, cancelled). There is no mail
+# provider yet: FileNotifier writes each message to the outbox folder as JSON and
+# LogNotifier only logs it. A real one needs the same send(message) method.
+
+logger = logging.getLogger("hotel.notifications")
+
+
+def message_id(message):
+    # the same message always gets the same id, so a retried job overwrites its file instead of adding one
+    return hashlib.sha256(json.dumps(message, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+
+class FileNotifier:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def send(self, message):
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"{message_id(message)}.json")
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(message, file, indent=2, default=str)
+        os.replace(temporary, path)  # <-- whoever reads the outbox never sees half a message
+        return path
+
+
+class LogNotifier:
+    def send(self, message):
+        logger.info("notification", extra={"to": message["to"], "subject": message["subject"]})
+
+
+def notifier_from_config(config):
+    backend = config.get("NOTIFIER", "file")
+    if backend == "log":
+        return LogNotifier()
+    if backend == "file":
+        return FileNotifier(config["NOTIFICATION_FOLDER"])
+    raise ValueError(f"unknown NOTIFIER {backend!r}, expected 'file' or 'log'")
@@ -0,0 +1,157 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+# Pages that look the same for everyone with the same inputs are rendered once and
+# served from memory afterwards. The key is the URL, the session values the page uses
+# and the catalog fingerprint, so a change to rooms, meal deals or deals (in this or any
+# other worker) gives new keys and the old pages simply fall out of the LRU.
+
+DEFAULT_MAX_ENTRIES = 512
+
+
+class LRUCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PageCache:
+    """Full page cache for GET views, with strong ETags and 304 responses.
+
+    ``catalog`` is the CatalogCache whose fingerprint goes into every key.
+    """
+
+    def __init__(self, catalog, app=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.catalog = catalog
+        self.pages = LRUCache(max_entries)
+        self.fragments = LRUCache(max_entries)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        max_entries = app.config.get("PAGE_CACHE_MAX_ENTRIES")
+        if max_entries:
+            self.pages.max_entries = self.fragments.max_entries = int(max_entries)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self.fragments
+        self.app = app
+
+    def clear(self):
+        self.pages.clear()
+        self.fragments.clear()
+
+    def cached(self, *session_keys, fresh=None):
+        """Caches a view's GET response, keyed on the URL and these session values.
+
+        ``fresh`` maps placeholders the view renders to functions called for every
+        response, e.g. a new idempotency key per visit. Those pages are still rendered
+        once, but are sent without ETag and are not stored by the browser.
+        """
+        fresh = {placeholder.encode(): value for placeholder, value in (fresh or {}).items()}
+
+        def fill(body):
+            for placeholder, value in fresh.items():
+                body = body.replace(placeholder, value().encode())
+            return body
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method not in ("GET", "HEAD") or "_flashes" in session:  # <-- flashed messages are shown once
+                    response = self.app.make_response(view(*args, **kwargs))
+                    if fresh and not response.direct_passthrough and response.mimetype == "text/html":
+                        response.set_data(fill(response.get_data()))
+                    return response
+                key = (
+                    request.path,
+                    tuple(sorted(request.args.items(multi=True))),
+                    tuple(session.get(name) for name in session_keys),
+                    self.catalog.get().fingerprint,
+                )
+                page = self.pages.get(key)
+                if page is None:
+                    response = self.app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough or response.mimetype != "text/html":
+                        return response  # <-- redirects and errors are never cached
+                    body = response.get_data()
+                    page = (body, response.headers["Content-Type"], hashlib.sha256(body).hexdigest()[:32])
+                    self.pages.set(key, page)
+                body, content_type, etag = page
+                if fresh:
+                    response = self.app.response_class(fill(body), content_type=content_type)
+                    response.cache_control.no_store = True  # <-- going back to the page asks for it again, with a new value
+                    return response
+                response = self.app.response_class(body, content_type=content_type)
+                response.set_etag(etag)  # <-- strong ETag, same bytes for the same key
+                response.cache_control.no_cache = True  # <-- the browser keeps it but asks with If-None-Match first
+                response.cache_control.private = True
+                return response.make_conditional(request)  # <-- 304 without a body when the ETag matches
+            return wrapper
+        return decorator
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache "name", key, ... %}...{% endcache %} renders the block once per key.
+
+    Every value the block depends on has to be part of the key.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(self.call_method("_render", [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = tuple(key)
+        html = cache.get(key)
+        if html is None:
+            html = Markup(caller())
+            cache.set(key, html)
+        return html
@@ -0,0 +1,153 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+
+from availability import rebuild_occupancy
+from bookings import booking_partition
+from database import partition_config
+from models import Booking, Customer, DailyRevenue, Deals, MealDeals, RoomInventory, RoomNight, Rooms
+from persistence import bulk_upsert, object_to_row
+from reporting import rebuild_reports
+
+
+# Every group of locations can have a database of its own (DATABASE_PARTITIONS), so a
+# busy location only ever waits for the write lock of its own database. A booking lives
+# in the partition of its location and its number comes from that partition's range
+# (bookings.PARTITION_SPAN), so the number alone leads to the right database. The rooms,
+# meal deals and deals are kept in the main database and copied to every partition.
+# Questions about every location (reports, the sweeper, the job workers) go to all the
+# partitions at once and their answers are put together here.
+
+LEGACY_CACHE_SIZE = 10000
+MOVE_BATCH_SIZE = 1000  # <-- bookings moved per transaction by move_bookings()
+CATALOG_MODELS = (MealDeals, Rooms, Deals, RoomInventory)  # <-- in foreign key order
+
+
+class PartitionRouter:
+    """Finds the Database (see database.py) that holds a location or a booking.
+
+    ``for_location(...).session`` and ``for_booking(...).session`` are the sessions
+    of the current request in that partition. Without DATABASE_PARTITIONS both
+    return the main database, so the pages work the same either way.
+    """
+
+    def __init__(self, database, app=None):
+        self.database = database
+        self.locations = {}  # <-- location -> partition number, the others are in partition 0
+        self._legacy = {}  # <-- booking number -> partition, for the numbers that don't say
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["partitions"] = self
+        self.locations = {location: number for number, (_, locations) in partition_config(app.config).items()
+                          for location in locations}
+        self._legacy = {}
+
+    @property
+    def partitioned(self):
+        return bool(self.database.partitions)
+
+    def all(self):
+        return self.database.all()
+
+    def get(self, number):
+        # an unknown partition is answered by the main database, which simply won't have the booking
+        return self.database.partitions.get(number, self.database)
+
+    def for_location(self, location):
+        return self.get(self.locations.get(location, 0))
+
+    def for_booking(self, booking_number):
+        number = booking_partition(booking_number)
+        if number or not self.partitioned:
+            return self.get(number)
+        return self.get(self.locate(int(booking_number)))
+
+    def locate(self, booking_number):
+        # numbers from before the partitions existed are all in the range of partition 0, but
+        # move_bookings() may have taken them to another partition: look in each of them
+        number = self._legacy.get(booking_number)
+        if number is not None:
+            return number
+        for partition in self.all():
+            with partition.Session() as db_session:
+                if db_session.get(Booking, booking_number) is not None:
+                    break
+        else:
+            return 0  # <-- not booked (yet), not cached: the number may still be handed out
+        if len(self._legacy) >= LEGACY_CACHE_SIZE:
+            self._legacy.clear()
+        self._legacy[booking_number] = partition.number
+        return partition.number
+
+    def scatter(self, work, partitions=None):
+        """Runs work(db_session) in every partition at the same time, in a session of its own.
+
+        Returns the results in partition order, the caller puts them together.
+        """
+        partitions = partitions or self.all()
+
+        def run(partition):
+            with partition.Session() as db_session:
+                return work(db_session)
+
+        if len(partitions) == 1:
+            return [run(partitions[0])]
+        with ThreadPoolExecutor(max_workers=len(partitions), thread_name_prefix="scatter") as executor:
+            return list(executor.map(run, partitions))
+
+    def copy_catalog(self, partition):
+        # the rooms, meal deals, deals and inventory of the main database, written over those of the partition
+        with self.database.Session() as source:
+            rows = {model: [object_to_row(obj) for obj in source.scalars(sa.select(model))] for model in CATALOG_MODELS}
+        with partition.Session() as db_session:
+            count = sum(bulk_upsert(db_session, model, model_rows) for model, model_rows in rows.items() if model_rows)
+            db_session.commit()
+        return count
+
+    def sync_catalog(self):
+        for partition in self.database.partitions.values():
+            self.copy_catalog(partition)
+
+    def move_bookings(self, batch_size=MOVE_BATCH_SIZE, on_batch=None):
+        """Moves the bookings of every partitioned location out of the main database.
+
+        Needed once, after a location already in the main database was given a partition.
+        Each batch is written to the partition before it is deleted from the main
+        database, so an interrupted run is finished by running it again. Returns how
+        many bookings were moved.
+        """
+        moved = 0
+        for number, partition in sorted(self.database.partitions.items()):
+            locations = [location for location, target in self.locations.items() if target == number]
+            if not locations:
+                continue
+            with self.database.Session() as source, partition.Session() as target:
+                while True:
+                    bookings = source.scalars(
+                        sa.select(Booking).where(Booking.location.in_(locations))
+                        .order_by(Booking.booking_number).limit(batch_size)
+                    ).all()
+                    if not bookings:
+                        break
+                    numbers = [booking.booking_number for booking in bookings]
+                    customers = source.scalars(sa.select(Customer).where(Customer.booking_number.in_(numbers))).all()
+                    bulk_upsert(target, Booking, [object_to_row(booking) for booking in bookings])
+                    if customers:
+                        bulk_upsert(target, Customer, [object_to_row(customer) for customer in customers])
+                    target.commit()
+                    source.execute(sa.delete(Booking).where(Booking.booking_number.in_(numbers)))  # <-- and the customers, by the cascade
+                    source.commit()
+                    moved += len(bookings)
+                    if on_batch is not None:
+                        on_batch(number, moved)
+                # the counts per night follow the bookings: recomputed where they are now, dropped where they were
+                rebuild_occupancy(target)
+                rebuild_reports(target)
+                target.commit()
+                for model in (RoomNight, DailyRevenue):
+                    source.execute(sa.delete(model).where(model.location.in_(locations)))
+                source.commit()
+        self._legacy = {}
+        return moved
@@ -0,0 +1,96 @@
+import csv
+import json
+from datetime import date
+from functools import lru_cache
+from itertools import islice
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+# Bulk writes: many rows per statement (executemany) and one transaction per batch,
+# instead of commit_to_database()'s one session, commit and refresh per object.
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def upsert_statement(db_session, model):
+    if db_session.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def object_to_row(obj):
+    return {column.key: getattr(obj, column.key) for column in sa.inspect(obj).mapper.column_attrs}
+
+
+@lru_cache(maxsize=None)
+def column_types(model):
+    return {column.key: column.type.python_type for column in sa.inspect(model).columns}
+
+
+def coerce_row(model, row):
+    # values read from CSV are strings, turn them into what the column expects
+    types = column_types(model)
+    coerced = {}
+    for key, value in row.items():
+        python_type = types.get(key)
+        if python_type is None:
+            continue
+        if isinstance(value, str) and python_type is not str:
+            value = date.fromisoformat(value) if python_type is date else python_type(value)
+        coerced[key] = value
+    return coerced
+
+
+def add_all(session_factory, objects, refresh=False):
+    # the batched version of commit_to_database(), one transaction for every object
+    objects = list(objects)
+    with session_factory() as db_session:
+        db_session.add_all(objects)
+        db_session.commit()
+        if refresh:
+            for obj in objects:
+                db_session.refresh(obj)
+    return objects
+
+
+def bulk_insert(db_session, model, rows, batch_size=DEFAULT_BATCH_SIZE):
+    count = 0
+    for batch in batched(rows, batch_size):
+        db_session.execute(sa.insert(model), batch)
+        count += len(batch)
+    return count
+
+
+def bulk_upsert(db_session, model, rows, batch_size=DEFAULT_BATCH_SIZE):
+    # insert rows, or overwrite every non primary key column when the row already exists
+    primary_key = [column.name for column in sa.inspect(model).primary_key]
+    count = 0
+    for batch in batched(rows, batch_size):
+        statement = upsert_statement(db_session, model)
+        updates = {name: statement.excluded[name] for name in batch[0] if name not in primary_key}
+        if updates:
+            statement = statement.on_conflict_do_update(index_elements=primary_key, set_=updates)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=primary_key)
+        db_session.execute(statement, batch)
+        count += len(batch)
+    return count
+
+
+def iter_records(path):
+    # streams dicts from a .csv file (with a header line) or a .jsonl file, one line at a time
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
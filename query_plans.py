@@ -0,0 +1,87 @@
+import re
+from datetime import date
+
+import sqlalchemy as sa
+
+from models import Base, Booking, Customer, Deals, Rooms, RoomNight
+from search import SearchFilters, search_statement
+from reporting import report_statement
+from tasks import next_due_statement, next_job_statement
+from archive import due_statement
+
+
+# The queries the booking flow runs on every request. check_query_plans() asks SQLite
+# how it would run each of them and reports the ones that would read a whole table.
+
+SAMPLE_DAY = date(2030, 1, 1)
+SAMPLE_NEXT_WEEK = date(2030, 1, 8)
+
+HOT_QUERIES = {
+    "login_booking": sa.select(Customer).where(Customer.booking_number == 1000009, Customer.surname == "Smith"),
+    "booking_by_number": sa.select(Booking).where(Booking.booking_number == 1000009),
+    "customers_by_surname": sa.select(Customer).where(Customer.surname == "Smith"),
+    "rooms_by_location": sa.select(Rooms).where(Rooms.location == "United Kingdom"),
+    "deal_for_room": sa.select(Deals).where(Deals.room_name == "Deluxe Room"),
+    "bookings_overlapping_stay": sa.select(Booking.booking_number).where(
+        Booking.room_selection == "Deluxe Room",
+        Booking.location == "United Kingdom",
+        Booking.check_in < SAMPLE_NEXT_WEEK,
+        Booking.check_out > SAMPLE_DAY,
+    ),
+    "bookings_checking_in_between": sa.select(Booking).where(
+        Booking.check_in >= SAMPLE_DAY, Booking.check_in < SAMPLE_NEXT_WEEK
+    ),
+    "room_nights_for_stay": sa.select(sa.func.max(RoomNight.booked)).where(
+        RoomNight.location == "United Kingdom",
+        RoomNight.room_name == "Deluxe Room",
+        RoomNight.night >= SAMPLE_DAY,
+        RoomNight.night < SAMPLE_NEXT_WEEK,
+    ),
+    "room_nights_for_location": sa.select(RoomNight.room_name, sa.func.max(RoomNight.booked)).where(
+        RoomNight.location == "United Kingdom",
+        RoomNight.night >= SAMPLE_DAY,
+        RoomNight.night < SAMPLE_NEXT_WEEK,
+    ).group_by(RoomNight.room_name),
+    "search_page_by_price": search_statement(
+        "United Kingdom", SAMPLE_DAY, SAMPLE_NEXT_WEEK, SearchFilters(), after=(20, "Premium Room")
+    ),
+    "search_page_by_size": search_statement(
+        "United Kingdom", SAMPLE_DAY, SAMPLE_NEXT_WEEK, SearchFilters(sort="size_desc"), after=(30, "Exclusive Room")
+    ),
+    "report_for_period": report_statement(SAMPLE_DAY, SAMPLE_NEXT_WEEK, ("night", "room_name")),
+    "next_job": next_job_statement(date(2030, 1, 1)),
+    "next_job_due": next_due_statement(),
+    "stays_to_archive": due_statement(SAMPLE_DAY),
+}
+
+FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})  # <-- IN (...) as one ? per value
+    params = compiled.construct_params()
+    values = tuple(
+        params[name].isoformat() if isinstance(params[name], date) else params[name]
+        for name in compiled.positiontup
+    )
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", values).all()
+    return [row[-1] for row in rows]  # <-- the last column is the readable plan step
+
+
+def check_query_plans(engine=None, queries=HOT_QUERIES):
+    """Returns {query name: plan steps} for every hot query that scans a full table.
+
+    Without an engine the plans come from an empty in-memory database built from
+    models.py, which checks the declared indexes without depending on how much data
+    (or which ANALYZE statistics) a particular database happens to have.
+    """
+    if engine is None:
+        engine = sa.create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+    offenders = {}
+    with engine.connect() as connection:
+        for name, statement in queries.items():
+            plan = explain(connection, statement)
+            if any(FULL_SCAN.match(step) for step in plan):
+                offenders[name] = plan
+    return offenders
@@ -0,0 +1,265 @@
+import random
+import re
+import threading
+from array import array
+from dataclasses import dataclass
+from datetime import timedelta
+from types import MappingProxyType
+from typing import Mapping
+
+import sqlalchemy as sa
+
+from models import RoomNight
+
+
+# Prices for many stays at once. The catalog is turned into a PriceTable of flat
+# columns (one array entry per room, one per meal deal) and a batch of stays is three
+# more columns of the same length, so pricing a whole year of stays is one pass over
+# plain integers instead of one room_deal_condition() call per stay.
+
+BUNDLE_NIGHTS = re.compile(r"(\d+)\s*nights?", re.IGNORECASE)
+
+CHEAPEST_DATES_WINDOW = 14
+
+
+def bundle_nights(deal):
+    # "7 nights" -> 7, a deal without a readable number of nights never applies
+    match = BUNDLE_NIGHTS.search(deal.nights or "")
+    return int(match.group(1)) if match else 0
+
+
+def bundle_applies(nights, deal):
+    # a room without a row in the Deals table (Standard Room) never gets a bundle price
+    return deal is not None and nights == bundle_nights(deal)
+
+
+@dataclass(frozen=True)
+class PriceTable:
+    room_names: tuple
+    meal_deal_names: tuple
+    night_prices: array  # <-- price_per_night of every room
+    bundle_nights: array  # <-- length of the room's bundle, 0 when it has none
+    bundle_prices: array  # <-- new_price of the room's bundle
+    meal_deal_prices: array
+    room_index: Mapping[str, int]
+    meal_deal_index: Mapping[str, int]
+    version: int
+
+
+@dataclass(frozen=True)
+class Stays:
+    rooms: array  # <-- indexes into PriceTable.room_names
+    meal_deals: array  # <-- indexes into PriceTable.meal_deal_names
+    nights: array
+
+    def __len__(self):
+        return len(self.nights)
+
+
+@dataclass(frozen=True)
+class DateQuote:
+    check_in: object
+    check_out: object
+    room_name: str
+    price: int
+
+
+def build_price_table(snapshot) -> PriceTable:
+    room_names = tuple(room.room_name for room in snapshot.rooms)
+    bundles = []
+    for room in snapshot.rooms:
+        deal = snapshot.deal_for_room(room.room_name)
+        if deal is not None:
+            bundles.append((bundle_nights(deal), deal.new_price))
+        else:
+            bundles.append((0, 0))
+    return PriceTable(
+        room_names=room_names,
+        meal_deal_names=tuple(meal_deal.meal_deal_name for meal_deal in snapshot.meal_deals),
+        night_prices=array("q", (room.price_per_night for room in snapshot.rooms)),
+        bundle_nights=array("i", (length for length, _ in bundles)),
+        bundle_prices=array("q", (price for _, price in bundles)),
+        meal_deal_prices=array("q", (meal_deal.meal_deal_price for meal_deal in snapshot.meal_deals)),
+        room_index=MappingProxyType({name: index for index, name in enumerate(room_names)}),
+        meal_deal_index=MappingProxyType({
+            meal_deal.meal_deal_name: index for index, meal_deal in enumerate(snapshot.meal_deals)
+        }),
+        version=snapshot.version,
+    )
+
+
+_latest = (None, None)  # <-- (snapshot, its table), older snapshots are never priced again
+_latest_lock = threading.Lock()
+
+
+def price_table(snapshot) -> PriceTable:
+    # one table per catalog snapshot, rebuilt when the catalog cache loads a new one
+    global _latest
+    cached_snapshot, table = _latest
+    if cached_snapshot is not snapshot:
+        table = build_price_table(snapshot)
+        with _latest_lock:
+            _latest = (snapshot, table)
+    return table
+
+
+def make_stays(table, stays) -> Stays:
+    # stays are (room_name, meal_deal_name, nights) tuples
+    rooms, meal_deals, nights = array("i"), array("i"), array("i")
+    for room_name, meal_deal_name, stay_length in stays:
+        rooms.append(table.room_index[room_name])
+        meal_deals.append(table.meal_deal_index[meal_deal_name])
+        nights.append(stay_length)
+    return Stays(rooms, meal_deals, nights)
+
+
+def quote(table, stays) -> array:
+    """Returns the total price of every stay, in the same order as the stays.
+
+    Same rule as room_deal_condition(): the meal deal is paid per night and the room
+    either per night or, for a stay exactly as long as its bundle, at the bundle price.
+    """
+    night_prices = table.night_prices
+    bundle_lengths = table.bundle_nights
+    bundle_prices = table.bundle_prices
+    meal_deal_prices = table.meal_deal_prices
+    return array("q", (
+        meal_deal_prices[meal_deal] * nights
+        + (bundle_prices[room] if nights == bundle_lengths[room] else night_prices[room] * nights)
+        for room, meal_deal, nights in zip(stays.rooms, stays.meal_deals, stays.nights)
+    ))
+
+
+def quote_grid(table, max_nights):
+    """Prices every room x meal deal x length of stay from 1 to max_nights.
+
+    Returns the stays and their prices. Prices don't depend on the check-in date, so
+    this grid covers every check-in date of any window.
+    """
+    room_count, meal_deal_count = len(table.room_names), len(table.meal_deal_names)
+    per_room = meal_deal_count * max_nights
+    size = room_count * per_room
+    stays = Stays(
+        rooms=array("i", (index // per_room for index in range(size))),
+        meal_deals=array("i", (index // max_nights % meal_deal_count for index in range(size))),
+        nights=array("i", (index % max_nights + 1 for index in range(size))),
+    )
+    return stays, quote(table, stays)
+
+
+def booked_by_room(db_session, location, start, end):
+    # {room_name: array of booked units for every night in [start, end)}
+    days = (end - start).days
+    booked = {}
+    rows = db_session.execute(
+        sa.select(RoomNight.room_name, RoomNight.night, RoomNight.booked).where(
+            RoomNight.location == location,
+            RoomNight.night >= start,
+            RoomNight.night < end,
+        )
+    )
+    for room_name, night, count in rows:
+        booked.setdefault(room_name, array("i", bytes(4 * days)))[(night - start).days] = count
+    return booked
+
+
+def cheapest_dates(db_session, snapshot, location, start, nights, meal_deal_name, days=CHEAPEST_DATES_WINDOW):
+    """The cheapest available room for a stay of `nights` checking in on each of `days` days.
+
+    One query reads the occupancy of the whole window. A date with nothing available
+    is returned with room_name and price set to None.
+    """
+    rooms = snapshot.rooms_in(location)
+    table = price_table(snapshot)
+    meal_deal = snapshot.meal_deal(meal_deal_name)
+    if not rooms or meal_deal is None or nights < 1:
+        return []
+    prices = quote(table, make_stays(table, [(room.room_name, meal_deal_name, nights) for room in rooms]))
+    cheapest_first = sorted(zip(prices, (room.room_name for room in rooms)))
+    booked = booked_by_room(db_session, location, start, start + timedelta(days=days + nights - 1))
+
+    calendar = []
+    for offset in range(days):
+        check_in = start + timedelta(days=offset)
+        check_out = check_in + timedelta(days=nights)
+        found = DateQuote(check_in, check_out, None, None)
+        for price, room_name in cheapest_first:
+            room_booked = booked.get(room_name)
+            most_booked = max(room_booked[offset:offset + nights]) if room_booked else 0
+            if snapshot.units(room_name, location) - most_booked >= 1:
+                found = DateQuote(check_in, check_out, room_name, price)
+                break
+        calendar.append(found)
+    return calendar
+
+
+def original_price(room, nights, meal_deal, room_deal):
+    # room_deal_condition() as it was written before the bundle rule came from the Deals table
+    if nights == 7 and room.room_name != "Standard Room" and room_deal is not None:
+        return meal_deal.meal_deal_price * nights + room_deal.new_price
+    return meal_deal.meal_deal_price * nights + room.price_per_night * nights
+
+
+def reference_price(room, nights, meal_deal, room_deal):
+    # the rule of the Deals table written out again without bundle_nights() or bundle_applies():
+    # the room is paid per night, or at new_price for a stay exactly as long as the deal's "N nights"
+    words = (room_deal.nights or "").split() if room_deal is not None else []
+    length = int(words[0]) if words and words[0].isdigit() else 0
+    if room_deal is not None and nights == length:
+        return meal_deal.meal_deal_price * nights + room_deal.new_price
+    return meal_deal.meal_deal_price * nights + room.price_per_night * nights
+
+
+def check_quotes(snapshot, reference, max_nights=60, samples=10000, seed=0):
+    """Compares quote() with one-stay prices and returns the mismatches.
+
+    Every room x meal deal x length of stay of the real catalog is checked against
+    ``reference`` (room_deal_condition) and reference_price(), and against
+    original_price() as long as every deal of the catalog is a 7 night one. Then
+    `samples` random stays against random catalogs whose deals have other bundle
+    lengths and prices, where Standard Room never has a deal row: against
+    reference_price(), and original_price() for the catalogs with 7 night deals only.
+    """
+    mismatches = []
+
+    def compare(catalog, stays, references):
+        table = build_price_table(catalog)
+        prices = quote(table, make_stays(table, stays))
+        for (room_name, meal_deal_name, nights), price in zip(stays, prices):
+            arguments = (catalog.room(room_name), nights, catalog.meal_deal(meal_deal_name), catalog.deal_for_room(room_name))
+            for expected in {one_stay(*arguments) for one_stay in references}:
+                if expected != price:
+                    mismatches.append((room_name, meal_deal_name, nights, expected, price))
+
+    def seven_nights_only(catalog):
+        return all(deal.nights == "7 nights" and deal.room_name != "Standard Room" for deal in catalog.deals)
+
+    compare(snapshot, [
+        (room.room_name, meal_deal.meal_deal_name, nights)
+        for room in snapshot.rooms
+        for meal_deal in snapshot.meal_deals
+        for nights in range(1, max_nights + 1)
+    ], [reference, reference_price] + ([original_price] if seven_nights_only(snapshot) else []))
+
+    from catalog import DealInfo, MealDealInfo, RoomInfo, build_snapshot  # <-- catalog imports nothing from here
+
+    rng = random.Random(seed)
+    room_names = ["Standard Room", "Premium Room", "Exclusive Room", "Deluxe Room", "Family Room"]
+    for round_number in range(max(samples // 100, 1)):
+        lengths = ["7 nights"] if round_number % 2 else ["1 night", "3 nights", "7 nights", "14 nights", "a week"]
+        rooms = [
+            RoomInfo(name, rng.randint(1, 500), "", "", "", "United Kingdom", "")
+            for name in rng.sample(room_names, rng.randint(1, len(room_names)))
+        ]
+        meal_deals = [MealDealInfo(f"Meal {index}", rng.randint(0, 50)) for index in range(rng.randint(1, 3))]
+        deals = [
+            DealInfo(f"{room.room_name} Bundle", "London, UK", room.room_name, rng.choice(lengths),
+                     rng.randint(1, 2000), rng.randint(1, 2000))
+            for room in rooms if room.room_name != "Standard Room" and rng.random() < 0.7
+        ]
+        catalog = build_snapshot(rooms, meal_deals, deals)
+        compare(catalog, [
+            (rng.choice(rooms).room_name, rng.choice(meal_deals).meal_deal_name, rng.randint(1, max_nights))
+            for _ in range(100)
+        ], [reference_price] + ([original_price] if seven_nights_only(catalog) else []))
+    return mismatches
@@ -0,0 +1,226 @@
+import csv
+import heapq
+import io
+import itertools
+from datetime import timedelta
+
+import sqlalchemy as sa
+
+from models import Booking, DailyRevenue
+from persistence import batched, upsert_statement
+
+
+# Occupancy and revenue reports. Every booking adds its nights to daily_revenue (one
+# row per night, location, room type and meal deal) in the same transaction that
+# books, moves or cancels it, so a report over a year reads a few thousand small rows
+# instead of grouping the whole booking table.
+
+DIMENSIONS = {
+    "night": DailyRevenue.night,
+    "location": DailyRevenue.location,
+    "room_name": DailyRevenue.room_name,
+    "meal_deal": DailyRevenue.meal_deal,
+}
+DEFAULT_GROUP_BY = ("location", "room_name")
+MEASURES = ("rooms_sold", "available", "occupancy", "revenue", "adr", "arrivals")
+CSV_FLUSH_ROWS = 500  # <-- rows written to the response at a time
+
+
+def nightly_amounts(total_price, nights):
+    # the price spread over the nights, the first nights take the remainder so the sum is exact
+    share, remainder = divmod(total_price, nights)
+    return [share + (1 if index < remainder else 0) for index in range(nights)]
+
+
+def revenue_deltas(stays, sign=1):
+    """{(night, location, room_name, meal_deal): [rooms_sold, revenue, arrivals]} for the stays.
+
+    stays are (room_name, location, meal_deal, check_in, check_out, total_price) tuples,
+    sign=-1 gives the deltas that take them out again.
+    """
+    deltas = {}
+    for room_name, location, meal_deal, check_in, check_out, total_price in stays:
+        nights = (check_out - check_in).days
+        if nights < 1:
+            continue
+        for offset, amount in enumerate(nightly_amounts(total_price, nights)):
+            delta = deltas.setdefault((check_in + timedelta(days=offset), location, room_name, meal_deal), [0, 0, 0])
+            delta[0] += sign
+            delta[1] += sign * amount
+            delta[2] += sign if offset == 0 else 0
+    return deltas
+
+
+def booking_stay(booking):
+    return (booking.room_selection, booking.location, booking.meal_deal,
+            booking.check_in, booking.check_out, booking.total_price)
+
+
+def add_revenue(db_session, deltas):
+    if not deltas:
+        return
+    statement = upsert_statement(db_session, DailyRevenue)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DailyRevenue.night, DailyRevenue.location, DailyRevenue.room_name, DailyRevenue.meal_deal],
+        set_={
+            "rooms_sold": DailyRevenue.rooms_sold + statement.excluded.rooms_sold,
+            "revenue": DailyRevenue.revenue + statement.excluded.revenue,
+            "arrivals": DailyRevenue.arrivals + statement.excluded.arrivals,
+        },
+    )
+    db_session.execute(statement, [
+        {"night": night, "location": location, "room_name": room_name, "meal_deal": meal_deal,
+         "rooms_sold": rooms_sold, "revenue": revenue, "arrivals": arrivals}
+        for (night, location, room_name, meal_deal), (rooms_sold, revenue, arrivals) in deltas.items()
+    ])
+
+
+def record_booking(db_session, booking, sign=1):
+    # called by bookings.py inside the transaction that writes the booking
+    add_revenue(db_session, revenue_deltas([booking_stay(booking)], sign))
+
+
+def rebuild_reports(db_session, batch_size=5000, since=None):
+    # recomputes daily_revenue from the booking table, only needed once for an existing database;
+    # with since only the nights from then on, the ones before may belong to archived bookings
+    delete = sa.delete(DailyRevenue)
+    statement = sa.select(Booking.room_selection, Booking.location, Booking.meal_deal,
+                          Booking.check_in, Booking.check_out, Booking.total_price)
+    if since is not None:
+        delete = delete.where(DailyRevenue.night >= since)
+        statement = statement.where(Booking.check_out > since)
+    db_session.execute(delete)
+    rows = db_session.execute(statement.execution_options(yield_per=batch_size))
+    deltas = {}
+    for batch in batched(rows, batch_size):
+        for key, (rooms_sold, revenue, arrivals) in revenue_deltas(batch).items():
+            if since is not None and key[0] < since:
+                continue
+            total = deltas.setdefault(key, [0, 0, 0])
+            total[0] += rooms_sold
+            total[1] += revenue
+            total[2] += arrivals
+    add_revenue(db_session, deltas)
+    return len(deltas)
+
+
+def parse_group_by(value):
+    # "night,room_name" -> ("night", "room_name") in the order of DIMENSIONS
+    names = [name.strip() for name in (value or "").split(",") if name.strip()] or list(DEFAULT_GROUP_BY)
+    unknown = [name for name in names if name not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"unknown report columns: {', '.join(unknown)}")
+    return tuple(name for name in DIMENSIONS if name in names)
+
+
+def report_statement(start, end, group_by=DEFAULT_GROUP_BY, location=None):
+    columns = [DIMENSIONS[name] for name in group_by]
+    statement = (
+        sa.select(*columns,
+                  sa.func.sum(DailyRevenue.rooms_sold).label("rooms_sold"),
+                  sa.func.sum(DailyRevenue.revenue).label("revenue"),
+                  sa.func.sum(DailyRevenue.arrivals).label("arrivals"))
+        .where(DailyRevenue.night >= start, DailyRevenue.night < end)
+        .group_by(*columns)
+        .having(sa.func.sum(DailyRevenue.rooms_sold) > 0)  # <-- nights whose bookings were all cancelled
+        .order_by(*columns)
+    )
+    if location:
+        statement = statement.where(DailyRevenue.location == location)
+    return statement
+
+
+def units_by_group(snapshot, group_by, location=None):
+    # rooms available per group, from the inventory in the catalog snapshot
+    keys = [name for name in group_by if name in ("location", "room_name")]
+    units = {}
+    for (room_name, room_location), count in snapshot.inventory.items():
+        if location and room_location != location:
+            continue
+        values = {"location": room_location, "room_name": room_name}
+        key = tuple(values[name] for name in keys)
+        units[key] = units.get(key, 0) + count
+    return keys, units
+
+
+def report_totals(db_session, start, end, group_by=DEFAULT_GROUP_BY, location=None, batch_size=1000):
+    # rooms sold, revenue and arrivals per group in group order, fetched batch_size rows at a time
+    return db_session.execute(
+        report_statement(start, end, group_by, location).execution_options(yield_per=batch_size)
+    ).mappings()
+
+
+def merge_totals(partials, group_by=DEFAULT_GROUP_BY):
+    """Adds up the report_totals() of several partitions, in group order.
+
+    A location is only ever in one partition, but a report that isn't split by
+    location has the same groups (nights, room types) in each of them. Every
+    partition's rows already come in group order, so they are merged as they
+    arrive and only the current row of each partition is held.
+    """
+    def group(row):
+        return tuple(row[name] for name in group_by)
+
+    # the database sorts strings by code point (SQLite's BINARY collation), the same order as Python
+    for key, rows in itertools.groupby(heapq.merge(*partials, key=group), key=group):
+        rooms_sold = revenue = arrivals = 0
+        for row in rows:
+            rooms_sold += row["rooms_sold"]
+            revenue += row["revenue"]
+            arrivals += row["arrivals"]
+        yield dict(zip(group_by, key), rooms_sold=rooms_sold, revenue=revenue, arrivals=arrivals)
+
+
+def iter_report(db_session, snapshot, start, end, group_by=DEFAULT_GROUP_BY, location=None, batch_size=1000):
+    """Yields one dict per group: the group columns, then rooms sold, available room
+    nights, occupancy, revenue, ADR (revenue per room sold) and arrivals.
+
+    Rows are fetched from the database batch_size at a time. Occupancy is left empty
+    when the report is split by meal deal, a room is not sold per meal deal.
+    """
+    rows = report_totals(db_session, start, end, group_by, location, batch_size)
+    return report_measures(rows, snapshot, start, end, group_by, location)
+
+
+def report_measures(rows, snapshot, start, end, group_by=DEFAULT_GROUP_BY, location=None):
+    # the rows of report_totals() or merge_totals() with the measures worked out from them
+    unit_keys, units = units_by_group(snapshot, group_by, location)
+    nights_per_group = 1 if "night" in group_by else (end - start).days
+    for row in rows:
+        values = {name: row[name] for name in group_by}
+        rooms_sold, revenue = row["rooms_sold"], row["revenue"]
+        available = None
+        occupancy = None
+        if "meal_deal" not in group_by:
+            available = units.get(tuple(values[name] for name in unit_keys), 0) * nights_per_group
+            occupancy = round(rooms_sold / available, 4) if available else None
+        values.update(
+            rooms_sold=rooms_sold,
+            available=available,
+            occupancy=occupancy,
+            revenue=revenue,
+            adr=round(revenue / rooms_sold, 2),
+            arrivals=row["arrivals"],
+        )
+        yield values
+
+
+def iter_csv(rows, columns, flush_rows=CSV_FLUSH_ROWS):
+    """Turns an iterable of dicts into CSV text chunks, the header first.
+
+    Only flush_rows rows are held at a time, so a response built on this never keeps
+    the whole report in memory.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= flush_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
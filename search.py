@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import sqlalchemy as sa
+
+from models import RoomInventory, RoomNight, Rooms
+
+
+# The search results page: filters and the sort order become WHERE and ORDER BY on the
+# rooms table, and pages are fetched with a keyset ("after this price and room name")
+# instead of OFFSET, so page 50 reads as few index entries as page 1.
+
+SEARCH_PAGE_SIZE = 10
+
+SORT_COLUMNS = {  # <-- sort name -> (column, descending), room_name breaks ties
+    "price": (Rooms.price_per_night, False),
+    "price_desc": (Rooms.price_per_night, True),
+    "size": (Rooms.size_sqm, False),
+    "size_desc": (Rooms.size_sqm, True),
+}
+DEFAULT_SORT = "price"
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    bed: Optional[str] = None
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    people: Optional[int] = None  # <-- rooms that sleep at least this many
+    available_only: bool = True
+    sort: str = DEFAULT_SORT
+
+    def query_args(self):
+        # the filters as query string arguments, the ones left at their default are dropped
+        args = {name: getattr(self, name) for name in ("min_price", "max_price", "bed", "min_size", "max_size", "people")}
+        args = {name: value for name, value in args.items() if value not in (None, "")}
+        if not self.available_only:
+            args["show_full"] = "1"
+        if self.sort != DEFAULT_SORT:
+            args["sort"] = self.sort
+        return args
+
+
+@dataclass(frozen=True)
+class SearchPage:
+    rooms: list  # <-- (room_name, free units) in page order
+    next_cursor: Optional[str]
+
+
+def optional_int(args, name):
+    value = (args.get(name) or "").strip()
+    if not value:
+        return None
+    if not value.isdigit():
+        raise InvalidSearch(f"{name} must be a whole number")
+    return int(value)
+
+
+def parse_filters(args) -> SearchFilters:
+    sort = args.get("sort") or DEFAULT_SORT
+    if sort not in SORT_COLUMNS:
+        raise InvalidSearch(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    return SearchFilters(
+        min_price=optional_int(args, "min_price"),
+        max_price=optional_int(args, "max_price"),
+        bed=(args.get("bed") or "").strip() or None,
+        min_size=optional_int(args, "min_size"),
+        max_size=optional_int(args, "max_size"),
+        people=optional_int(args, "people"),
+        available_only=args.get("show_full") not in ("1", "on", "true"),
+        sort=sort,
+    )
+
+
+def encode_cursor(value, room_name):
+    return f"{value}:{room_name}"
+
+
+def decode_cursor(cursor):
+    # "<sort value>:<room name>" of the last room on the previous page
+    value, separator, room_name = (cursor or "").partition(":")
+    if not separator or not value.isdigit() or not room_name:
+        raise InvalidSearch("invalid page cursor")
+    return int(value), room_name
+
+
+def search_statement(location, check_in, check_out, filters, after=None, limit=SEARCH_PAGE_SIZE):
+    """One page of rooms in a location, with the units free on every night of the stay.
+
+    Returns room_name, the sort value and the free units. ``after`` is a decoded
+    cursor, the statement asks for one row more than the page to know if there is
+    a next one.
+    """
+    sort_column, descending = SORT_COLUMNS[filters.sort]
+    booked = (
+        sa.select(RoomNight.room_name, sa.func.max(RoomNight.booked).label("booked"))
+        .where(RoomNight.location == location, RoomNight.night >= check_in, RoomNight.night < check_out)
+        .group_by(RoomNight.room_name)
+        .subquery()
+    )
+    free_units = (sa.func.coalesce(RoomInventory.units, 0) - sa.func.coalesce(booked.c.booked, 0)).label("free_units")
+    statement = (
+        sa.select(Rooms.room_name, sort_column, free_units)
+        .outerjoin(RoomInventory, sa.and_(RoomInventory.room_name == Rooms.room_name, RoomInventory.location == Rooms.location))
+        .outerjoin(booked, booked.c.room_name == Rooms.room_name)
+        .where(Rooms.location == location)
+    )
+    if filters.min_price is not None:
+        statement = statement.where(Rooms.price_per_night >= filters.min_price)
+    if filters.max_price is not None:
+        statement = statement.where(Rooms.price_per_night <= filters.max_price)
+    if filters.bed:
+        statement = statement.where(Rooms.bed == filters.bed)
+    if filters.min_size is not None:
+        statement = statement.where(Rooms.size_sqm >= filters.min_size)
+    if filters.max_size is not None:
+        statement = statement.where(Rooms.size_sqm <= filters.max_size)
+    if filters.people is not None:
+        statement = statement.where(Rooms.capacity >= filters.people)
+    if filters.available_only:
+        statement = statement.where(free_units >= 1)
+    if after is not None:
+        key = sa.tuple_(sort_column, Rooms.room_name)
+        statement = statement.where(key < sa.tuple_(*after) if descending else key > sa.tuple_(*after))
+    if descending:
+        statement = statement.order_by(sort_column.desc(), Rooms.room_name.desc())
+    else:
+        statement = statement.order_by(sort_column, Rooms.room_name)
+    return statement.limit(limit + 1)
+
+
+def search_rooms(db_session, location, check_in, check_out, filters, cursor=None, limit=SEARCH_PAGE_SIZE) -> SearchPage:
+    after = decode_cursor(cursor) if cursor else None
+    rows = db_session.execute(search_statement(location, check_in, check_out, filters, after, limit)).all()
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return SearchPage([(room_name, max(free, 0)) for room_name, _, free in rows[:limit]], next_cursor)
+
+
+def bed_types(snapshot, location):
+    return sorted({room.bed for room in snapshot.rooms_in(location)})
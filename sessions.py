@@ -0,0 +1,174 @@
+import os
+import pickle
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSession, SessionInterface
+
+
+# Server-side sessions: the browser only gets a random session id in its cookie and the
+# values themselves (dates included, as real date objects) stay in a store on the server.
+
+SID_PATTERN = re.compile(r"[A-Za-z0-9_-]{43}")  # <-- what secrets.token_urlsafe(32) produces
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+
+
+class MemoryStore:
+    """Keeps sessions in this process, dropping the least recently used ones past max_entries.
+
+    Only suitable for a single worker, every worker has its own copy.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return dict(data)
+
+    def set(self, sid, data, expires_at):
+        with self._lock:
+            self._entries[sid] = (dict(data), expires_at)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class SQLiteStore:
+    """Keeps sessions in their own SQLite file so every worker on the host shares them.
+
+    Expired rows are deleted at most once every sweep_interval seconds, piggybacking
+    on a write.
+    """
+
+    def __init__(self, path, sweep_interval=300):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._next_sweep = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _connect(self):
+        # the file is only opened by the first request of each thread, building the app opens nothing
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)")
+        return connection
+
+    @property
+    def connection(self):
+        # one connection per thread, sqlite3 connections are not shared between threads
+        if getattr(self._local, "pid", None) != os.getpid():  # <-- a forked worker opens its own
+            self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, sid):
+        row = self.connection.execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires_at >= ?", (sid, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, sid, data, expires_at):
+        with self.connection as connection:
+            connection.execute(
+                "INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                (sid, pickle.dumps(dict(data), pickle.HIGHEST_PROTOCOL), expires_at),
+            )
+        if time.time() >= self._next_sweep:
+            self.sweep()
+
+    def delete(self, sid):
+        with self.connection as connection:
+            connection.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self):
+        self._next_sweep = time.time() + self.sweep_interval
+        with self.connection as connection:
+            return connection.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),)).rowcount
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SID_PATTERN.fullmatch(sid):
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.modified and session.sid:  # <-- the session was cleared
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        new_session = session.sid is None
+        if new_session:
+            session.sid = new_sid()
+        if session.modified or new_session:
+            expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+            self.store.set(session.sid, session, expires_at)
+        if new_session or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+                domain=domain,
+                path=path,
+            )
+
+
+def session_interface_from_config(config):
+    backend = config.get("SESSION_BACKEND", "sqlite")
+    if backend == "memory":
+        return ServerSideSessionInterface(MemoryStore(int(config.get("SESSION_MEMORY_MAX_ENTRIES", 10000))))
+    if backend == "sqlite":
+        return ServerSideSessionInterface(SQLiteStore(config.get("SESSION_SQLITE_PATH", "instance/sessions.db")))
+    raise ValueError(f"unknown SESSION_BACKEND {backend!r}, use 'sqlite' or 'memory'")
@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+
+
+# Clean-up jobs (expired holds, old idempotency keys) run on a daemon thread in every
+# worker process. The thread is started by the first request a process handles, so CLI
+# commands don't start one and a forked worker starts its own.
+
+logger = logging.getLogger("hotel.sweeper")
+
+DEFAULT_SWEEP_INTERVAL = 60
+
+
+class Sweeper:
+    def __init__(self, app=None, interval=DEFAULT_SWEEP_INTERVAL):
+        self.interval = interval
+        self.jobs = []
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["sweeper"] = self  # <-- "flask sweep" runs the jobs of the current application
+        self.interval = float(app.config.get("SWEEP_INTERVAL", self.interval))
+        if self.interval > 0:  # <-- SWEEP_INTERVAL=0 leaves it to "flask sweep" from cron
+            app.before_request(self.start)
+
+    def add(self, name, job):
+        # job() does one round of clean-up and returns how many rows it removed
+        self.jobs.append((name, job))
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        removed = {}
+        for name, job in self.jobs:
+            try:
+                removed[name] = job()
+            except Exception:
+                logger.exception("sweep failed", extra={"job": name})
+                continue
+            if removed[name]:
+                logger.info("swept", extra={"job": name, "removed": removed[name]})
+        return removed
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
@@ -0,0 +1,242 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+
+import sqlalchemy as sa
+
+from models import Job, utc_now
+
+
+# Work that follows a booking (the receipt, the confirmation message) runs on a few
+# worker threads instead of in the request. A job is a row in the jobs table, added in
+# the same transaction as the change it follows: it is never lost when a process dies,
+# and never run for a change that was rolled back. The workers of every process take
+# jobs from the table, a job that fails is tried again later with exponential backoff.
+# An idle worker only reads: the UPDATE that claims a job takes the SQLite write lock
+# the bookings wait on, so it only runs once a read has found a job that is due.
+
+logger = logging.getLogger("hotel.tasks")
+
+DEFAULT_WORKERS = 2
+POLL_SECONDS = 30.0  # <-- idle workers look for jobs queued by other processes this often, this process's own wake them at once
+LEASE_SECONDS = 300  # <-- a job still running after this long belonged to a worker that died and is run again
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 2.0  # <-- wait before the 2nd attempt, doubled for every attempt after it
+SHUTDOWN_SECONDS = 10  # <-- how long stop() waits for the running jobs
+DONE_RETENTION = 7 * 24 * 3600  # <-- finished jobs are kept a week, failed ones until someone looks at them
+
+_wake = threading.Event()  # <-- set when a transaction that queued jobs commits
+
+
+def enqueue(db_session, kind, payload, delay=0):
+    """Adds a job to db_session. It is queued when the caller commits, and dropped on rollback.
+
+    ``payload`` is JSON serialisable (dates become strings) and is all the handler gets.
+    """
+    now = utc_now()
+    db_session.add(Job(kind=kind, payload=json.dumps(payload, default=str), status="pending", attempts=0,
+                       run_after=now + timedelta(seconds=delay), created_at=now))
+    sa.event.listen(db_session, "after_commit", wake_workers, once=True)
+
+
+def wake_workers(*args):
+    _wake.set()
+
+
+def next_job_statement(now):
+    # the job a worker takes next: the oldest one due, or a running one whose lease has ended
+    return (
+        sa.select(Job.id)
+        .where(Job.status.in_(("pending", "running")), Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+        .limit(1)
+    )
+
+
+def next_due_statement():
+    # when the next job is due: a pending one's run_after, or when a running one's lease ends
+    return sa.select(sa.func.min(Job.run_after)).where(Job.status.in_(("pending", "running")))
+
+
+def backoff_seconds(attempts, base=BACKOFF_SECONDS):
+    # 2, 4, 8, ... seconds, +-25% so jobs that failed together don't all retry together
+    return base * 2 ** (attempts - 1) * random.uniform(0.75, 1.25)
+
+
+class JobQueue:
+    """The job handlers and the worker threads of this process.
+
+    Handlers are registered with ``@jobs.handler("kind")`` and called as
+    handler(payload) in an application context. A handler can run more than once
+    for the same job (a retry, a worker dying half way), so it must be safe to repeat.
+
+    ``sources`` returns the session factory of every database jobs are queued in
+    (one per partition), by default only ``session_factory``.
+    """
+
+    def __init__(self, session_factory, app=None, workers=DEFAULT_WORKERS, sources=None):
+        self.session_factory = session_factory
+        self.sources = sources or (lambda: [session_factory])
+        self.workers = workers
+        self.max_attempts = MAX_ATTEMPTS
+        self.lease_seconds = LEASE_SECONDS
+        self.poll_seconds = POLL_SECONDS
+        self.handlers = {}
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._turn = itertools.count()  # <-- which source run_next() looks at first, so none of them waits behind another
+        atexit.register(self.stop)  # <-- a worker process that is shutting down finishes its running jobs first
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["jobs"] = self
+        self.workers = int(app.config.get("JOB_WORKERS", self.workers))
+        self.max_attempts = int(app.config.get("JOB_MAX_ATTEMPTS", self.max_attempts))
+        self.poll_seconds = float(app.config.get("JOB_POLL_SECONDS", self.poll_seconds))
+        if self.workers > 0:  # <-- JOB_WORKERS=0 leaves the jobs to "flask run-jobs"
+            app.before_request(self.start)
+
+    def handler(self, kind):
+        def register(function):
+            self.handlers[kind] = function
+            return function
+        return register
+
+    def start(self, workers=None):
+        # started by the first request of every process, like the sweeper
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self._loop, name=f"jobs-{index}", daemon=True)
+                             for index in range(workers or self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=SHUTDOWN_SECONDS):
+        """Stops the workers once they have finished the job they are running."""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        _wake.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+        self._pid = None
+
+    def claim(self, session_factory=None):
+        # marks the next job as running in one UPDATE, two workers can't both get it
+        # the UPDATE only runs when a read found a job that is due, an idle worker takes no write lock
+        now = utc_now()
+        next_job = next_job_statement(now).with_for_update(skip_locked=True).scalar_subquery()
+        with (session_factory or self.session_factory)() as db_session:
+            if db_session.execute(next_job_statement(now)).scalar() is None:
+                return None
+            job = db_session.execute(
+                sa.update(Job)
+                .where(Job.id == next_job)
+                .values(status="running", attempts=Job.attempts + 1, run_after=now + timedelta(seconds=self.lease_seconds))
+                .returning(Job)
+                .execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
+            db_session.commit()
+        return job
+
+    def run_next(self):
+        """Runs the next job that is due, returns False when there was none."""
+        sources = self.sources()
+        first = next(self._turn) % len(sources)
+        for session_factory in sources[first:] + sources[:first]:
+            job = self.claim(session_factory)
+            if job is not None:
+                self.run(job, session_factory)
+                return True
+        return False
+
+    def run(self, job, session_factory=None):
+        started = time.perf_counter()
+        try:
+            handler = self.handlers.get(job.kind)
+            if handler is None:
+                raise LookupError(f"no handler for {job.kind} jobs")
+            if job.attempts > self.max_attempts:
+                raise RuntimeError("the worker running this job stopped before it finished")
+            with self.app.app_context():
+                handler(json.loads(job.payload))
+        except Exception as error:
+            logger.warning("job failed", exc_info=True, extra={"job": job.id, "kind": job.kind, "attempts": job.attempts})
+            self.finish(job, error, session_factory)
+        else:
+            self.finish(job, session_factory=session_factory)
+            logger.info("job done", extra={"job": job.id, "kind": job.kind,
+                                           "ms": round((time.perf_counter() - started) * 1000, 1)})
+
+    def finish(self, job, error=None, session_factory=None):
+        now = utc_now()
+        if error is None:
+            values = {"status": "done", "finished_at": now, "last_error": None}
+        elif job.attempts >= self.max_attempts:
+            values = {"status": "failed", "finished_at": now, "last_error": repr(error)}
+            logger.error("job given up", extra={"job": job.id, "kind": job.kind, "attempts": job.attempts})
+        else:
+            values = {"status": "pending", "run_after": now + timedelta(seconds=backoff_seconds(job.attempts)),
+                      "last_error": repr(error)}
+        with (session_factory or self.session_factory)() as db_session:
+            db_session.execute(sa.update(Job).where(Job.id == job.id).values(**values))
+            db_session.commit()
+
+    def idle_seconds(self):
+        # how long an idle worker waits: until the next job of any database is due (a retry,
+        # an ended lease), at most poll_seconds
+        now = utc_now()
+        wait = self.poll_seconds
+        for session_factory in self.sources():
+            with session_factory() as db_session:
+                due = db_session.execute(next_due_statement()).scalar()
+            if due is not None:
+                wait = min(wait, max((due - now).total_seconds(), 0.0))
+        return wait
+
+    def run_pending(self):
+        # runs every job that is due now in this thread, returns how many ran ("flask run-jobs --once")
+        count = 0
+        while self.run_next():
+            count += 1
+        return count
+
+    def sweep(self, now=None):
+        cutoff = (now or utc_now()) - timedelta(seconds=DONE_RETENTION)
+        deleted = 0
+        for session_factory in self.sources():
+            with session_factory() as db_session:
+                deleted += db_session.execute(
+                    sa.delete(Job).where(Job.status == "done", Job.finished_at < cutoff)
+                ).rowcount
+                db_session.commit()
+        return deleted
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                ran = self.run_next()
+                wait = 0 if ran else self.idle_seconds()
+            except Exception:
+                logger.exception("job worker error")  # <-- e.g. the database was locked for too long, try again later
+                ran, wait = False, self.poll_seconds
+            if not ran:
+                _wake.wait(wait)
+                _wake.clear()
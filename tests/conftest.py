@@ -0,0 +1,33 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.common import SyntheticConfig, load_app, seed_database
+
+
+# Every test gets the application on a small synthetic database of its own in tmp_path,
+# prepared the way "flask db-upgrade" does it (see benchmarks/common.py).
+
+TEST_CATALOG = SyntheticConfig(locations=2, rooms_per_location=4, bookings=200, units=5)
+
+
+@pytest.fixture
+def empty_hotel(tmp_path):
+    # the schema and the migrations, no rooms and no bookings
+    app, appmodule = load_app(str(tmp_path), JOB_WORKERS=0)
+    yield SimpleNamespace(app=app, module=appmodule, rooms=[], workdir=str(tmp_path))
+    appmodule.database.remove_session()
+    appmodule.database.dispose()
+    appmodule.archive.dispose()
+
+
+@pytest.fixture
+def hotel(empty_hotel):
+    empty_hotel.rooms = seed_database(empty_hotel.module, TEST_CATALOG)
+    return empty_hotel
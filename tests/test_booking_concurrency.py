@@ -0,0 +1,55 @@
+import threading
+from datetime import timedelta
+
+from availability import RoomUnavailable
+from benchmarks.common import MEAL_DEAL, first_stay_day
+from benchmarks.stress import check_consistency, run_stress, set_units
+
+
+# Several bookers at once for the last unit of a room: exactly one of them gets it,
+# the others are told the room is full, and the database agrees with itself after.
+
+BOOKERS = 6
+
+
+def test_only_one_booking_gets_the_last_unit(hotel):
+    room, appmodule = hotel.rooms[0], hotel.module
+    check_in = first_stay_day() + timedelta(days=1000)  # <-- past the seeded bookings
+    check_out = check_in + timedelta(days=3)
+    set_units(appmodule, room["room_name"], room["location"], 1)
+    start = threading.Barrier(BOOKERS)
+    numbers, refused, errors = [], [], []
+
+    def book():
+        with hotel.app.app_context():
+            snapshot = appmodule.catalog.get()
+            booked_room = snapshot.room(room["room_name"])
+            start.wait()  # <-- every booker reads the room as free before any of them books it
+            try:
+                booking = appmodule.create_booking(booked_room, snapshot.meal_deal(MEAL_DEAL), 3, 2, room["location"],
+                                                   check_in, check_out, snapshot.deal_for_room(booked_room.room_name))
+                numbers.append(booking.booking_number)
+            except RoomUnavailable:
+                refused.append(True)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                appmodule.database.remove_session()
+
+    threads = [threading.Thread(target=book) for _ in range(BOOKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(numbers) == 1
+    assert len(refused) == BOOKERS - 1
+    units, booked = check_consistency(appmodule, room["room_name"], room["location"], check_in, numbers)
+    assert units == 1 and set(booked.values()) == {1}
+
+
+def test_forked_workers_never_overbook(hotel):
+    # the stress benchmark at a small size, run_stress raises AssertionError when the checks fail
+    metrics = run_stress(hotel.app, hotel.module, hotel.rooms, workers=4, attempts=8)
+    assert metrics["bookings"]["booked"] + metrics["bookings"]["refused"] == 4 * 8
@@ -0,0 +1,23 @@
+import sqlalchemy as sa
+
+from models import Deals, Rooms
+
+
+# The deals page is cached as a whole, a deal it can't show a picture for must not take it down.
+
+
+def test_deals_without_a_room_picture_are_shown_without_one(hotel):
+    appmodule = hotel.module
+    pictured = hotel.rooms[1]["room_name"]
+    with appmodule.Session() as db_session:
+        db_session.add(Deals(deal_name="Ghost Bundle", room_location="London, UK", room_name="Ghost Room",
+                             nights="7 nights", new_price=1, old_price=2))  # <-- no such room
+        db_session.execute(sa.update(Rooms).where(Rooms.room_name == pictured).values(image_file_name=""))
+        db_session.commit()
+    appmodule.catalog.invalidate()
+
+    response = hotel.app.test_client().get("/Deals")
+
+    assert response.status_code == 200
+    assert b"Ghost Bundle" in response.data
+    assert b'src="/static/img/"' not in response.data
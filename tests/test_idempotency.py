@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+import sqlalchemy as sa
+
+from benchmarks.common import SyntheticConfig, first_stay_day, load_app, seed_database
+from models import IdempotencyKey
+
+
+# With DATABASE_PARTITIONS an idempotency key is kept in the partition the request books
+# in, next to the booking, so a location's writes never go through the main database.
+
+
+def key_count(partition):
+    with partition.Session() as db_session:
+        return db_session.scalar(sa.select(sa.func.count()).select_from(IdempotencyKey))
+
+
+def test_api_keys_are_kept_in_the_partition_of_the_booking(tmp_path):
+    app, appmodule = load_app(str(tmp_path), JOB_WORKERS=0, DATABASE_PARTITIONS={
+        "1": {"url": f"sqlite:///{tmp_path / 'uk.db'}", "locations": ["United Kingdom"]},
+    })
+    try:
+        rooms = seed_database(appmodule, SyntheticConfig(locations=2, rooms_per_location=2, bookings=0))
+        appmodule.partitions.sync_catalog()
+        room = next(room for room in rooms if room["location"] == "United Kingdom")
+        check_in = first_stay_day()
+        body = {"room": room["room_name"], "location": room["location"], "people": 2,
+                "check_in": check_in.isoformat(), "check_out": (check_in + timedelta(days=2)).isoformat(),
+                "customer": {"name": "Ann", "surname": "Lee", "email": "ann@example.com", "address": "1 Street",
+                             "telephone": "0123"}}
+        client = app.test_client()
+        first = client.post("/api/v1/bookings", json=body, headers={"Idempotency-Key": "k1"})
+        again = client.post("/api/v1/bookings", json=body, headers={"Idempotency-Key": "k1"})
+        number = first.json["booking_number"]
+        cancelled = client.delete(f"/api/v1/bookings/{number}?surname=Lee", headers={"Idempotency-Key": "k2"})
+
+        assert (first.status_code, again.status_code, cancelled.status_code) == (201, 201, 200)
+        assert again.json["booking_number"] == number
+        main, uk = appmodule.partitions.get(0), appmodule.partitions.get(1)
+        assert (key_count(main), key_count(uk)) == (0, 2)
+    finally:
+        appmodule.database.remove_session()
+        appmodule.database.dispose()
+        appmodule.archive.dispose()
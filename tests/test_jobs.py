@@ -0,0 +1,27 @@
+import sqlalchemy as sa
+
+from tasks import enqueue
+
+
+# The job workers of every process look for work in every partition: while nothing is
+# due they only read, the claiming UPDATE (and the write lock it takes) waits for a job.
+
+
+def job_writes(engine):
+    writes = []
+    sa.event.listen(engine, "before_cursor_execute",
+                    lambda connection, cursor, statement, *args: writes.append(statement)
+                    if statement.startswith("UPDATE jobs") else None)
+    return writes
+
+
+def test_idle_workers_only_read(hotel):
+    jobs = hotel.module.jobs
+    writes = job_writes(hotel.module.database.engine)
+    with hotel.module.Session() as db_session:
+        enqueue(db_session, "booking_confirmed", {"booking_number": 0}, delay=5)  # <-- like a retry, due in a few seconds
+        db_session.commit()
+
+    assert [jobs.run_next() for _ in range(3)] == [False, False, False]
+    assert writes == []
+    assert 0 < jobs.idle_seconds() <= 5 < jobs.poll_seconds  # <-- the worker sleeps until it is due, not a whole poll
@@ -0,0 +1,43 @@
+import os
+
+from flask import Flask
+
+from metrics import Metrics
+
+
+# /metrics behind several worker processes: a scrape reaching any of them shows what
+# all of them counted (METRICS_DIRECTORY), and only to a caller allowed to see it.
+
+
+def metrics_app(tmp_path, **config):
+    app = Flask(__name__)
+    app.config.update(METRICS_DIRECTORY=str(tmp_path / "metrics"), **config)
+    return app, Metrics(app)
+
+
+def sample(body, name):
+    return [line.split()[-1] for line in body.splitlines() if line.startswith(name + " ")]
+
+
+def test_metrics_add_up_every_worker(tmp_path):
+    app, metrics = metrics_app(tmp_path)
+    metrics.statements.inc(amount=2)
+    pid = os.fork()
+    if pid == 0:  # <-- another worker, forked like gunicorn's: it counts from 0 and writes its own file
+        try:
+            metrics.statements.inc(amount=5)
+            metrics.write_worker_file()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    body = app.test_client().get("/metrics").get_data(as_text=True)
+
+    assert sample(body, "hotel_sql_statements_total") == ["7"]
+    assert len(os.listdir(tmp_path / "metrics")) == 2
+
+
+def test_metrics_ask_for_permission(tmp_path):
+    app, metrics = metrics_app(tmp_path)
+    metrics.allowed = lambda: False
+    assert app.test_client().get("/metrics").status_code == 403
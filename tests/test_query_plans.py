@@ -0,0 +1,14 @@
+from query_plans import check_query_plans
+
+
+# The hot queries (query_plans.HOT_QUERIES) have to be answered from an index: on the
+# schema models.py declares, and on a database "flask db-upgrade" prepared. Both have
+# no data, so the plans show the indexes rather than the statistics of a tiny table.
+
+
+def test_hot_queries_use_an_index_on_the_declared_schema():
+    assert check_query_plans() == {}
+
+
+def test_hot_queries_use_an_index_on_an_upgraded_database(empty_hotel):
+    assert check_query_plans(empty_hotel.module.database.engine) == {}
@@ -0,0 +1,31 @@
+import os
+import shutil
+
+from benchmarks.common import REPO_ROOT, load_app
+from quotes import check_quotes
+
+
+# The batch quote engine (quotes.quote) against the one-stay price, room_deal_condition(),
+# and the reference prices in quotes.py, the same check as "flask check-quotes".
+
+
+def assert_quotes_agree(app, appmodule, samples):
+    with app.app_context():
+        mismatches = check_quotes(appmodule.catalog.get(), appmodule.room_deal_condition, samples=samples)
+    assert mismatches[:20] == [], f"{len(mismatches)} quotes differ from the one-stay prices"
+
+
+def test_quotes_agree_on_the_synthetic_catalog(hotel):
+    assert_quotes_agree(hotel.app, hotel.module, samples=2000)
+
+
+def test_quotes_agree_on_the_shipped_catalog(tmp_path):
+    # a copy of instance/Flora_Hotel.db, its Standard Room has no deal row
+    shutil.copy(os.path.join(REPO_ROOT, "instance", "Flora_Hotel.db"), tmp_path / "bench.db")
+    app, appmodule = load_app(str(tmp_path), JOB_WORKERS=0)
+    try:
+        assert_quotes_agree(app, appmodule, samples=100)
+    finally:
+        appmodule.database.remove_session()
+        appmodule.database.dispose()
+        appmodule.archive.dispose()
@@ -0,0 +1,25 @@
+# The reports and /metrics show revenue, ADR and occupancy: nobody sees them without
+# REPORTS_TOKEN, except on the debug server.
+
+PROTECTED = ("/reports", "/reports.csv", "/metrics")
+
+
+def statuses(app, **request_options):
+    client = app.test_client()
+    return [client.get(path, **request_options).status_code for path in PROTECTED]
+
+
+def test_reports_are_closed_without_a_token(hotel):
+    assert statuses(hotel.app) == [403, 403, 403]
+
+
+def test_reports_need_the_token_once_it_is_set(hotel):
+    hotel.app.config["REPORTS_TOKEN"] = "s3cret"
+    assert statuses(hotel.app) == [403, 403, 403]
+    assert statuses(hotel.app, query_string={"token": "s3cret"}) == [200, 200, 200]
+    assert statuses(hotel.app, headers={"Authorization": "Bearer s3cret"}) == [200, 200, 200]
+
+
+def test_the_debug_server_shows_the_reports(hotel):
+    hotel.app.debug = True
+    assert statuses(hotel.app) == [200, 200, 200]
@@ -0,0 +1,32 @@
+import gc
+import sqlite3
+
+from benchmarks.common import app_config
+
+
+# Building the application only reads config: no database, session store or admission
+# file is opened until the first request, so a preloading master forks its workers
+# without a connection they would share. preload() then fills the caches on a prepared
+# database and closes what it opened.
+
+
+def test_create_app_opens_no_database(tmp_path, monkeypatch):
+    import app as appmodule
+
+    opened = []
+    connect = sqlite3.connect
+    for module in (sqlite3, sqlite3.dbapi2):  # <-- SQLAlchemy connects through sqlite3.dbapi2, the stores through sqlite3
+        monkeypatch.setattr(module, "connect", lambda *arguments, **options: opened.append(arguments[0]) or connect(*arguments, **options))
+    appmodule.create_app(dict(app_config(str(tmp_path)), ADMISSION_ENABLED=True,
+                              ADMISSION_SQLITE_PATH=str(tmp_path / "admission.db")))
+    assert opened == []
+
+
+def test_preload_fills_the_caches_and_closes_the_database(hotel):
+    appmodule = hotel.module
+    try:
+        appmodule.preload(hotel.app)
+    finally:
+        gc.unfreeze()  # <-- what preload() froze is the test process's, not a master's
+    assert len(hotel.app.jinja_env.cache) > 0
+    assert appmodule.database._engine is None